@@ -2,3 +2,11 @@ from citylearn.agent import *
 from citylearn.citylearn import *
 from citylearn.gridlearn import *
 from citylearn.energy_models import *
+from citylearn.dataset import *
+from citylearn.upsampling import *
+from citylearn.step_engine import *
+from citylearn.power_flow import *
+from citylearn.recorder import *
+from citylearn.baseline import *
+from citylearn.metrics import *
+from citylearn.vec_env import *
@@ -0,0 +1,125 @@
+"""
+Cache of the baseline costs of the rule-based controller, which normalize the costs of CityLearn and GridLearn. The
+baseline of a configuration is simulated once: its costs are kept in memory for the process and, with a cache
+directory (cache_dir argument or CITYLEARN_CACHE_DIR), on disk for all the processes:
+
+    <cache_dir>/baseline/<key>.json
+
+The key is a hash of the configuration, which includes a hash of the content of the data files. Processes that need
+the same baseline at the same time wait on a file lock for the first one to simulate it, instead of simulating it too.
+"""
+import os
+import json
+import hashlib
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager
+from citylearn.dataset import get_cache_dir
+
+try:
+    import fcntl
+except ImportError:
+    # No file locking (e.g. on Windows): concurrent processes may simulate the same baseline, the entries are still written atomically
+    fcntl = None
+
+# Version of the baseline costs. Bump it whenever the simulation of the rule-based controller or the costs change.
+BASELINE_VERSION = 2
+
+# Baseline costs of the process, keyed by the key of their configuration
+_BASELINE_CACHE = {}
+
+# Hashes of the content of the data files, keyed by (path, mtime, size)
+_FILE_HASHES = {}
+
+def hash_file(path):
+    """ Returns the sha256 hash of the content of a file. It is computed once per process for every version of the file. """
+    path = Path(path).resolve()
+    stat = os.stat(path)
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+    if key not in _FILE_HASHES:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as source:
+            for block in iter(lambda: source.read(1 << 20), b''):
+                digest.update(block)
+        _FILE_HASHES[key] = digest.hexdigest()
+    return _FILE_HASHES[key]
+
+def get_baseline_key(config):
+    """ Returns the key of the baseline costs of a configuration. The values of config that are files (see CityLearn.get_baseline_config) must be given under 'files' """
+    config = dict(config, files={name: hash_file(path) for name, path in config.get('files', {}).items()}, version=BASELINE_VERSION)
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+@contextmanager
+def file_lock(path):
+    """ Holds an exclusive lock on a file, shared by all the processes """
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _read_baseline(path, key):
+    try:
+        with open(path) as json_file:
+            entry = json.load(json_file)
+        if entry['key'] == key:
+            return entry['cost']
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def _write_baseline(path, key, config, cost):
+    # The entry is written into a temporary file which is then moved in place, so that other processes never read a partially written entry
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + path.stem + '_', dir=path.parent)
+    try:
+        with os.fdopen(fd, 'w') as json_file:
+            json.dump({'key': key, 'config': config, 'cost': cost}, json_file, default=str)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def find_baseline_cost(config, cache_dir=None):
+    """ Returns the cached baseline costs of a configuration, from the cache of the process or from the on-disk cache, or None if they are not cached """
+    key = get_baseline_key(config)
+    if key in _BASELINE_CACHE:
+        return dict(_BASELINE_CACHE[key])
+    cache_dir = get_cache_dir(cache_dir)
+    if cache_dir is None:
+        return None
+    return _read_baseline(cache_dir / 'baseline' / (key + '.json'), key)
+
+def get_baseline_cost(config, simulate, cache_dir=None):
+    """
+    Returns the baseline costs of a configuration, from the cache of the process, from the on-disk cache or by simulating them.
+    Args:
+        config (dict): everything the baseline depends on, with the data files under 'files'
+        simulate (function): simulates the rule-based controller and returns its costs, called if the baseline is not cached
+        cache_dir (str or Path): directory of the on-disk cache (see get_cache_dir)
+    """
+    key = get_baseline_key(config)
+    if key not in _BASELINE_CACHE:
+        cache_dir = get_cache_dir(cache_dir)
+        if cache_dir is None:
+            cost = simulate()
+        else:
+            path = cache_dir / 'baseline' / (key + '.json')
+            path.parent.mkdir(parents=True, exist_ok=True)
+            cost = _read_baseline(path, key)
+            if cost is None:
+                with file_lock(path.with_suffix('.lock')):
+                    # Another process may have simulated the baseline while this one was waiting for the lock
+                    cost = _read_baseline(path, key)
+                    if cost is None:
+                        cost = {name: float(value) for name, value in simulate().items()}
+                        _write_baseline(path, key, config, cost)
+        _BASELINE_CACHE[key] = {name: float(value) for name, value in cost.items()}
+    return dict(_BASELINE_CACHE[key])
+
+def clear_baseline_cache():
+    """ Clears the baseline costs kept in memory by the process (not the on-disk cache) """
+    _BASELINE_CACHE.clear()
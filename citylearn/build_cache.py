@@ -0,0 +1,33 @@
+"""
+Pre-builds the on-disk dataset cache used by building_loader, so that environments constructed afterwards (e.g. by the
+jobs of a parameter sweep) memory-map their interpolated series instead of parsing and interpolating the csv files.
+
+    python -m citylearn.build_cache citylearn/data/Climate_Zone_* --cache-dir /scratch/citylearn_cache --hourly-timesteps 1 6
+
+The environments must then be created with cache_dir=/scratch/citylearn_cache (or with the CITYLEARN_CACHE_DIR
+environment variable set).
+"""
+import argparse
+from citylearn.dataset import build_dataset_cache, get_cache_dir
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Pre-build the CityLearn dataset cache')
+    parser.add_argument('data_paths', nargs='+', help='climate zone directories (e.g. citylearn/data/Climate_Zone_1)')
+    parser.add_argument('--cache-dir', default=None, help='cache directory (defaults to $CITYLEARN_CACHE_DIR)')
+    parser.add_argument('--hourly-timesteps', type=int, nargs='+', default=[1], help='sub-hourly resolutions to build')
+    parser.add_argument('--building-ids', nargs='+', default=None, help='only build these buildings')
+    parser.add_argument('--building-attributes', default='building_attributes.json')
+    parser.add_argument('--weather-file', default='weather_data.csv')
+    parser.add_argument('--solar-profile', default='solar_generation_1kW.csv')
+    args = parser.parse_args(args)
+
+    cache_dir = get_cache_dir(args.cache_dir)
+    if cache_dir is None:
+        parser.error('no cache directory given: use --cache-dir or set CITYLEARN_CACHE_DIR')
+
+    for data_path in args.data_paths:
+        entries = build_dataset_cache(data_path, cache_dir, args.hourly_timesteps, args.building_ids, args.building_attributes, args.weather_file, args.solar_profile)
+        print(data_path + ': ' + str(len(entries)) + ' cache entries in ' + str(cache_dir))
+
+if __name__ == '__main__':
+    main()
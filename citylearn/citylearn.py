@@ -4,290 +4,414 @@ import numpy as np
 import pandas as pd
 import json
 import random, string
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from gym import spaces
 from citylearn.energy_models import HeatPump, ElectricHeater, EnergyStorage, Building
 from citylearn.reward_function import reward_function_sa, reward_function_ma
+from citylearn.dataset import SimulationData, load_building_series, build_sizing_series, heat_pump_cops, stack_stores
+from citylearn.upsampling import upsample, upsample_window
+from citylearn.step_engine import StepEngine, ActionLayout, is_supported
+from citylearn.observations import ObservationLayout, CENTRAL_AGENT_BUILDING_STATES
+from citylearn.baseline import get_baseline_cost, find_baseline_cost
+from citylearn.metrics import get_costs, CostAccumulator
 from pathlib import Path
 from citylearn.agent import RBC_Agent
 gym.logger.set_level(40)
 
-def auto_size(buildings):
+# Seed of the random draws of the environment (duplicated buildings, their random series and the houses of the grid)
+SEED = 12
+
+def _hourly_max(subhourly_data, hourly_divisor):
+    # Max of subhourly_data divided by hourly values that are kept during every sub-hourly time step, without repeating the hourly values
+    return (subhourly_data.reshape(len(hourly_divisor), -1)/hourly_divisor[:, np.newaxis]).max()
+
+def get_device_sizes(building, sim_results = None):
+    """ Returns the autosized (dhw_nominal_power, cooling_nominal_power, dhw_capacity, cooling_capacity) of a building (see auto_size), from the demands
+    of sim_results (by default the series of the building) """
+    if sim_results is None:
+        sim_results = building.sim_results
+    dhw_nominal_power = building.dhw_heating_device.nominal_power
+    cooling_nominal_power = building.cooling_device.nominal_power
+
+    # Autosize guarantees that the DHW device is large enough to always satisfy the maximum DHW demand
+    if dhw_nominal_power == 'autosize':
+
+        # If the DHW device is a HeatPump
+        if isinstance(building.dhw_heating_device, HeatPump):
+
+            #We assume that the heat pump is always large enough to meet the highest heating or cooling demand of the building
+            dhw_nominal_power = _hourly_max(sim_results['dhw_demand'], building.dhw_heating_device.cop_heating)
+
+        # If the device is an electric heater
+        elif isinstance(building.dhw_heating_device, ElectricHeater):
+            dhw_nominal_power = (sim_results['dhw_demand']/building.dhw_heating_device.efficiency).max()
+
+    # Autosize guarantees that the cooling device device is large enough to always satisfy the maximum DHW demand
+    if cooling_nominal_power == 'autosize':
+
+        cooling_nominal_power = _hourly_max(sim_results['cooling_demand'], building.cooling_device.cop_cooling)
+
+    # Defining the capacity of the storage devices as a number of times the maximum demand
+    dhw_capacity = sim_results['dhw_demand'].max()*building.dhw_storage.capacity
+    cooling_capacity = sim_results['cooling_demand'].max()*building.cooling_storage.capacity
+
+    # Done in order to avoid dividing by 0 if the capacity is 0
+    if dhw_capacity <= 0.00001:
+        dhw_capacity = 0.00001
+    if cooling_capacity <= 0.00001:
+        cooling_capacity = 0.00001
+
+    return dhw_nominal_power, cooling_nominal_power, dhw_capacity, cooling_capacity
+
+def auto_size(buildings, sizes = None):
+    """ Sizes the devices of the buildings. Before the DHW draws are made, the demands and the COPs of a building only depend on its prototype,
+    so if a dict sizes is given, the buildings created from the same prototype are sized once and their sizes are kept in sizes for the next ones """
     for building in buildings.values():
+        if sizes is None:
+            building_sizes = get_device_sizes(building)
+        else:
+            if building.buildingId not in sizes:
+                sizes[building.buildingId] = get_device_sizes(building)
+            building_sizes = sizes[building.buildingId]
 
-        # Autosize guarantees that the DHW device is large enough to always satisfy the maximum DHW demand
-        if building.dhw_heating_device.nominal_power == 'autosize':
+        building.dhw_heating_device.nominal_power, building.cooling_device.nominal_power, building.dhw_storage.capacity, building.cooling_storage.capacity = building_sizes
 
-            # If the DHW device is a HeatPump
-            if isinstance(building.dhw_heating_device, HeatPump):
+def set_dhw_draws(buildings, rng = None):
+    if rng is None:
+        rng = np.random.default_rng(np.random.randint(np.iinfo(np.int32).max))
+
+    for uid, building in buildings.items():
+        # Until the draws are made the DHW demand holds its hourly values repeated at every sub-hourly time step
+        hourly_dhw_demand = building.sim_results['dhw_demand'][::building.hourly_timesteps]
+        window = building.sim_results.window
+        if window is None:
+            building.sim_results['dhw_demand'] = upsample(hourly_dhw_demand, building.hourly_timesteps, 'randomdraw', power=building.dhw_heating_device.nominal_power, rng=rng)
+        else:
+            # The draws are made for all the hours (the demand is zero outside of the window) and only those of the window are kept, so that they are the same
+            # as when all the time steps are loaded
+            dhw_demand = np.array(building.sim_results['dhw_demand'])
+            dhw_demand[window[0]:window[1]] = upsample(hourly_dhw_demand, building.hourly_timesteps, 'randomdraw', power=building.dhw_heating_device.nominal_power, rng=rng)[window[0]:window[1]]
+            building.sim_results['dhw_demand'] = dhw_demand
+
+def get_simulation_window(simulation_period, hourly_timesteps):
+    """ Returns the range of time steps (start, stop) used by the episodes over simulation_period (see CityLearn.reset), in whole hours and with one more hour of margin """
+    return simulation_period[0]//hourly_timesteps*hourly_timesteps, (simulation_period[1] + 2)*hourly_timesteps
+
+# Series of a building that are drawn randomly for every building instead of being shared with its prototype
+RANDOMIZED_SERIES = ['dhw_demand', 'non_shiftable_load']
+
+def load_building_data(building, attributes, data_path, weather_file, solar_profile, hourly_timesteps, cache_dir = None, rng = None, window = None):
+    """ Loads the series of a building: the series of its prototype, which are shared with the other buildings, and its own random series drawn from rng.
+    If window = (start, stop) is given, only these time steps are loaded (see SimulationData) """
+    # The interpolated series are loaded once per prototype building (memory-mapped from the on-disk cache if there is one) and shared read-only by all its duplicates.
+    # Each building only stores the series that are randomized for every building. The DHW demand keeps its hourly value at every sub-hourly time step until the random draws are made (see set_dhw_draws)
+    series, hourly = load_building_series(data_path, building.buildingId, attributes, weather_file, solar_profile, hourly_timesteps, cache_dir = cache_dir, window = window)
+    building.sim_results = SimulationData(base = series, window = series.window)
+    if series.window is None:
+        building.sim_results.add_columns({'dhw_demand': upsample(hourly['dhw_demand'], hourly_timesteps, 'repeat'),
+                                          'non_shiftable_load': upsample(hourly['non_shiftable_load'], hourly_timesteps, 'noisy', rng=rng)})
+    else:
+        start, stop = series.window
+        randomized_series = {name: np.zeros(series.n_steps, dtype=np.float32) for name in RANDOMIZED_SERIES}
+        randomized_series['dhw_demand'][start:stop] = upsample_window(hourly['dhw_demand'], hourly_timesteps, series.window, 'repeat')
+        # The perturbations are drawn for all the hours (the hourly inputs are zero outside of the window), so that those of the window are the same as when all the time steps are loaded
+        randomized_series['non_shiftable_load'][start:stop] = upsample(hourly['non_shiftable_load'], hourly_timesteps, 'noisy', rng=rng)[start:stop]
+        building.sim_results.add_columns(randomized_series)
+
+def get_state_bounds(building, attributes, states):
+    """ Returns the lower and upper bounds (s_low, s_high) of the states of a building, from its series. The net electricity consumption bound uses
+    the storage capacities of the attributes (as a number of times the maximum demand), not the autosized ones """
+    s_low, s_high = [], []
+    for state_name, value in zip(states, states.values()):
+        if value == True:
+            if state_name == "net_electricity_consumption":
+                # lower and upper bounds of net electricity consumption are rough estimates and may not be completely accurate. Scaling this state-variable using these bounds may result in normalized values above 1 or below 0.
+                # The bound is accumulated in a single buffer to avoid allocating a temporary array per term
+                _net_elec_cons = np.subtract(building.sim_results['non_shiftable_load'], building.sim_results['solar_gen'])
+                _net_elec_cons += building.sim_results['dhw_demand']/np.float32(.8)
+                _net_elec_cons += building.sim_results['cooling_demand']
+                _net_elec_cons_upper_bound = _net_elec_cons.max() + attributes['DHW_Tank']['capacity']/.8 + attributes['Chilled_Water_Tank']['capacity']/2
+                s_low.append(0.)
+                s_high.append(_net_elec_cons_upper_bound)
+
+            elif state_name == "relative_voltage":
+                # @akp, added relative voltage to give homes their voltage ranked against the community max/min
+                s_low.append(0.) # the house is the lowest voltage in the community
+                s_high.append(1.)
+
+            elif state_name == "total_voltage_spread":
+                # @akp, added total voltage spread to give a sense of the total loss incurred by the community. without the total voltage spread state "relative_voltage" is more or less meaningless. (total_voltage_spread = how much the community is penaltized, relative_voltage = what that house can do to fix the issue)
+                s_low.append(0.) # @akp?, not sure what the typical spread in v pu would be.
+                s_high.append(1.)
+
+            elif state_name != 'cooling_storage_soc' and state_name != 'dhw_storage_soc':
+                # The bounds of the series shared with the prototype are computed once per prototype (and stored in the dataset cache)
+                low, high = building.sim_results.bounds(state_name)
+                s_low.append(low)
+                s_high.append(high)
 
-                #We assume that the heat pump is always large enough to meet the highest heating or cooling demand of the building
-                building.dhw_heating_device.nominal_power = np.array(building.sim_results['dhw_demand']/building.dhw_heating_device.cop_heating).max()
-
-            # If the device is an electric heater
-            elif isinstance(building.dhw_heating_device, ElectricHeater):
-                building.dhw_heating_device.nominal_power = (np.array(building.sim_results['dhw_demand'])/building.dhw_heating_device.efficiency).max()
-
-        # Autosize guarantees that the cooling device device is large enough to always satisfy the maximum DHW demand
-        if building.cooling_device.nominal_power == 'autosize':
-
-            building.cooling_device.nominal_power = (np.array(building.sim_results['cooling_demand'])/ np.repeat(building.cooling_device.cop_cooling, building.hourly_timesteps)).max()
-
-        # Defining the capacity of the storage devices as a number of times the maximum demand
-        building.dhw_storage.capacity = max(building.sim_results['dhw_demand'])*building.dhw_storage.capacity
-        building.cooling_storage.capacity = max(building.sim_results['cooling_demand'])*building.cooling_storage.capacity
-
-        # Done in order to avoid dividing by 0 if the capacity is 0
-        if building.dhw_storage.capacity <= 0.00001:
-            building.dhw_storage.capacity = 0.00001
-        if building.cooling_storage.capacity <= 0.00001:
-            building.cooling_storage.capacity = 0.00001
-
-def subhourly_lin_interp(hourly_data, subhourly_steps):
-    """ Returns a linear interpolation of a data array as a list """
-    n = len(hourly_data)
-    data = np.interp(np.linspace(0, n, n*subhourly_steps), np.arange(n), hourly_data)
-    return list(data)
-
-def subhourly_noisy_interp(hourly_data, subhourly_steps):
-    """ Returns a noisy distribution of power consumption +/- 5% standard deviation of the original power draw."""
-    n = len(hourly_data)
-    data = np.repeat(hourly_data, subhourly_steps)
-    perturbation = np.random.normal(1.0, 0.05, n*subhourly_steps)
-    data = np.multiply(data, perturbation)
-    return list(data)
-
-def subhourly_randomdraw_interp(hourly_data, subhourly_steps, dhw_pwr):
-    """ Returns a randomized binary distribution where demand = power*time when water is drawn, 0 otherwise.
-    Proportion of time with demand at full power corresponds to energy consumption at the hourly interval by E+ """
-    data = []
-    subhourly_dhw_energy = max(0.01, dhw_pwr / subhourly_steps)
-    for hour in hourly_data:
-        draw_times = np.random.choice(subhourly_steps, int(hour/subhourly_dhw_energy), replace=False)
-        for i in range(subhourly_steps):
-            if i in draw_times:
-                data += [subhourly_dhw_energy]
             else:
-                data += [0]
-    return list(data)
+                s_low.append(0.0)
+                s_high.append(1.0)
+
+    return s_low, s_high
+
+def create_building(uid, attributes, data_path, weather_file, solar_profile, buildings_states_actions, hourly_timesteps, save_memory = True, cache_dir = None, rng = None, cops = None, sizes = None, window = None):
+    """ Returns a building created from its prototype uid as a tuple (building, s_low, s_high, a_low, a_high), with the bounds of its states and actions.
+    All the random series of the building (non-shiftable load perturbations and DHW draws) are drawn from rng, so that the building only depends on its seed.
+    cops are the COPs of the heat pumps of the prototypes (see heat_pump_cops) and sizes the sizes of their devices (see auto_size), which are shared by all the buildings created by building_loader.
+    If window is given, only these time steps are loaded and the bounds of the states are those of the window. The devices are still sized from all the time steps (see build_sizing_series). """
+    if rng is None:
+        rng = np.random.default_rng(np.random.randint(np.iinfo(np.int32).max))
+
+    heat_pump = HeatPump(nominal_power = attributes['Heat_Pump']['nominal_power'],
+                         eta_tech = attributes['Heat_Pump']['technical_efficiency'],
+                         t_target_heating = attributes['Heat_Pump']['t_target_heating'],
+                         t_target_cooling = attributes['Heat_Pump']['t_target_cooling'], save_memory = save_memory)
+
+    electric_heater = ElectricHeater(nominal_power = attributes['Electric_Water_Heater']['nominal_power'],
+                                     efficiency = attributes['Electric_Water_Heater']['efficiency'], save_memory = save_memory)
+
+    chilled_water_tank = EnergyStorage(capacity = attributes['Chilled_Water_Tank']['capacity'],
+                                       loss_coeff = attributes['Chilled_Water_Tank']['loss_coefficient'], save_memory = save_memory)
+
+    dhw_tank = EnergyStorage(capacity = attributes['DHW_Tank']['capacity'],
+                             loss_coeff = attributes['DHW_Tank']['loss_coefficient'], save_memory = save_memory)
+
+    building = Building(buildingId = uid, hourly_timesteps=hourly_timesteps, dhw_storage = dhw_tank, cooling_storage = chilled_water_tank, dhw_heating_device = electric_heater, cooling_device = heat_pump, save_memory = save_memory)
+
+    load_building_data(building, attributes, data_path, weather_file, solar_profile, hourly_timesteps, cache_dir, rng, window)
+
+    # Hourly COPs of the heat pumps
+    if cops is None:
+        cops = heat_pump_cops(weather_file, {uid: attributes})
+    if isinstance(building.dhw_heating_device, HeatPump):
+        building.dhw_heating_device.cop_heating = cops[uid][0]
+    building.cooling_device.cop_cooling = cops[uid][1]
+
+    # Reading the building attributes
+    building.building_type = attributes['Building_Type']
+    building.climate_zone = attributes['Climate_Zone']
+    building.solar_power_capacity = attributes['Solar_Power_Installed(kW)']
+
+    # Finding the max and min possible values of all the states, which can then be used by the RL agent to scale the states and train any function approximators more effectively
+    s_low, s_high = get_state_bounds(building, attributes, buildings_states_actions[uid]['states'])
+
+    '''The energy storage (tank) capacity indicates how many times bigger the tank is compared to the maximum hourly energy demand of the building (cooling or DHW respectively), which sets a lower bound for the action of 1/tank_capacity, as the energy storage device can't provide the building with more energy than it will ever need for a given hour. The heat pump is sized using approximately the maximum hourly energy demand of the building (after accounting for the COP, see function autosize). Therefore, we make the fair assumption that the action also has an upper bound equal to 1/tank_capacity. This boundaries should speed up the learning process of the agents and make them more stable rather than if we just set them to -1 and 1. I.e. if Chilled_Water_Tank.Capacity is 3 (3 times the max. hourly demand of the building in the entire year), its actions will be bounded between -1/3 and 1/3'''
+    a_low, a_high = [], []
+    for action_name, value in zip(buildings_states_actions[uid]['actions'], buildings_states_actions[uid]['actions'].values()):
+        if value == True:
+            if action_name =='cooling_storage':
+
+                # Avoid division by 0
+                if attributes['Chilled_Water_Tank']['capacity'] > 0.000001:
+                    a_low.append(max(-1.0/attributes['Chilled_Water_Tank']['capacity'], -1.0))
+                    a_high.append(min(1.0/attributes['Chilled_Water_Tank']['capacity'], 1.0))
+                else:
+                    a_low.append(-1.0)
+                    a_high.append(1.0)
 
-def set_dhw_draws(buildings):
-    for uid, building in buildings.items():
-        building.sim_results['dhw_demand'] = subhourly_randomdraw_interp(building.sim_results['dhw_demand'], building.hourly_timesteps, building.dhw_heating_device.nominal_power)
+            elif action_name == 'dhw_storage':
+                if attributes['DHW_Tank']['capacity'] > 0.000001:
+                    a_low.append(max(-1.0/attributes['DHW_Tank']['capacity'], -1.0))
+                    a_high.append(min(1.0/attributes['DHW_Tank']['capacity'], 1.0))
+                else:
+                    a_low.append(-1.0)
+                    a_high.append(1.0)
+
+            elif action_name == 'pv_curtail':
+                # pv curtailment of apparent power, S
+                a_low.append(-1.0)
+                a_high.append(1.0)
+
+            elif action_name == 'pv_phi':
+                # smart inverter voltage control @constance?
+                a_low.append(-1.0)
+                a_high.append(1.0)
+
+    building.set_state_space(np.array(s_high), np.array(s_low))
+    building.set_action_space(np.array(a_high), np.array(a_low))
+
+    building.reset()
+
+    # In a window, the devices are sized from all the time steps, so that they are the same as when all the time steps are loaded
+    if window is not None and (sizes is None or uid not in sizes):
+        sizes = {} if sizes is None else sizes
+        sizes[uid] = get_device_sizes(building, build_sizing_series(data_path, uid, hourly_timesteps))
+    auto_size({uid: building}, sizes)
+
+    set_dhw_draws({uid: building}, rng) # @akp, kinda janky but until this point the dhw nominal power isn't set
+
+    return building, s_low, s_high, a_low, a_high
+
+# State of the worker processes of building_loader: the arguments shared by all the buildings and the shared memory block that receives their series
+_WORKER = {}
+
+def _init_worker(config, shm_name, shape):
+    # The workers share the resource tracker of the parent process, which unlinks the block
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _WORKER['config'] = config
+    _WORKER['sizes'] = {}
+    _WORKER['shm'] = shm
+    _WORKER['series'] = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+
+def _create_buildings_worker(tasks):
+    results = []
+    for i, uid, attributes, seed in tasks:
+        building, s_low, s_high, a_low, a_high = create_building(uid, attributes, rng = np.random.default_rng(seed), sizes = _WORKER['sizes'], **_WORKER['config'])
+
+        # The randomized series are returned through the shared memory block. The prototype series and the COPs are not sent back,
+        # the parent process re-attaches its own copies of them
+        _WORKER['series'][i] = building.sim_results.data
+        building.sim_results = SimulationData(columns = building.sim_results.columns, window = building.sim_results.window)
+        building.dhw_heating_device.cop_heating = None
+        building.cooling_device.cop_cooling = None
+
+        results.append((i, building, s_low, s_high, a_low, a_high))
+    return results
+
+def _create_buildings_parallel(tasks, config, n_jobs):
+    n_steps = load_building_series(config['data_path'], tasks[0][1], tasks[0][2], config['weather_file'], config['solar_profile'], config['hourly_timesteps'], cache_dir = config['cache_dir'], window = config['window'])[0].n_steps
+    shape = (len(tasks), n_steps, len(RANDOMIZED_SERIES))
+
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape))*np.dtype(np.float32).itemsize)
+    try:
+        chunks = [chunk for chunk in np.array_split(np.arange(len(tasks)), 4*n_jobs) if len(chunk) > 0]
+        results = [None]*len(tasks)
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(config, shm.name, shape)) as executor:
+            for chunk_results in executor.map(_create_buildings_worker, [[tasks[i] for i in chunk] for chunk in chunks]):
+                for result in chunk_results:
+                    results[result[0]] = result[1:]
+
+        series = np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+    for (i, uid, attributes, seed), (building, s_low, s_high, a_low, a_high) in zip(tasks, results):
+        building.sim_results.data = series[i]
+        building.sim_results.base = load_building_series(config['data_path'], uid, attributes, config['weather_file'], config['solar_profile'], config['hourly_timesteps'], cache_dir = config['cache_dir'], window = config['window'])[0]
+        if isinstance(building.dhw_heating_device, HeatPump):
+            building.dhw_heating_device.cop_heating = config['cops'][uid][0]
+        building.cooling_device.cop_cooling = config['cops'][uid][1]
+
+    return results
 
-def building_loader(data_path, building_attributes, weather_file, solar_profile, building_ids, buildings_states_actions, n_buildings, hourly_timesteps, save_memory = True):
+def get_central_observation_space(states, state_bounds):
+    """ Returns the observation space of a centralized agent, from the names of the states of every building and their bounds (s_low, s_high) """
+    # Create boundaries of the observation space of a centralized agent (if a central agent is being used instead of decentralized ones). We include all the weather variables used as states, and use the list appended_states to make sure we don't include any repeated states (i.e. weather variables measured by different buildings)
+    s_low_central_agent, s_high_central_agent, appended_states = [], [], []
+    for building_states, (s_low, s_high) in zip(states, state_bounds):
+        for state_name, low, high in zip(building_states, s_low, s_high):
+            if state_name in CENTRAL_AGENT_BUILDING_STATES or state_name not in appended_states:
+                s_low_central_agent.append(low)
+                s_high_central_agent.append(high)
+                if state_name not in CENTRAL_AGENT_BUILDING_STATES:
+                    appended_states.append(state_name)
+
+    return spaces.Box(low=np.float32(np.array(s_low_central_agent)), high=np.float32(np.array(s_high_central_agent)), dtype=np.float32)
+
+def building_loader(data_path, building_attributes, weather_file, solar_profile, building_ids, buildings_states_actions, n_buildings, hourly_timesteps, save_memory = True, cache_dir = None, n_jobs = None, window = None):
+    """ Creates n_buildings buildings (randomly duplicated from the prototypes building_ids). With n_jobs > 1 (-1 for all the cpus), the buildings are created by a pool of
+    processes. Every building is drawn from its own seed, so the buildings are the same whatever the number of processes.
+    If window = (start, stop) is given, only these time steps of the data are loaded (see create_building). """
     with open(building_attributes) as json_file:
         data = json.load(json_file)
 
     data = {k:v for k,v in data.items() if k in building_ids}
 
     buildings, observation_spaces, action_spaces = {},[],{}
-    s_low_central_agent, s_high_central_agent, appended_states = [], [], []
-    a_low_central_agent, a_high_central_agent, appended_actions = [], [], []
+    states, state_bounds = [], []
+    a_low_central_agent, a_high_central_agent = [], []
     all_data = list(zip(data, data.values()))
-    for _ in range(n_buildings):
+
+    # The prototypes, ids and seeds of all the buildings are drawn before the buildings are created
+    tasks, unique_ids = [], []
+    seeds = np.random.SeedSequence(np.random.randint(np.iinfo(np.int32).max)).spawn(n_buildings)
+    for i in range(n_buildings):
         uid, attributes = random.choice(all_data) # @akp, iterate through buildings randomly to create duplicates of building types
-        if uid in building_ids:
-            heat_pump = HeatPump(nominal_power = attributes['Heat_Pump']['nominal_power'],
-                                 eta_tech = attributes['Heat_Pump']['technical_efficiency'],
-                                 t_target_heating = attributes['Heat_Pump']['t_target_heating'],
-                                 t_target_cooling = attributes['Heat_Pump']['t_target_cooling'], save_memory = save_memory)
-
-            electric_heater = ElectricHeater(nominal_power = attributes['Electric_Water_Heater']['nominal_power'],
-                                             efficiency = attributes['Electric_Water_Heater']['efficiency'], save_memory = save_memory)
-
-            chilled_water_tank = EnergyStorage(capacity = attributes['Chilled_Water_Tank']['capacity'],
-                                               loss_coeff = attributes['Chilled_Water_Tank']['loss_coefficient'], save_memory = save_memory)
-
-            dhw_tank = EnergyStorage(capacity = attributes['DHW_Tank']['capacity'],
-                                     loss_coeff = attributes['DHW_Tank']['loss_coefficient'], save_memory = save_memory)
-
-            building = Building(buildingId = uid, hourly_timesteps=hourly_timesteps, dhw_storage = dhw_tank, cooling_storage = chilled_water_tank, dhw_heating_device = electric_heater, cooling_device = heat_pump, save_memory = save_memory)
-
-            data_file = str(uid) + '.csv'
-            simulation_data = data_path / data_file
-            with open(simulation_data) as csv_file:
-                data = pd.read_csv(csv_file)
-
-            building.sim_results['cooling_demand'] = subhourly_lin_interp(data['Cooling Load [kWh]'], hourly_timesteps)
-            building.sim_results['dhw_demand'] = list(data['DHW Heating [kWh]'])
-            building.sim_results['non_shiftable_load'] = subhourly_noisy_interp(data['Equipment Electric Power [kWh]'], hourly_timesteps)
-            building.sim_results['month'] = list(np.repeat(data['Month'], hourly_timesteps))
-            building.sim_results['day'] = list(np.repeat(data['Day Type'], hourly_timesteps))
-            building.sim_results['hour'] = list(np.repeat(data['Hour'], hourly_timesteps))
-            building.sim_results['daylight_savings_status'] = list(np.repeat(data['Daylight Savings Status'], hourly_timesteps))
-            building.sim_results['t_in'] = subhourly_lin_interp(data['Indoor Temperature [C]'], hourly_timesteps)
-            building.sim_results['avg_unmet_setpoint'] = subhourly_lin_interp(data['Average Unmet Cooling Setpoint Difference [C]'], hourly_timesteps)
-            building.sim_results['rh_in'] = subhourly_lin_interp(data['Indoor Relative Humidity [%]'], hourly_timesteps)
-
-            with open(weather_file) as csv_file:
-                weather_data = pd.read_csv(csv_file)
-
-            building.sim_results['t_out'] = subhourly_lin_interp(weather_data['Outdoor Drybulb Temperature [C]'], hourly_timesteps)
-            building.sim_results['rh_out'] = subhourly_lin_interp(weather_data['Outdoor Relative Humidity [%]'], hourly_timesteps)
-            building.sim_results['diffuse_solar_rad'] = subhourly_lin_interp(weather_data['Diffuse Solar Radiation [W/m2]'], hourly_timesteps)
-            building.sim_results['direct_solar_rad'] = subhourly_lin_interp(weather_data['Direct Solar Radiation [W/m2]'], hourly_timesteps)
-
-            # Reading weather forecasts
-            building.sim_results['t_out_pred_6h'] = subhourly_lin_interp(weather_data['6h Prediction Outdoor Drybulb Temperature [C]'], hourly_timesteps)
-            building.sim_results['t_out_pred_12h'] = subhourly_lin_interp(weather_data['12h Prediction Outdoor Drybulb Temperature [C]'], hourly_timesteps)
-            building.sim_results['t_out_pred_24h'] = subhourly_lin_interp(weather_data['24h Prediction Outdoor Drybulb Temperature [C]'], hourly_timesteps)
-
-            building.sim_results['rh_out_pred_6h'] = subhourly_lin_interp(weather_data['6h Prediction Outdoor Relative Humidity [%]'], hourly_timesteps)
-            building.sim_results['rh_out_pred_12h'] = subhourly_lin_interp(weather_data['12h Prediction Outdoor Relative Humidity [%]'], hourly_timesteps)
-            building.sim_results['rh_out_pred_24h'] = subhourly_lin_interp(weather_data['24h Prediction Outdoor Relative Humidity [%]'], hourly_timesteps)
-
-            building.sim_results['diffuse_solar_rad_pred_6h'] = subhourly_lin_interp(weather_data['6h Prediction Diffuse Solar Radiation [W/m2]'], hourly_timesteps)
-            building.sim_results['diffuse_solar_rad_pred_12h'] = subhourly_lin_interp(weather_data['12h Prediction Diffuse Solar Radiation [W/m2]'], hourly_timesteps)
-            building.sim_results['diffuse_solar_rad_pred_24h'] = subhourly_lin_interp(weather_data['24h Prediction Diffuse Solar Radiation [W/m2]'], hourly_timesteps)
-
-            building.sim_results['direct_solar_rad_pred_6h'] = subhourly_lin_interp(weather_data['6h Prediction Direct Solar Radiation [W/m2]'], hourly_timesteps)
-            building.sim_results['direct_solar_rad_pred_12h'] = subhourly_lin_interp(weather_data['12h Prediction Direct Solar Radiation [W/m2]'], hourly_timesteps)
-            building.sim_results['direct_solar_rad_pred_24h'] = subhourly_lin_interp(weather_data['24h Prediction Direct Solar Radiation [W/m2]'], hourly_timesteps)
-
-            # Reading the building attributes
-            building.building_type = attributes['Building_Type']
-            building.climate_zone = attributes['Climate_Zone']
-            building.solar_power_capacity = attributes['Solar_Power_Installed(kW)']
-
-            with open(solar_profile) as csv_file:
-                data = pd.read_csv(csv_file)
-
-            building.sim_results['solar_gen'] = subhourly_lin_interp(attributes['Solar_Power_Installed(kW)']*data['Hourly Data: AC inverter power (W)']/1000, hourly_timesteps)
-
-            # Finding the max and min possible values of all the states, which can then be used by the RL agent to scale the states and train any function approximators more effectively
-            s_low, s_high = [], []
-            for state_name, value in zip(buildings_states_actions[uid]['states'], buildings_states_actions[uid]['states'].values()):
-                if value == True:
-                    if state_name == "net_electricity_consumption":
-                        # lower and upper bounds of net electricity consumption are rough estimates and may not be completely accurate. Scaling this state-variable using these bounds may result in normalized values above 1 or below 0.
-                        _net_elec_cons_upper_bound = max(np.array(building.sim_results['non_shiftable_load']) - np.array(building.sim_results['solar_gen']) + np.array(np.repeat(building.sim_results['dhw_demand'], hourly_timesteps))/.8 + np.array(building.sim_results['cooling_demand']) + building.dhw_storage.capacity/.8 + building.cooling_storage.capacity/2)
-                        s_low.append(0.)
-                        s_high.append(_net_elec_cons_upper_bound)
-                        s_low_central_agent.append(0.)
-                        s_high_central_agent.append(_net_elec_cons_upper_bound)
-
-                    elif state_name == "relative_voltage":
-                        # @akp, added relative voltage to give homes their voltage ranked against the community max/min
-                        s_low.append(0.) # the house is the lowest voltage in the community
-                        s_high.append(1.)
-
-                        s_low_central_agent.append(0.)
-                        s_high_central_agent.append(1.)
-
-                    elif state_name == "total_voltage_spread":
-                        # @akp, added total voltage spread to give a sense of the total loss incurred by the community. without the total voltage spread state "relative_voltage" is more or less meaningless. (total_voltage_spread = how much the community is penaltized, relative_voltage = what that house can do to fix the issue)
-                        s_low.append(0.) # @akp?, not sure what the typical spread in v pu would be.
-                        s_high.append(1.)
-
-                        s_low_central_agent.append(0.)
-                        s_high_central_agent.append(1.)
-
-                    elif state_name != 'cooling_storage_soc' and state_name != 'dhw_storage_soc':
-                        s_low.append(min(building.sim_results[state_name]))
-                        s_high.append(max(building.sim_results[state_name]))
-
-                        # Create boundaries of the observation space of a centralized agent (if a central agent is being used instead of decentralized ones). We include all the weather variables used as states, and use the list appended_states to make sure we don't include any repeated states (i.e. weather variables measured by different buildings)
-                        if state_name in ['t_in', 'avg_unmet_setpoint', 'rh_in', 'non_shiftable_load', 'solar_gen']:
-                            s_low_central_agent.append(min(building.sim_results[state_name]))
-                            s_high_central_agent.append(max(building.sim_results[state_name]))
-
-                        elif state_name not in appended_states:
-                            s_low_central_agent.append(min(building.sim_results[state_name]))
-                            s_high_central_agent.append(max(building.sim_results[state_name]))
-                            appended_states.append(state_name)
-
-                    else:
-                        s_low.append(0.0)
-                        s_high.append(1.0)
-                        s_low_central_agent.append(0.0)
-                        s_high_central_agent.append(1.0)
-
-            '''The energy storage (tank) capacity indicates how many times bigger the tank is compared to the maximum hourly energy demand of the building (cooling or DHW respectively), which sets a lower bound for the action of 1/tank_capacity, as the energy storage device can't provide the building with more energy than it will ever need for a given hour. The heat pump is sized using approximately the maximum hourly energy demand of the building (after accounting for the COP, see function autosize). Therefore, we make the fair assumption that the action also has an upper bound equal to 1/tank_capacity. This boundaries should speed up the learning process of the agents and make them more stable rather than if we just set them to -1 and 1. I.e. if Chilled_Water_Tank.Capacity is 3 (3 times the max. hourly demand of the building in the entire year), its actions will be bounded between -1/3 and 1/3'''
-            a_low, a_high = [], []
-            for action_name, value in zip(buildings_states_actions[uid]['actions'], buildings_states_actions[uid]['actions'].values()):
-                if value == True:
-                    if action_name =='cooling_storage':
-
-                        # Avoid division by 0
-                        if attributes['Chilled_Water_Tank']['capacity'] > 0.000001:
-                            a_low.append(max(-1.0/attributes['Chilled_Water_Tank']['capacity'], -1.0))
-                            a_high.append(min(1.0/attributes['Chilled_Water_Tank']['capacity'], 1.0))
-                            a_low_central_agent.append(max(-1.0/attributes['Chilled_Water_Tank']['capacity'], -1.0))
-                            a_high_central_agent.append(min(1.0/attributes['Chilled_Water_Tank']['capacity'], 1.0))
-                        else:
-                            a_low.append(-1.0)
-                            a_high.append(1.0)
-                            a_low_central_agent.append(-1.0)
-                            a_high_central_agent.append(1.0)
-
-                    elif action_name == 'dhw_storage':
-                        if attributes['DHW_Tank']['capacity'] > 0.000001:
-                            a_low.append(max(-1.0/attributes['DHW_Tank']['capacity'], -1.0))
-                            a_high.append(min(1.0/attributes['DHW_Tank']['capacity'], 1.0))
-                            a_low_central_agent.append(max(-1.0/attributes['DHW_Tank']['capacity'], -1.0))
-                            a_high_central_agent.append(min(1.0/attributes['DHW_Tank']['capacity'], 1.0))
-                        else:
-                            a_low.append(-1.0)
-                            a_high.append(1.0)
-                            a_low_central_agent.append(-1.0)
-                            a_high_central_agent.append(1.0)
-
-                    elif action_name == 'pv_curtail':
-                        # pv curtailment of apparent power, S
-                        a_low.append(-1.0)
-                        a_high.append(1.0)
-                        a_low_central_agent.append(-1.0)
-                        a_high_central_agent.append(1.0)
-
-                    elif action_name == 'pv_phi':
-                        # smart inverter voltage control @constance?
-                        a_low.append(-1.0)
-                        a_high.append(1.0)
-                        a_low_central_agent.append(-1.0)
-                        a_high_central_agent.append(1.0)
+        unique_ids.append(''.join(random.choices(string.ascii_uppercase + string.digits, k=5)))
+        tasks.append((i, uid, attributes, seeds[i]))
 
+    # The COPs are indexed by the time step of the devices, which starts at 0 whatever the simulation period, so they are computed for all the hours even in a window
+    config = {'data_path': data_path, 'weather_file': weather_file, 'solar_profile': solar_profile, 'buildings_states_actions': buildings_states_actions,
+              'hourly_timesteps': hourly_timesteps, 'save_memory': save_memory, 'cache_dir': cache_dir, 'cops': heat_pump_cops(weather_file, data), 'window': window}
 
-            building.set_state_space(np.array(s_high), np.array(s_low))
-            building.set_action_space(np.array(a_high), np.array(a_low))
+    if n_jobs is not None and n_jobs < 0:
+        n_jobs = os.cpu_count()
+    if n_jobs is None or n_jobs <= 1 or n_buildings <= 1:
+        sizes = {}
+        results = [create_building(uid, attributes, rng = np.random.default_rng(seed), sizes = sizes, **config) for i, uid, attributes, seed in tasks]
 
-            unique_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=5))
-            buildings[unique_id] = building
+        # The randomized series of all the buildings are kept in one array, as they are by the process pool, so that the step engine gathers them at once
+        stack_stores([building.sim_results for building, _, _, _, _ in results])
+    else:
+        results = _create_buildings_parallel(tasks, config, min(n_jobs, n_buildings))
 
-            observation_spaces.append(building.observation_space)
-            action_spaces[unique_id] = building.action_space
+    for (i, uid, attributes, seed), unique_id, (building, s_low, s_high, a_low, a_high) in zip(tasks, unique_ids, results):
+        states.append([state_name for state_name, value in buildings_states_actions[uid]['states'].items() if value == True])
+        state_bounds.append((s_low, s_high))
 
-    observation_space_central_agent = spaces.Box(low=np.float32(np.array(s_low_central_agent)), high=np.float32(np.array(s_high_central_agent)), dtype=np.float32)
-    action_space_central_agent = spaces.Box(low=np.float32(np.array(a_low_central_agent)), high=np.float32(np.array(a_high_central_agent)), dtype=np.float32)
+        a_low_central_agent += a_low
+        a_high_central_agent += a_high
 
-    for building in buildings.values():
+        building.seed = seed
+        buildings[unique_id] = building
+        observation_spaces.append(building.observation_space)
+        action_spaces[unique_id] = building.action_space
 
-        # If the DHW device is a HeatPump
-        if isinstance(building.dhw_heating_device, HeatPump):
+    observation_space_central_agent = get_central_observation_space(states, state_bounds)
+    action_space_central_agent = spaces.Box(low=np.float32(np.array(a_low_central_agent)), high=np.float32(np.array(a_high_central_agent)), dtype=np.float32)
 
-            # Calculating COPs of the heat pumps for every hour
-            building.dhw_heating_device.cop_heating = building.dhw_heating_device.eta_tech*(building.dhw_heating_device.t_target_heating + 273.15)/(building.dhw_heating_device.t_target_heating - weather_data['Outdoor Drybulb Temperature [C]'])
-            building.dhw_heating_device.cop_heating[building.dhw_heating_device.cop_heating < 0] = 20.0
-            building.dhw_heating_device.cop_heating[building.dhw_heating_device.cop_heating > 20] = 20.0
-            building.dhw_heating_device.cop_heating = building.dhw_heating_device.cop_heating.to_numpy()
+    return buildings, observation_spaces, action_spaces, observation_space_central_agent, action_space_central_agent
 
-        building.cooling_device.cop_cooling = building.cooling_device.eta_tech*(building.cooling_device.t_target_cooling + 273.15)/(weather_data['Outdoor Drybulb Temperature [C]'] - building.cooling_device.t_target_cooling)
-        building.cooling_device.cop_cooling[building.cooling_device.cop_cooling < 0] = 20.0
-        building.cooling_device.cop_cooling[building.cooling_device.cop_cooling > 20] = 20.0
-        building.cooling_device.cop_cooling = building.cooling_device.cop_cooling.to_numpy()
+# Series of the district recorded at every time step of an episode, rows of CityLearn._district_buffer
+DISTRICT_SERIES = ['net_electric_consumption', 'electric_consumption_dhw_storage', 'electric_consumption_cooling_storage', 'electric_consumption_dhw', 'electric_consumption_cooling',
+                   'electric_consumption_appliances', 'electric_generation', 'net_electric_consumption_no_storage', 'net_electric_consumption_no_pv_no_storage']
 
-        building.reset()
+def _district_series(name):
+    # Read-only attribute of CityLearn holding the time steps of a district series recorded so far in the episode, as a view of the buffer
+    row = DISTRICT_SERIES.index(name)
+    return property(lambda self: self._district_buffer[row, :self._district_steps], doc = 'Values of ' + name + ' at the time steps of the episode')
 
-    auto_size(buildings)
+def simulate_rbc(env_rbc):
+    """ Simulates the rule-based controller on an environment and returns its baseline costs """
+    _, actions_spaces = env_rbc.get_state_action_spaces()
 
-    set_dhw_draws(buildings) # @akp, kinda janky but until this point the dhw nominal power isn't set
+    #Instantiatiing the control agent(s)
+    agent_rbc = RBC_Agent(env_rbc)
 
-    return buildings, observation_spaces, action_spaces, observation_space_central_agent, action_space_central_agent
+    state = env_rbc.reset()
+    done = False
+    while not done:
+        action = agent_rbc.select_action([list(env_rbc.buildings.values())[0].sim_results['hour'][env_rbc.time_step]])
+        next_state, rewards, done, _ = env_rbc.step(action)
+        state = next_state
+    return env_rbc.get_baseline_cost()
 
-class CityLearn(gym.Env):
-    def __init__(self, data_path, building_attributes, weather_file, solar_profile, building_ids, hourly_timesteps, buildings_states_actions = None, simulation_period = (0,8759), cost_function = ['ramping','1-load_factor','average_daily_peak','peak_demand','net_electricity_consumption', 'voltage_dev'], central_agent = False, verbose = 0, n_buildings=None):
+def _simulate_baseline(environment, kwargs, config):
+    # Runs in the background process of CityLearn.start_baseline. The baseline is written to the on-disk cache (if any) under its lock
+    return get_baseline_cost(config, lambda: simulate_rbc(environment(**kwargs)), kwargs['cache_dir'])
 
-        np.random.seed(12)
-        random.seed(12)
+class CityLearn(gym.Env):
+    net_electric_consumption = _district_series('net_electric_consumption')
+    electric_consumption_dhw_storage = _district_series('electric_consumption_dhw_storage')
+    electric_consumption_cooling_storage = _district_series('electric_consumption_cooling_storage')
+    electric_consumption_dhw = _district_series('electric_consumption_dhw')
+    electric_consumption_cooling = _district_series('electric_consumption_cooling')
+    electric_consumption_appliances = _district_series('electric_consumption_appliances')
+    electric_generation = _district_series('electric_generation')
+    net_electric_consumption_no_storage = _district_series('net_electric_consumption_no_storage')
+    net_electric_consumption_no_pv_no_storage = _district_series('net_electric_consumption_no_pv_no_storage')
+
+    def __init__(self, data_path, building_attributes, weather_file, solar_profile, building_ids, hourly_timesteps, buildings_states_actions = None, simulation_period = (0,8759), cost_function = ['ramping','1-load_factor','average_daily_peak','peak_demand','net_electricity_consumption', 'voltage_dev'], central_agent = False, verbose = 0, n_buildings=None, cache_dir=None, n_jobs=None, lazy=False, step_engine='vectorized', background_baseline=False, seed=SEED):
+
+        # The buildings and the grid are drawn from the seed, so that environments with the same seed are the same
+        self.random_seed = seed
+        np.random.seed(seed)
+        random.seed(seed)
 
         with open(buildings_states_actions) as json_file:
             self.buildings_states_actions = json.load(json_file)
@@ -305,6 +429,24 @@ class CityLearn(gym.Env):
         self.loss = []
         self.verbose = verbose
         self.hourly_timesteps = hourly_timesteps
+        self.cache_dir = cache_dir
+        self.n_jobs = n_jobs
+
+        # In the lazy data mode, only the time steps of simulation_period are loaded (the bounds of the states are those of this period, the devices are still sized from
+        # all the time steps). The other time steps are loaded by reset() if the simulation period is changed
+        self.lazy = lazy
+
+        # With the 'vectorized' step engine, the actions of a central agent are applied to all the buildings at once by a StepEngine. The 'object' engine applies them
+        # building by building with the methods of Building (the buildings that the vectorized engine does not support are always stepped this way)
+        if step_engine not in ['vectorized', 'object']:
+            raise ValueError("step_engine must be 'vectorized' or 'object'")
+        self.step_engine = step_engine
+        self._step_engine = None
+        self._step_results = None
+
+        # Spread of the voltages of the grid and voltage of every building ranked against the others, computed once per time step by the power flow
+        # (see GridLearn.calc_total_voltage_spread and GridLearn.calc_relative_voltage)
+        self.total_voltage_spread = 0
 
         self.simulation_period = simulation_period
         self.uid = None
@@ -313,45 +455,88 @@ class CityLearn(gym.Env):
         else:
             self.n_buildings = n_buildings
 
-        self.buildings, self.observation_spaces, self.action_spaces, self.observation_space, self.action_space = building_loader(data_path, building_attributes, weather_file, solar_profile, building_ids, self.buildings_states_actions, self.n_buildings, self.hourly_timesteps)
+        # With background_baseline, the rule-based controller is simulated by a background process while this environment is used, and cost() only waits for it if it is not done yet
+        self._baseline_future = None
+        self._baseline_config = None
+        if background_baseline:
+            self.start_baseline()
+
+        self.buildings, self.observation_spaces, self.action_spaces, self.observation_space, self.action_space = building_loader(data_path, building_attributes, weather_file, solar_profile, building_ids, self.buildings_states_actions, self.n_buildings, self.hourly_timesteps, cache_dir=cache_dir, n_jobs=n_jobs, window=get_simulation_window(simulation_period, hourly_timesteps) if lazy else None)
 
         self.buildings_states_actions = {k:self.buildings_states_actions[self.buildings[k].buildingId] for k in self.buildings}
+        self.action_layout = ActionLayout(self.buildings, self.buildings_states_actions)
+        self.relative_voltage = np.full(len(self.buildings), 0.5)
+        self.observation_layout = ObservationLayout(self.buildings, self.buildings_states_actions)
 
         self.reset()
 
     def get_state_action_spaces(self):
         return self.observation_spaces, self.action_spaces
 
+    def materialize(self):
+        """ Loads all the time steps of the data of the buildings created in the lazy data mode. The random series of every building are drawn again from its seed,
+        and the bounds of the states (and the observation spaces) are computed again from all the time steps """
+        with open(self.building_attributes) as json_file:
+            data = json.load(json_file)
+
+        data = {k:v for k,v in data.items() if k in self.building_ids}
+        cops = heat_pump_cops(self.weather_file, data)
+        states, state_bounds = [], []
+        for uid, building in self.buildings.items():
+            rng = np.random.default_rng(building.seed)
+            load_building_data(building, data[building.buildingId], self.data_path, self.weather_file, self.solar_profile, self.hourly_timesteps, self.cache_dir, rng)
+            if isinstance(building.dhw_heating_device, HeatPump):
+                building.dhw_heating_device.cop_heating = cops[building.buildingId][0]
+            building.cooling_device.cop_cooling = cops[building.buildingId][1]
+
+            # The bounds are computed before the DHW draws, as in create_building. The devices were already sized from all the time steps
+            s_low, s_high = get_state_bounds(building, data[building.buildingId], self.buildings_states_actions[uid]['states'])
+            building.set_state_space(np.array(s_high), np.array(s_low))
+            states.append([state_name for state_name, value in self.buildings_states_actions[uid]['states'].items() if value == True])
+            state_bounds.append((s_low, s_high))
+
+            set_dhw_draws({uid: building}, rng)
+
+        stack_stores([building.sim_results for building in self.buildings.values()])
+        self.observation_spaces = [building.observation_space for building in self.buildings.values()]
+        self.observation_space = get_central_observation_space(states, state_bounds)
+
     def next_hour(self, buildings):
         self.time_step = self.hour[self.time_index]
         self.time_index += 1
-        for uid, building in self.buildings.items():
-            if uid in buildings:
-                building.time_step = self.time_step
+        for uid in buildings:
+            self.buildings[uid].time_step = self.time_step
 
     def get_building_information(self):
 
         np.seterr(divide='ignore', invalid='ignore')
+
+        # Correlations between the demands of every pair of buildings, computed at once from the columns of their simulation data
+        uids = list(self.buildings.keys())
+        correlations = {}
+        for series in ['dhw_demand', 'cooling_demand', 'non_shiftable_load']:
+            correlations[series] = np.corrcoef(np.array([self.buildings[uid].sim_results[series] for uid in uids], dtype=np.float64))
+
         # Annual DHW demand, Annual Cooling Demand, Annual Electricity Demand
         building_info = {}
-        for uid, building in self.buildings.items():
+        for i, (uid, building) in enumerate(self.buildings.items()):
             building_info[uid] = {}
             building_info[uid]['building_type'] = building.building_type
             building_info[uid]['climate_zone'] = building.climate_zone
             building_info[uid]['solar_power_capacity (kW)'] = round(building.solar_power_capacity, 3)
-            building_info[uid]['Annual_DHW_demand (kWh)'] = round(sum(building.sim_results['dhw_demand']), 3)
-            building_info[uid]['Annual_cooling_demand (kWh)'] = round(sum(building.sim_results['cooling_demand']), 3)
-            building_info[uid]['Annual_nonshiftable_electrical_demand (kWh)'] = round(sum(building.sim_results['non_shiftable_load']), 3)
+            building_info[uid]['Annual_DHW_demand (kWh)'] = round(float(building.sim_results['dhw_demand'].sum(dtype=np.float64)), 3)
+            building_info[uid]['Annual_cooling_demand (kWh)'] = round(float(building.sim_results['cooling_demand'].sum(dtype=np.float64)), 3)
+            building_info[uid]['Annual_nonshiftable_electrical_demand (kWh)'] = round(float(building.sim_results['non_shiftable_load'].sum(dtype=np.float64)), 3)
 
             building_info[uid]['Correlations_DHW'] = {}
             building_info[uid]['Correlations_cooling_demand'] = {}
             building_info[uid]['Correlations_non_shiftable_load'] = {}
 
-            for uid_corr, building_corr in self.buildings.items():
+            for j, uid_corr in enumerate(uids):
                 if uid_corr != uid:
-                    building_info[uid]['Correlations_DHW'][uid_corr] = round((np.corrcoef(np.array(building.sim_results['dhw_demand']), np.array(building_corr.sim_results['dhw_demand'])))[0][1], 3)
-                    building_info[uid]['Correlations_cooling_demand'][uid_corr] = round((np.corrcoef(np.array(building.sim_results['cooling_demand']), np.array(building_corr.sim_results['cooling_demand'])))[0][1], 3)
-                    building_info[uid]['Correlations_non_shiftable_load'][uid_corr] = round((np.corrcoef(np.array(building.sim_results['non_shiftable_load']), np.array(building_corr.sim_results['non_shiftable_load'])))[0][1], 3)
+                    building_info[uid]['Correlations_DHW'][uid_corr] = round(correlations['dhw_demand'][i][j], 3)
+                    building_info[uid]['Correlations_cooling_demand'][uid_corr] = round(correlations['cooling_demand'][i][j], 3)
+                    building_info[uid]['Correlations_non_shiftable_load'][uid_corr] = round(correlations['non_shiftable_load'][i][j], 3)
 
         return building_info
 
@@ -366,98 +551,49 @@ class CityLearn(gym.Env):
         elec_consumption_appliances = 0
         elec_generation = 0
 
-        if self.central_agent:
-            # If the agent is centralized, all the actions for all the buildings are provided as an ordered list of numbers. The order corresponds to the order of the buildings as they appear on the file building_attributes.json, and only considering the buildings selected for the simulation by the user (building_ids).
-            for uid, building in self.buildings.items():
-
-                if self.buildings_states_actions[uid]['actions']['cooling_storage']:
-                    # Cooling
-                    _electric_demand_cooling = building.set_storage_cooling(actions[0])
-                    actions = actions[1:]
-                    elec_consumption_cooling_storage += building._electric_consumption_cooling_storage
-                else:
-                    _electric_demand_cooling = 0
-
-                if self.buildings_states_actions[uid]['actions']['dhw_storage']:
-                    # DHW
-                    _electric_demand_dhw = building.set_storage_heating(actions[0])
-                    actions = actions[1:]
-                    elec_consumption_dhw_storage += building._electric_consumption_dhw_storage
-                else:
-                    _electric_demand_dhw = 0
-
-                if self.buildings_states_actions[uid]['actions']['pv_curtail']:
-                    # solar power curtailment
-                    _solar_generation = building.get_solar_power(actions[0])
-                    actions = actions[1:]
-                else:
-                    _solar_generation = building.get_solar_power()
-                elec_generation += _solar_generation # because the default is to not curtail pv production.
-
-                if self.buildings_states_actions[uid]['actions']['pv_phi']:
-                    building.set_phase_lag(actions[0])
-                    actions = actions[1:]
-                else:
-                    building.set_phase_lag()
-
-                # Total heating and cooling electrical loads
-                elec_consumption_cooling_total += _electric_demand_cooling
-                elec_consumption_dhw_total += _electric_demand_dhw
-
-                # Electrical appliances
-                _non_shiftable_load = building.get_non_shiftable_load()
-                elec_consumption_appliances += _non_shiftable_load
-
-                # Adding loads from appliances and subtracting solar generation to the net electrical load of each building
-                building_electric_demand = round(_electric_demand_cooling + _electric_demand_dhw + _non_shiftable_load - _solar_generation, 4)
-
-                # Electricity consumed by every building
-                building.current_net_electricity_demand = building_electric_demand
-                self.buildings_net_electricity_demand.append(-building_electric_demand) # >0 if solar generation > electricity consumption
-
-                # Total electricity consumption
-                electric_demand += building_electric_demand
-
-            assert len(actions) == 0, 'Some of the actions provided were not used'
+        # The actions are given as an ordered list of numbers for a central agent, and as an array of shape (buildings, max_actions) or a dict {uid: list of actions}
+        # for decentralized agents (see ActionLayout). The order of the buildings is the order of self.buildings, and every building reads its actions in the order of ACTIONS
+        actions, indices = self.action_layout.unpack(actions)
+        uids = [self.action_layout.uids[i] for i in indices]
+
+        if self._step_engine is not None and len(indices) == len(self.buildings):
+            results = self._step_engine.step(actions, self.time_step)
+            self._step_results = results
+            self.buildings_net_electricity_demand = list(-results['net_electricity_demand'])
+            electric_demand = results['electric_demand']
+            elec_consumption_dhw_storage = results['elec_consumption_dhw_storage']
+            elec_consumption_cooling_storage = results['elec_consumption_cooling_storage']
+            elec_consumption_dhw_total = results['elec_consumption_dhw_total']
+            elec_consumption_cooling_total = results['elec_consumption_cooling_total']
+            elec_consumption_appliances = results['elec_consumption_appliances']
+            elec_generation = results['elec_generation']
 
         else:
-
-            for uid, a in actions.items():
+            self._step_results = None
+            actions = actions.tolist()
+            for i, uid in zip(indices, uids):
                 building = self.buildings[uid]
-                if self.buildings_states_actions[uid]['actions']['cooling_storage']:
-                    # Cooling will always be the first action available
-                    # print("setting cooling storage...")
+                cooling_storage, dhw_storage, pv_curtail, pv_phi = self.action_layout.flags[i]
+                a = actions[i]
+
+                if cooling_storage:
+                    # Cooling
                     _electric_demand_cooling = building.set_storage_cooling(a[0])
                     elec_consumption_cooling_storage += building._electric_consumption_cooling_storage
-                    a = a[1:]
                 else:
                     _electric_demand_cooling = 0
 
-                if self.buildings_states_actions[uid]['actions']['dhw_storage']:
+                if dhw_storage:
                     # DHW
-                    # print("setting dhw storage...")
-                    _electric_demand_dhw = building.set_storage_heating(a[0])
+                    _electric_demand_dhw = building.set_storage_heating(a[1])
                     elec_consumption_dhw_storage += building._electric_consumption_dhw_storage
-                    a = a[1:]
                 else:
                     _electric_demand_dhw = 0
 
-                if self.buildings_states_actions[uid]['actions']['pv_curtail']:
-                    # Solar power
-                    # print("setting pv curtailment...")
-                    _solar_generation = building.get_solar_power(a[0])
-                    elec_generation += _solar_generation
-                    a = a[1:]
-                else:
-                    _solar_generation = building.get_solar_power()
-                    elec_generation += _solar_generation
-
-                if self.buildings_states_actions[uid]['actions']['pv_vm']:
-                    # print("setting pv voltage")
-                    building.set_target_vm(a[0])
-                    a = a[1:]
-                else:
-                    building.set_target_vm()
+                # Solar power curtailment and phase lag of the inverter. The buildings that do not control them get the default actions (no curtailment and no phase lag)
+                _solar_generation = building.get_solar_power(a[2])
+                elec_generation += _solar_generation
+                building.set_phase_lag(a[3])
 
                 # Total heating and cooling electrical loads
                 elec_consumption_cooling_total += _electric_demand_cooling
@@ -472,103 +608,41 @@ class CityLearn(gym.Env):
 
                 # Electricity consumed by every building
                 building.current_net_electricity_demand = building_electric_demand
-                self.buildings_net_electricity_demand.append(-building_electric_demand)
+                self.buildings_net_electricity_demand.append(-building_electric_demand) # >0 if solar generation > electricity consumption
 
                 # Total electricity consumption
                 electric_demand += building_electric_demand
 
         self.aux_grid_func()
-        self.next_hour(actions.keys() if type(actions)==dict else self.buildings.keys())
+        self.next_hour(uids)
 
+        # The engine reads the state of the buildings stepped by the objects (actions given for some of the buildings), so that the next step of all the buildings starts from it
+        if self._step_engine is not None and self._step_results is None:
+            self._step_engine.sync()
+
+        self.observation_layout.fill(self.time_step, self._get_building_states(), self._get_district_states())
         if self.central_agent:
-            s, s_appended = [], []
-            for uid, building in self.buildings.items():
-
-                # If the agent is centralized, we append the states avoiding repetition. I.e. if multiple buildings share the outdoor temperature as a state, we only append it once to the states of the central agent. The variable s_appended is used for this purpose.
-                for state_name, value in self.buildings_states_actions[uid]['states'].items():
-                    if value == True:
-                        if state_name not in s_appended:
-                            if state_name in ['t_in', 'avg_unmet_setpoint', 'rh_in', 'non_shiftable_load', 'solar_gen']:
-                                s.append(building.sim_results[state_name][self.time_step])
-                            elif state_name == 'net_electricity_consumption':
-                                s.append(building.current_net_electricity_demand)
-
-                            elif state_name == 'relative_voltage':
-                                if self.time_step <= 1:
-                                    s.append(0.5)
-                                else:
-                                    ranked_voltage = self.net.res_bus['vm_pu'].rank(pct=True)[self.net.load.loc[self.net.load['name']==uid].bus].iat[0]
-                                    s.append(ranked_voltage)
-                            elif state_name == 'total_voltage_spread':
-                                    if self.time_step <= 1:
-                                        s.append(0)
-                                    else:
-                                        voltage_spread = 0
-                                        for index, line in self.net.line.iterrows():
-                                            voltage_spread += abs(self.net.res_bus.loc[line.to_bus].vm_pu - self.net.res_bus.loc[line.from_bus].vm_pu)
-                                        s.append(voltage_spread)
-
-                            elif state_name != 'cooling_storage_soc' and state_name != 'dhw_storage_soc':
-                                s.append(building.sim_results[state_name][self.time_step])
-                                s_appended.append(state_name)
-                            elif state_name == 'cooling_storage_soc':
-                                s.append(building.cooling_storage._soc/building.cooling_storage.capacity)
-                            elif state_name == 'dhw_storage_soc':
-                                s.append(building.dhw_storage._soc/building.dhw_storage.capacity)
-            self.state = np.array(s)
+            # If the agent is centralized, the states shared by the buildings (i.e. weather variables) are only included once (see ObservationLayout)
+            self.state = self.observation_layout.get_central_observation()
             rewards = reward_function_sa(self.buildings_net_electricity_demand)
             self.cumulated_reward_episode += rewards
 
         else:
-            # If the controllers are decentralized, we append all the states to each associated agent's list of states.
-            self.state = []
-            for uid in actions.keys():
-                building = self.buildings[uid]
-                s = []
-                for state_name, value in self.buildings_states_actions[uid]['states'].items():
-                    if value == True:
-                        if state_name == 'net_electricity_consumption':
-                            s.append(building.current_net_electricity_demand)
-
-                        elif state_name == 'relative_voltage':
-                            if self.time_step <= 1:
-                                s.append(0.5)
-                            else:
-                                ranked_voltage = self.net.res_bus['vm_pu'].rank(pct=True)[self.net.load.loc[self.net.load['name']==uid].bus].iat[0]
-                                s.append(ranked_voltage)
-                        elif state_name == 'total_voltage_spread':
-                            if self.time_step <= 1:
-                                s.append(0)
-                            else:
-                                voltage_spread = 0
-                                for index, line in self.net.line.iterrows():
-                                    voltage_spread += abs(self.net.res_bus.loc[line.to_bus].vm_pu - self.net.res_bus.loc[line.from_bus].vm_pu)
-                                s.append(voltage_spread)
-
-                        elif state_name != 'cooling_storage_soc' and state_name != 'dhw_storage_soc':
-                            s.append(building.sim_results[state_name][self.time_step])
-                        elif state_name == 'cooling_storage_soc':
-                            s.append(building.cooling_storage._soc/building.cooling_storage.capacity)
-                        elif state_name == 'dhw_storage_soc':
-                            s.append(building.dhw_storage._soc/building.dhw_storage.capacity)
-
-                self.state.append(np.array(s))
-            self.state = np.array(self.state, dtype=object)
+            # If the controllers are decentralized, every agent gets all the states of its building
+            self.state = self.observation_layout.get_observations(indices)
             sys_losses = self.system_losses[-1] if self.time_step > 1 else 0
             voltage_dev = self.voltage_dev[-1] if self.time_step > 1 else 0
             rewards = self.reward_function.get_rewards(voltage_dev, sys_losses)
             self.cumulated_reward_episode += sum(rewards)
 
-        # Control variables which are used to display the results and the behavior of the buildings at the district level.
-        self.net_electric_consumption = np.append(self.net_electric_consumption,np.float32(electric_demand))
-        self.electric_consumption_dhw_storage  = np.append(self.electric_consumption_dhw_storage,np.float32(elec_consumption_dhw_storage))
-        self.electric_consumption_cooling_storage = np.append(self.electric_consumption_cooling_storage,np.float32(elec_consumption_cooling_storage))
-        self.electric_consumption_dhw = np.append(self.electric_consumption_dhw,np.float32(elec_consumption_dhw_total))
-        self.electric_consumption_cooling = np.append(self.electric_consumption_cooling,np.float32(elec_consumption_cooling_total))
-        self.electric_consumption_appliances = np.append(self.electric_consumption_appliances,np.float32(elec_consumption_appliances))
-        self.electric_generation = np.append(self.electric_generation,np.float32(elec_generation))
-        self.net_electric_consumption_no_storage = np.append(self.net_electric_consumption_no_storage,np.float32(electric_demand-elec_consumption_cooling_storage-elec_consumption_dhw_storage))
-        self.net_electric_consumption_no_pv_no_storage = np.append(self.net_electric_consumption_no_pv_no_storage,np.float32(electric_demand + elec_generation - elec_consumption_cooling_storage - elec_consumption_dhw_storage))
+        # Control variables which are used to display the results and the behavior of the buildings at the district level. They are written in place in
+        # buffers that hold the whole episode, in the order of DISTRICT_SERIES (with the float32 precision of the values)
+        self._district_buffer[:, self._district_steps] = np.float32([electric_demand, elec_consumption_dhw_storage, elec_consumption_cooling_storage, elec_consumption_dhw_total,
+                                                                     elec_consumption_cooling_total, elec_consumption_appliances, elec_generation,
+                                                                     electric_demand-elec_consumption_cooling_storage-elec_consumption_dhw_storage,
+                                                                     electric_demand + elec_generation - elec_consumption_cooling_storage - elec_consumption_dhw_storage])
+        self.kpis.update(self._district_buffer[0, self._district_steps])
+        self._district_steps += 1
 
         terminal = self._terminal()
         return (self._get_ob(), rewards, terminal, {})
@@ -579,93 +653,97 @@ class CityLearn(gym.Env):
     def aux_grid_func(self):
         return("Auxiliary grid function has not been implemented yet.")
 
+    def get_buildings_power(self):
+        """ Returns the electricity consumption of the DHW devices, the non-shiftable load, the electricity consumption of the cooling devices, the solar power and
+        the phase lag of the inverters of all the buildings at the current time step, as arrays (taken from the step engine if it stepped all the buildings) """
+        if self._step_results is not None:
+            results = self._step_results
+            return results['electric_demand_dhw'], results['non_shiftable_load'], results['electric_demand_cooling'], results['solar_power'], results['v_lag']
+
+        buildings = list(self.buildings.values())
+        return (np.array([building.get_dhw_electric_demand() for building in buildings], dtype=np.float64),
+                np.array([building.get_non_shiftable_load() for building in buildings], dtype=np.float64),
+                np.array([building.get_cooling_electric_demand() for building in buildings], dtype=np.float64),
+                np.array([building.solar_power for building in buildings], dtype=np.float64),
+                np.array([building.v_lag for building in buildings], dtype=np.float64))
+
     def reset_baseline_cost(self):
         self.cost_rbc = None
 
     def reset(self):
 
+        # Time steps of the simulation period that were not loaded in the lazy data mode
+        if self.lazy and not all(building.sim_results.covers(get_simulation_window(self.simulation_period, self.hourly_timesteps)) for building in self.buildings.values()):
+            self.materialize()
+
         #Initialization of variables
         self.hour = np.array(range(self.simulation_period[0], self.simulation_period[1] * self.hourly_timesteps + 1))
         self.time_index = 0
         self.next_hour(self.buildings.keys())
 
-        self.net_electric_consumption = []
-        self.net_electric_consumption_no_storage = []
-        self.net_electric_consumption_no_pv_no_storage = []
-        self.electric_consumption_dhw_storage = []
-        self.electric_consumption_cooling_storage = []
-        self.electric_consumption_dhw = []
-        self.electric_consumption_cooling = []
-        self.electric_consumption_appliances = []
-        self.electric_generation = []
+        # A new buffer is allocated (without being initialized) for every episode, so the series of the previous episodes are kept by whoever holds them.
+        # An episode has at most one time step per element of self.hour
+        self._district_buffer = np.empty((len(DISTRICT_SERIES), len(self.hour)), dtype=np.float64)
+        self._district_steps = 0
+
+        # Costs of the episode updated at every time step, see current_kpis()
+        self.kpis = CostAccumulator(self.hourly_timesteps)
 
         self.cumulated_reward_episode = 0
 
-        if self.central_agent:
-            s, s_appended = [], []
-            for uid, building in self.buildings.items():
-                building.reset()
-                for state_name, value in self.buildings_states_actions[uid]['states'].items():
-                    if state_name not in s_appended:
-                        if value == True:
-                            if state_name in ['t_in', 'avg_unmet_setpoint', 'rh_in', 'non_shiftable_load', 'solar_gen']:
-                                s.append(building.sim_results[state_name][self.time_step])
-                            elif state_name == 'net_electricity_consumption':
-                                s.append(building.current_net_electricity_demand)
-                            elif state_name == 'total_voltage_spread':
-                                if self.time_step == 0:
-                                    s.append(0)
-                                else:
-                                    voltage_spread = s.append(max(self.net.res_bus.vm_pu)-min(self.net.res_bus.vm_pu))
-                            elif state_name == 'relative_voltage':
-                                if self.time_step == 0:
-                                    s.append(0.5)
-                                else:
-                                    house_voltage = self.net.res_bus[self.net.res_bus['name'] == uid]
-                                    s.append(house_voltage / spread)
-                            elif state_name != 'cooling_storage_soc' and state_name != 'dhw_storage_soc':
-                                s.append(building.sim_results[state_name][self.time_step])
-                                s_appended.append(state_name)
-                            elif state_name == 'cooling_storage_soc':
-                                s.append(0.0)
-                            elif state_name == 'dhw_storage_soc':
-                                s.append(0.0)
-            self.state = np.array(s)
-        else:
+        for building in self.buildings.values():
+            building.reset()
+        self.observation_layout.bind(self.buildings)
+
+        if not self.central_agent:
             self.reward_function = reward_function_ma(self.n_buildings, self.get_building_information())
 
-            self.state = []
-            for uid, building in self.buildings.items():
-                building.reset()
-                s = []
-                for state_name, value in zip(self.buildings_states_actions[uid]['states'], self.buildings_states_actions[uid]['states'].values()):
-                    if value == True:
-                        if state_name == 'net_electricity_consumption':
-                            s.append(building.current_net_electricity_demand)
-                        elif state_name == 'total_voltage_spread':
-                            if self.time_step == 0:
-                                s.append(0)
-                            else:
-                                voltage_spread = s.append(max(self.net.res_bus.vm_pu)-min(self.net.res_bus.vm_pu))
-                        elif state_name == 'relative_voltage':
-                            if self.time_step == 0:
-                                s.append(0.5)
-                            else:
-                                house_voltage = self.net.res_bus[self.net.res_bus['name'] == uid]
-                                s.append(house_voltage / spread)
-                        elif state_name != 'cooling_storage_soc' and state_name != 'dhw_storage_soc':
-                            s.append(building.sim_results[state_name][self.time_step])
-                        elif state_name == 'cooling_storage_soc':
-                            s.append(0.0)
-                        elif state_name == 'dhw_storage_soc':
-                            s.append(0.0)
-
-                self.state.append(np.array(s, dtype=np.float32))
-
-            self.state = np.array(self.state)
+        if self.step_engine == 'vectorized' and is_supported(self.buildings):
+            self._step_engine = StepEngine(self.buildings, self.buildings_states_actions)
+        else:
+            self._step_engine = None
+
+        # The storage devices are empty and the power flow has not been run yet
+        self.observation_layout.fill(self.time_step, self._get_building_states(initial=True), self._get_district_states(initial=True))
+        if self.central_agent:
+            self.state = self.observation_layout.get_central_observation()
+        else:
+            self.state = self.observation_layout.get_observations(list(range(len(self.buildings))))
 
         return self._get_ob()
 
+    def _get_building_states(self, initial=False):
+        # States of the buildings that are not read from their simulation data (see ObservationLayout)
+        layout, buildings = self.observation_layout, list(self.buildings.values())
+        states = {}
+        if layout.observed('net_electricity_consumption'):
+            states['net_electricity_consumption'] = np.array([building.current_net_electricity_demand for building in buildings], dtype=np.float64)
+
+        for name, storage in [('cooling_storage_soc', 'cooling_storage'), ('dhw_storage_soc', 'dhw_storage')]:
+            if layout.observed(name):
+                if self._step_engine is not None:
+                    storages = getattr(self._step_engine, storage)
+                    states[name] = storages.soc/storages.capacity
+                else:
+                    states[name] = np.array([getattr(building, storage)._soc/getattr(building, storage).capacity for building in buildings], dtype=np.float64)
+
+        if layout.observed('relative_voltage'):
+            if self.time_step <= 1 or initial:
+                states['relative_voltage'] = np.full(len(buildings), 0.5)
+            else:
+                states['relative_voltage'] = self.relative_voltage
+        return states
+
+    def _get_district_states(self, initial=False):
+        # States shared by all the buildings. They are computed once per step, as they do not depend on the building
+        states = {}
+        if self.observation_layout.observed('total_voltage_spread'):
+            if self.time_step <= 1 or initial:
+                states['total_voltage_spread'] = 0
+            else:
+                states['total_voltage_spread'] = self.total_voltage_spread
+        return states
+
     def _get_ob(self):
         return self.state
 
@@ -675,16 +753,6 @@ class CityLearn(gym.Env):
             for building in self.buildings.values():
                 building.terminate()
 
-            # When the simulation is over, convert all the control variables to numpy arrays so they are easier to plot.
-            self.net_electric_consumption = np.array(self.net_electric_consumption)
-            self.net_electric_consumption_no_storage = np.array(self.net_electric_consumption_no_storage)
-            self.net_electric_consumption_no_pv_no_storage = np.array(self.net_electric_consumption_no_pv_no_storage)
-            self.electric_consumption_dhw_storage = np.array(self.electric_consumption_dhw_storage)
-            self.electric_consumption_cooling_storage = np.array(self.electric_consumption_cooling_storage)
-            self.electric_consumption_dhw = np.array(self.electric_consumption_dhw)
-            self.electric_consumption_cooling = np.array(self.electric_consumption_cooling)
-            self.electric_consumption_appliances = np.array(self.electric_consumption_appliances)
-            self.electric_generation = np.array(self.electric_generation)
             self.loss.append([i for i in self.get_baseline_cost().values()])
 
             if self.verbose == 1:
@@ -700,90 +768,61 @@ class CityLearn(gym.Env):
         return self.buildings_net_electricity_demand
 
     def get_rbc_cost(self):
-        # Running the reference rule-based controller to find the baseline cost
+        # Running the reference rule-based controller to find the baseline cost, unless it is cached for the same configuration
         if self.cost_rbc is None:
-            env_rbc = CityLearn(self.data_path, self.building_attributes, self.weather_file, self.solar_profile, self.building_ids, hourly_timesteps=self.hourly_timesteps, buildings_states_actions = self.buildings_states_actions_filename, simulation_period = self.simulation_period, cost_function = self.cost_function, central_agent = False, n_buildings=self.n_buildings)
-            _, actions_spaces = env_rbc.get_state_action_spaces()
-
-            #Instantiatiing the control agent(s)
-            agent_rbc = RBC_Agent(env_rbc)
-
-            state = env_rbc.reset()
-            done = False
-            while not done:
-                action = agent_rbc.select_action([list(env_rbc.buildings.values())[0].sim_results['hour'][env_rbc.time_step]])
-                next_state, rewards, done, _ = env_rbc.step(action)
-                state = next_state
-            self.cost_rbc = env_rbc.get_baseline_cost()
+            config = self.get_baseline_config()
+            # The baseline simulated in the background is only used if the configuration has not changed since it was started
+            if self._baseline_future is not None and self._baseline_config == config:
+                simulate = self._baseline_future.result
+            else:
+                simulate = self.simulate_rbc
+            self.cost_rbc = get_baseline_cost(config, simulate, self.cache_dir)
+
+    def start_baseline(self):
+        """ Starts simulating the rule-based controller in a background process, unless the baseline cost is already cached """
+        config = self.get_baseline_config()
+        if find_baseline_cost(config, self.cache_dir) is None:
+            executor = ProcessPoolExecutor(max_workers=1)
+            self._baseline_future = executor.submit(_simulate_baseline, type(self), self.get_rbc_kwargs(), config)
+            self._baseline_config = config
+            # The worker process exits once the baseline is simulated
+            executor.shutdown(wait=False)
+
+    def get_baseline_config(self):
+        """ Returns everything the baseline cost depends on, with the data files under 'files' (see citylearn.baseline) """
+        files = {'building_attributes': self.building_attributes, 'weather_file': self.weather_file, 'solar_profile': self.solar_profile, 'buildings_states_actions': self.buildings_states_actions_filename}
+        files.update({uid: Path(self.data_path) / (str(uid) + '.csv') for uid in self.building_ids})
+        return {'environment': type(self).__name__, 'files': files, 'building_ids': list(self.building_ids), 'hourly_timesteps': self.hourly_timesteps,
+                'simulation_period': list(self.simulation_period), 'cost_function': list(self.cost_function), 'n_buildings': self.n_buildings, 'seed': self.random_seed,
+                'lazy': self.lazy}
+
+    def get_rbc_kwargs(self):
+        """ Returns the arguments of a new environment with the configuration of this one, which is controlled by the rule-based controller """
+        return dict(data_path=self.data_path, building_attributes=self.building_attributes, weather_file=self.weather_file, solar_profile=self.solar_profile, building_ids=self.building_ids, hourly_timesteps=self.hourly_timesteps, buildings_states_actions = self.buildings_states_actions_filename, simulation_period = self.simulation_period, cost_function = self.cost_function, central_agent = False, n_buildings=self.n_buildings, cache_dir=self.cache_dir, n_jobs=self.n_jobs, lazy=self.lazy, step_engine=self.step_engine, seed=self.random_seed)
+
+    def simulate_rbc(self):
+        """ Simulates the rule-based controller and returns its costs """
+        return simulate_rbc(type(self)(**self.get_rbc_kwargs()))
 
     def cost(self):
 
         self.get_rbc_cost()
 
         # Compute the costs normalized by the baseline costs
-        cost = {}
-        self.net_electric_consumption = np.array(self.net_electric_consumption)
-        if 'ramping' in self.cost_function:
-            cost['ramping'] = np.abs((self.net_electric_consumption - np.roll(self.net_electric_consumption,1))[1:]).sum()/self.cost_rbc['ramping']
-
-        # Finds the load factor for every month (average monthly demand divided by its maximum peak), and averages all the load factors across the 12 months. The metric is one minus the load factor.
-        if '1-load_factor' in self.cost_function:
-            cost['1-load_factor'] = np.mean([1-np.mean(self.net_electric_consumption[i:i+int(8760/12)])/ np.max(self.net_electric_consumption[i:i+int(8760/12)]) for i in range(0,len(self.net_electric_consumption), int(8760/12))])/self.cost_rbc['1-load_factor']
-
-        # Average of all the daily peaks of the 365 day of the year. The peaks are calculated using the net energy demand of the whole district of buildings.
-        if 'average_daily_peak' in self.cost_function:
-            cost['average_daily_peak'] = np.mean([np.max(self.net_electric_consumption[i:i+24]) for i in range(0,len(self.net_electric_consumption),24)])/self.cost_rbc['average_daily_peak']
-
-        # Peak demand of the district for the whole year period.
-        if 'peak_demand' in self.cost_function:
-            cost['peak_demand'] = np.max(self.net_electric_consumption)/self.cost_rbc['peak_demand']
-
-        # Positive net electricity consumption for the whole district. It is clipped at a min. value of 0 because the objective is to minimize the energy consumed in the district, not to profit from the excess generation. (Island operation is therefore incentivized)
-        if 'net_electricity_consumption' in self.cost_function:
-            cost['net_electricity_consumption'] = self.net_electric_consumption.clip(min=0).sum()/self.cost_rbc['net_electricity_consumption']
-
-        # Total line losses of the network
-        if 'system_losses' in self.cost_function:
-            cost['system_losses'] = -1*np.sum(self.system_losses)/self.cost_rbc['system_losses']
-
-        # Total line losses of the network
-        if 'voltage_dev' in self.cost_function:
-            cost['voltage_dev'] = -1*np.sum(self.voltage_dev)/self.cost_rbc['voltage_dev']
-
-        # Not used for the challenge
-        if 'quadratic' in self.cost_function:
-            cost['quadratic'] = (self.net_electric_consumption.clip(min=0)**2).sum()/self.cost_rbc['quadratic']
-
+        cost = {name: value/self.cost_rbc[name] for name, value in self.get_baseline_cost().items()}
         cost['total'] = np.mean([c for c in cost.values()])
 
         return cost
 
-    def get_baseline_cost(self):
-
-        # Computes the costs for the Rule-based controller, which are used to normalized the actual costs.
-        cost = {}
-        if 'ramping' in self.cost_function:
-            cost['ramping'] = np.abs((self.net_electric_consumption - np.roll(self.net_electric_consumption,1))[1:]).sum()
+    def current_kpis(self, normalize=False):
+        """ Returns the costs of the time steps of the episode so far, without going through the whole series. With normalize, they are normalized by the baseline costs as in cost() """
+        kpis = self.kpis.get_costs(self.cost_function)
+        if normalize:
+            self.get_rbc_cost()
+            kpis = {name: value/self.cost_rbc[name] for name, value in kpis.items()}
+        return kpis
 
-        if '1-load_factor' in self.cost_function:
-            cost['1-load_factor'] = np.mean([1 - np.mean(self.net_electric_consumption[i:i+int(8760/12)])/ np.max(self.net_electric_consumption[i:i+int(8760/12)]) for i in range(0, len(self.net_electric_consumption), int(8760/12))])
-
-        if 'average_daily_peak' in self.cost_function:
-            cost['average_daily_peak'] = np.mean([np.max(self.net_electric_consumption[i:i+24]) for i in range(0, len(self.net_electric_consumption), 24)])
-
-        if 'peak_demand' in self.cost_function:
-            cost['peak_demand'] = np.max(self.net_electric_consumption)
-
-        if 'net_electricity_consumption' in self.cost_function:
-            cost['net_electricity_consumption'] = np.array(self.net_electric_consumption).clip(min=0).sum()
-
-        if 'system_losses' in self.cost_function:
-            cost['system_losses'] = -1*np.sum(self.system_losses)
-
-        if 'voltage_dev' in self.cost_function:
-            cost['voltage_dev'] = -1*np.sum(self.voltage_dev)
-
-        if 'quadratic' in self.cost_function:
-            cost['quadratic'] = (np.array(self.net_electric_consumption).clip(min=0)**2).sum()
+    def get_baseline_cost(self):
 
-        return cost
+        # Computes the costs of the episode, which are not normalized (for the rule-based controller, they are used to normalize the actual costs). See citylearn.metrics
+        return get_costs(self.net_electric_consumption, self.cost_function, self.hourly_timesteps, getattr(self, 'system_losses', None), getattr(self, 'voltage_dev', None))
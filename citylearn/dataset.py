@@ -0,0 +1,447 @@
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from citylearn.upsampling import upsample, upsample_window, get_hour_window
+
+# Parsed csv files shared by every building (and every environment) of the process, keyed by (path, mtime)
+_CSV_CACHE = {}
+
+# Seed-independent series of the prototype buildings, shared read-only by all the buildings (and environments) of the
+# process that are created from the same prototype, keyed by the fingerprint of their sources
+_PROTOTYPE_CACHE = {}
+
+# Version of the layout of the on-disk dataset cache. Bump it whenever the series stored in the cache change.
+CACHE_VERSION = 4
+
+# Series that are linearly interpolated from the hourly values of the building csv file and of the weather file
+BUILDING_INTERP_COLUMNS = {'cooling_demand': 'Cooling Load [kWh]',
+                           't_in': 'Indoor Temperature [C]',
+                           'avg_unmet_setpoint': 'Average Unmet Cooling Setpoint Difference [C]',
+                           'rh_in': 'Indoor Relative Humidity [%]'}
+
+WEATHER_INTERP_COLUMNS = {'t_out': 'Outdoor Drybulb Temperature [C]',
+                          'rh_out': 'Outdoor Relative Humidity [%]',
+                          'diffuse_solar_rad': 'Diffuse Solar Radiation [W/m2]',
+                          'direct_solar_rad': 'Direct Solar Radiation [W/m2]',
+                          't_out_pred_6h': '6h Prediction Outdoor Drybulb Temperature [C]',
+                          't_out_pred_12h': '12h Prediction Outdoor Drybulb Temperature [C]',
+                          't_out_pred_24h': '24h Prediction Outdoor Drybulb Temperature [C]',
+                          'rh_out_pred_6h': '6h Prediction Outdoor Relative Humidity [%]',
+                          'rh_out_pred_12h': '12h Prediction Outdoor Relative Humidity [%]',
+                          'rh_out_pred_24h': '24h Prediction Outdoor Relative Humidity [%]',
+                          'diffuse_solar_rad_pred_6h': '6h Prediction Diffuse Solar Radiation [W/m2]',
+                          'diffuse_solar_rad_pred_12h': '12h Prediction Diffuse Solar Radiation [W/m2]',
+                          'diffuse_solar_rad_pred_24h': '24h Prediction Diffuse Solar Radiation [W/m2]',
+                          'direct_solar_rad_pred_6h': '6h Prediction Direct Solar Radiation [W/m2]',
+                          'direct_solar_rad_pred_12h': '12h Prediction Direct Solar Radiation [W/m2]',
+                          'direct_solar_rad_pred_24h': '24h Prediction Direct Solar Radiation [W/m2]'}
+
+# Calendar series, which keep their hourly value during every sub-hourly time step
+BUILDING_REPEAT_COLUMNS = {'month': 'Month',
+                           'day': 'Day Type',
+                           'hour': 'Hour',
+                           'daylight_savings_status': 'Daylight Savings Status'}
+
+class SimulationData:
+    """
+    Columnar store of the simulation series of a building. All the series are columns of a single contiguous float32
+    array of shape (time steps, series), and columns maps the name of every series to its column. The values of several
+    series at a time step can therefore be gathered with one fancy-index, data[time_step, index(names)].
+    Series are read and written by name like in a dict: reading returns a view of the column.
+
+    A store can be layered on top of a read-only base store (the series of a prototype building shared by all its
+    duplicates). Series that are not found in the store are read from the base, and writing a series of the base
+    copies it into the store (copy-on-write), so the base is never modified.
+
+    The bounds (min and max) of all the series are computed at once, the first time they are needed, and are kept until
+    the series are written again. The bounds of a base store are therefore computed once and shared by all the stores
+    built on top of it.
+
+    A store can hold a window of time steps only (window = (start, stop)): the series have their full length but the
+    other time steps are not loaded (they are zeros), and the bounds are those of the window.
+    """
+    def __init__(self, data = None, columns = None, base = None, bounds = None, window = None):
+        self.data = np.empty((0, 0), dtype=np.float32) if data is None else data
+        self.columns = {} if columns is None else dict(columns)
+        self.base = base
+        self._bounds = bounds
+        self.window = window
+
+    def __getitem__(self, name):
+        col = self.columns.get(name)
+        if col is None:
+            if self.base is None:
+                raise KeyError(name)
+            return self.base[name]
+        return self.data[:, col]
+
+    def __setitem__(self, name, values):
+        self.add_columns({name: values})
+
+    def __contains__(self, name):
+        return name in self.columns or (self.base is not None and name in self.base)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def keys(self):
+        if self.base is None:
+            return list(self.columns)
+        return [name for name in self.base.keys() if name not in self.columns] + list(self.columns)
+
+    def values(self):
+        return [self[name] for name in self.keys()]
+
+    def items(self):
+        return [(name, self[name]) for name in self.keys()]
+
+    @property
+    def n_steps(self):
+        if len(self.columns) == 0 and self.base is not None:
+            return self.base.n_steps
+        return self.data.shape[0]
+
+    def at(self, name, time_step):
+        """ Returns the value of a series at a time step as a python float """
+        col = self.columns.get(name)
+        if col is None:
+            if self.base is None:
+                raise KeyError(name)
+            return self.base.at(name, time_step)
+        return float(self.data[time_step, col])
+
+    def bounds(self, name):
+        """ Returns the (min, max) of a series as python floats """
+        col = self.columns.get(name)
+        if col is None:
+            if self.base is None:
+                raise KeyError(name)
+            return self.base.bounds(name)
+        if self._bounds is None:
+            self._bounds = self.get_bounds()
+        return float(self._bounds[0, col]), float(self._bounds[1, col])
+
+    def get_bounds(self):
+        """ Returns the bounds of all the series of this store (not of its base) as an array of shape (2, series) """
+        data = self.data if self.window is None else self.data[self.window[0]:self.window[1]]
+        if data.size == 0:
+            return np.empty((2, data.shape[1]), dtype=np.float32)
+        return np.stack([data.min(axis=0), data.max(axis=0)])
+
+    def covers(self, window):
+        """ Returns True if the time steps of window are loaded in the store and in its base """
+        if self.window is not None and (window is None or window[0] < self.window[0] or min(window[1], self.n_steps) > self.window[1]):
+            return False
+        return self.base is None or self.base.covers(window)
+
+    def index(self, names):
+        """ Returns the columns of a list of series stored in this store (not in its base) """
+        return np.array([self.columns[name] for name in names], dtype=np.intp)
+
+    def add_columns(self, series):
+        """ Writes several series at once. Existing series are overwritten in place, new ones (and series of the base) are
+        appended with a single reallocation of the array. """
+        self._bounds = None
+        new_series = {}
+        for name, values in series.items():
+            if name in self.columns:
+                self.data[:, self.columns[name]] = values
+            else:
+                new_series[name] = values
+
+        if len(new_series) > 0:
+            new_data = np.column_stack([np.asarray(values, dtype=np.float32) for values in new_series.values()])
+            if len(self.columns) == 0:
+                self.data = new_data
+            else:
+                self.data = np.concatenate([self.data, new_data], axis=1)
+
+            for name in new_series:
+                self.columns[name] = len(self.columns)
+
+    def copy(self):
+        """ Returns a copy of the store, which shares the same base """
+        return SimulationData(np.array(self.data, dtype=np.float32), self.columns, self.base, self._bounds, self.window)
+
+    def freeze(self):
+        """ Makes the store read-only, so that it can be shared as the base of other stores. Its bounds are computed at the same time. """
+        if self._bounds is None:
+            self._bounds = self.get_bounds()
+        self.data.setflags(write=False)
+        return self
+
+def stack_stores(stores):
+    """ Moves the series of stores that have the same columns into a single array of shape (stores, time steps, series), and returns it.
+    Every store keeps a view of its slice, so the values of all the stores at a time step are gathered with one index, stacked[:, time_step]. """
+    stacked = np.stack([store.data for store in stores]).astype(np.float32, copy=False)
+    for i, store in enumerate(stores):
+        store.data = stacked[i]
+    return stacked
+
+def get_stacked(stores):
+    """ Returns the array created by stack_stores if the stores still hold their slices of it (with the same columns), None otherwise """
+    stacked = stores[0].data.base if len(stores) > 0 else None
+    if stacked is None or stacked.ndim != 3 or stacked.shape[0] != len(stores):
+        return None
+    for i, store in enumerate(stores):
+        if store.data.base is not stacked or store.columns != stores[0].columns or store.data.shape != stacked.shape[1:] or not np.may_share_memory(store.data, stacked[i]):
+            return None
+    return stacked
+
+def read_csv_columns(csv_path, rows = None):
+    """ Returns the columns of a csv file as a dict of read-only numpy arrays. The file is parsed only once and the same
+    arrays are handed to every caller until the file is modified on disk. If rows = (first_row, last_row) is given, only
+    these rows are parsed, and the columns have the full length of the file with zeros in the other rows. """
+    csv_path = str(Path(csv_path).resolve())
+    key = (csv_path, os.stat(csv_path).st_mtime_ns, None if rows is None else tuple(rows))
+
+    columns = _CSV_CACHE.get(key)
+    if columns is None:
+        with open(csv_path) as csv_file:
+            if rows is None:
+                data = pd.read_csv(csv_file)
+            else:
+                data = pd.read_csv(csv_file, skiprows=range(1, rows[0] + 1), nrows=rows[1] - rows[0])
+                n_rows = count_csv_rows(csv_path)
+
+        columns = {}
+        for name in data.columns:
+            if rows is None:
+                columns[name] = data[name].to_numpy()
+            else:
+                values = data[name].to_numpy()
+                columns[name] = np.zeros(n_rows, dtype=values.dtype)
+                columns[name][rows[0]:rows[0] + len(values)] = values
+            columns[name].setflags(write=False) # shared between buildings, nobody should modify it in place
+
+        # Drop the entries of older versions of the same file
+        for stale_key in [k for k in _CSV_CACHE if k[0] == csv_path and k[1] != key[1]]:
+            del _CSV_CACHE[stale_key]
+        _CSV_CACHE[key] = columns
+
+    return columns
+
+def count_csv_rows(csv_path):
+    """ Returns the number of data rows of a csv file (without its header), without parsing it """
+    with open(csv_path, 'rb') as csv_file:
+        content = csv_file.read()
+    n_lines = content.count(b'\n') + (0 if content.endswith(b'\n') else 1)
+    return n_lines - 1
+
+def clear_csv_cache():
+    _CSV_CACHE.clear()
+    _PROTOTYPE_CACHE.clear()
+
+def subhourly_lin_interp(hourly_data, subhourly_steps):
+    """ Returns a linear interpolation of a data array """
+    return upsample(hourly_data, subhourly_steps, 'linear')
+
+def subhourly_noisy_interp(hourly_data, subhourly_steps):
+    """ Returns a noisy distribution of power consumption +/- 5% standard deviation of the original power draw."""
+    return upsample(hourly_data, subhourly_steps, 'noisy')
+
+def subhourly_randomdraw_interp(hourly_data, subhourly_steps, dhw_pwr, rng = None):
+    """ Returns a randomized binary distribution where demand = power*time when water is drawn, 0 otherwise.
+    Proportion of time with demand at full power corresponds to energy consumption at the hourly interval by E+.
+    The draws of the whole period are made at once: the sub-hourly steps of every hour are ranked randomly and water is drawn during the
+    first int(hour/subhourly_dhw_energy) of them (all of them if the heater can't meet the demand of that hour).
+    Args:
+        rng (np.random.Generator): random generator of the draws. If None, a generator seeded from the global numpy random state is used,
+        so that seeding numpy keeps the draws reproducible
+    Return:
+        data (np.array): float32 array of length len(hourly_data)*subhourly_steps
+    """
+    return upsample(hourly_data, subhourly_steps, 'randomdraw', power=dhw_pwr, rng=rng)
+
+def heat_pump_cop(eta_tech, t_target, t_out, heating):
+    """ Returns the hourly COP of a heat pump for the given outdoor temperatures, clipped to 20. The arguments are broadcast
+    together, so column vectors of parameters give a (heat pumps, hours) matrix of COPs. """
+    with np.errstate(divide='ignore'):
+        if heating:
+            cop = eta_tech*(t_target + 273.15)/(t_target - t_out)
+        else:
+            cop = eta_tech*(t_target + 273.15)/(t_out - t_target)
+    cop[cop < 0] = 20.0
+    cop[cop > 20] = 20.0
+    return cop
+
+def heat_pump_cops(weather_file, building_attributes, rows = None):
+    """ Returns the hourly COPs of the heat pumps of several buildings as a dict {uid: (cop_heating, cop_cooling)}.
+    The COPs of all the heat pumps with distinct parameters are computed at once as two (parameter sets, hours)
+    matrices, and the buildings whose heat pumps have the same parameters share the same read-only rows. If
+    rows = (first_row, last_row) is given, only these hours of the weather file are read (see read_csv_columns). """
+    t_out = read_csv_columns(weather_file, rows)['Outdoor Drybulb Temperature [C]']
+
+    params = {uid: tuple(attributes['Heat_Pump'][k] for k in ['technical_efficiency', 't_target_heating', 't_target_cooling']) for uid, attributes in building_attributes.items()}
+    unique_params = sorted(set(params.values()))
+    if len(unique_params) == 0:
+        return {}
+    eta_tech, t_target_heating, t_target_cooling = np.array(unique_params, dtype=np.float64).T[:, :, np.newaxis]
+
+    cop_heating = heat_pump_cop(eta_tech, t_target_heating, t_out[np.newaxis, :], heating=True)
+    cop_cooling = heat_pump_cop(eta_tech, t_target_cooling, t_out[np.newaxis, :], heating=False)
+    cop_heating.setflags(write=False)
+    cop_cooling.setflags(write=False)
+
+    rows = {p: i for i, p in enumerate(unique_params)}
+    return {uid: (cop_heating[rows[p]], cop_cooling[rows[p]]) for uid, p in params.items()}
+
+def build_sizing_series(data_path, uid, hourly_timesteps):
+    """ Returns a SimulationData with the cooling demand and the (hourly, not drawn yet) DHW demand of a building over all the time steps,
+    from which its devices are autosized. It is used in the lazy data mode, so that the devices have the same sizes as when all the time steps are loaded """
+    data = read_csv_columns(Path(data_path) / (str(uid) + '.csv'))
+    sizing_data = SimulationData()
+    sizing_data.add_columns({'cooling_demand': upsample(data[BUILDING_INTERP_COLUMNS['cooling_demand']], hourly_timesteps, 'linear'),
+                             'dhw_demand': upsample(data['DHW Heating [kWh]'], hourly_timesteps, 'repeat')})
+    return sizing_data
+
+def build_building_series(data_path, uid, attributes, weather_file, solar_profile, hourly_timesteps, window = None):
+    """ Returns the seed-independent series of a building as a tuple (series, hourly). series is a SimulationData with
+    the interpolated building, weather and solar series. hourly is a dict with the hourly inputs of the series that are
+    randomized every time the building is instantiated (non_shiftable_load and dhw_demand). The COPs of the heat pumps
+    are computed separately (see heat_pump_cops).
+    If window = (start, stop) is given, only the rows of the csv files needed by these time steps are parsed and only
+    these time steps are interpolated (see SimulationData). """
+    rows = None
+    if window is not None:
+        n_hours = count_csv_rows(Path(data_path) / (str(uid) + '.csv'))
+        rows = get_hour_window(window, n_hours, hourly_timesteps)
+        window = (window[0], min(window[1], n_hours*hourly_timesteps))
+
+    data = read_csv_columns(Path(data_path) / (str(uid) + '.csv'), rows)
+    weather_data = read_csv_columns(weather_file, rows)
+    solar_data = read_csv_columns(solar_profile, rows)
+
+    # All the interpolated columns of the building are upsampled as one (hours, columns) frame, and so are the calendar columns
+    interp_frame = [data[column] for column in BUILDING_INTERP_COLUMNS.values()]
+    interp_frame += [weather_data[column] for column in WEATHER_INTERP_COLUMNS.values()]
+    interp_frame.append(attributes['Solar_Power_Installed(kW)']*solar_data['Hourly Data: AC inverter power (W)']/1000)
+    interp_names = list(BUILDING_INTERP_COLUMNS) + list(WEATHER_INTERP_COLUMNS) + ['solar_gen']
+    repeat_frame = [data[column] for column in BUILDING_REPEAT_COLUMNS.values()]
+    if window is None:
+        interp_frame = upsample(np.column_stack(interp_frame), hourly_timesteps, 'linear')
+        repeat_frame = upsample(np.column_stack(repeat_frame), hourly_timesteps, 'repeat')
+    else:
+        interp_frame = upsample_window(np.column_stack(interp_frame), hourly_timesteps, window, 'linear')
+        repeat_frame = upsample_window(np.column_stack(repeat_frame), hourly_timesteps, window, 'repeat')
+
+    interp_series = {name: interp_frame[:, i] for i, name in enumerate(interp_names)}
+    repeat_series = {name: repeat_frame[:, i] for i, name in enumerate(BUILDING_REPEAT_COLUMNS)}
+    series = {name: interp_series[name] for name in BUILDING_INTERP_COLUMNS}
+    series.update(repeat_series)
+    series.update({name: interp_series[name] for name in interp_names[len(BUILDING_INTERP_COLUMNS):]})
+
+    hourly = {}
+    hourly['dhw_demand'] = np.array(data['DHW Heating [kWh]'])
+    hourly['non_shiftable_load'] = np.array(data['Equipment Electric Power [kWh]'])
+
+    if window is None:
+        simulation_data = SimulationData()
+        simulation_data.add_columns(series)
+    else:
+        # The series keep their full length, the time steps outside the window are zeros (np.zeros does not touch their memory)
+        simulation_data = SimulationData(np.zeros((n_hours*hourly_timesteps, len(series)), dtype=np.float32), {name: i for i, name in enumerate(series)}, window = window)
+        simulation_data.data[window[0]:window[1]] = np.column_stack(list(series.values()))
+    for values in hourly.values():
+        values.setflags(write=False)
+    return simulation_data.freeze(), hourly
+
+def get_cache_dir(cache_dir=None):
+    """ Returns the directory of the on-disk dataset cache (argument, or the CITYLEARN_CACHE_DIR environment variable),
+    or None if the cache is disabled """
+    if cache_dir is None:
+        cache_dir = os.environ.get('CITYLEARN_CACHE_DIR')
+    return None if cache_dir is None else Path(cache_dir)
+
+def _source_fingerprint(data_path, uid, attributes, weather_file, solar_profile, hourly_timesteps):
+    sources = []
+    for source in [Path(data_path) / (str(uid) + '.csv'), Path(weather_file), Path(solar_profile)]:
+        stat = os.stat(source)
+        sources.append([str(source.resolve()), stat.st_mtime_ns, stat.st_size])
+
+    return {'version': CACHE_VERSION,
+            'hourly_timesteps': hourly_timesteps,
+            'sources': sources,
+            'solar_power_installed': attributes['Solar_Power_Installed(kW)']}
+
+def _cache_entry(cache_dir, uid, attributes, hourly_timesteps):
+    return cache_dir / ('climate_zone_' + str(attributes['Climate_Zone'])) / (str(uid) + '_h' + str(hourly_timesteps))
+
+def load_building_series(data_path, uid, attributes, weather_file, solar_profile, hourly_timesteps, cache_dir=None, window=None):
+    """ Returns the seed-independent series of a prototype building (see build_building_series). They are loaded once per
+    process and are read-only, so that they can be shared by all the buildings created from that prototype. If a cache
+    directory is given, they are memory-mapped from the on-disk cache without parsing any file, and the cache entry is
+    (re)built if it is missing or outdated. Windows of time steps (see build_building_series) are not stored on disk. """
+    fingerprint = _source_fingerprint(data_path, uid, attributes, weather_file, solar_profile, hourly_timesteps)
+    key = json.dumps([fingerprint, None if window is None else list(window)], sort_keys=True)
+    if key in _PROTOTYPE_CACHE:
+        return _PROTOTYPE_CACHE[key]
+
+    cache_dir = get_cache_dir(cache_dir)
+    if cache_dir is None or window is not None:
+        prototype = build_building_series(data_path, uid, attributes, weather_file, solar_profile, hourly_timesteps, window)
+    else:
+        prototype = _load_cache_entry(_cache_entry(cache_dir, uid, attributes, hourly_timesteps), fingerprint)
+        if prototype is None:
+            prototype = build_building_series(data_path, uid, attributes, weather_file, solar_profile, hourly_timesteps)
+            write_cache_entry(_cache_entry(cache_dir, uid, attributes, hourly_timesteps), *prototype, fingerprint)
+
+    _PROTOTYPE_CACHE[key] = prototype
+    return prototype
+
+def _load_cache_entry(entry, fingerprint):
+    try:
+        with open(entry / 'meta.json') as json_file:
+            meta = json.load(json_file)
+        if meta['fingerprint'] == fingerprint:
+            series = SimulationData(np.load(entry / 'series.npy', mmap_mode='r'), meta['columns'], bounds = np.load(entry / 'bounds.npy'))
+            hourly = {name: np.load(entry / (name + '.npy'), mmap_mode='r') for name in meta['hourly']}
+            return series, hourly
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def write_cache_entry(entry, series, hourly, fingerprint):
+    """ Writes the series of a building into a cache entry. The entry is written into a temporary directory which is
+    then moved in place, so that concurrent jobs never see a partially written entry. """
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(prefix='.' + entry.name + '_', dir=entry.parent))
+    try:
+        np.save(tmp_dir / 'series.npy', np.ascontiguousarray(series.data))
+        np.save(tmp_dir / 'bounds.npy', series.get_bounds() if series._bounds is None else series._bounds)
+        for name, values in hourly.items():
+            np.save(tmp_dir / (name + '.npy'), np.ascontiguousarray(values))
+        with open(tmp_dir / 'meta.json', 'w') as json_file:
+            json.dump({'fingerprint': fingerprint, 'columns': series.columns, 'hourly': list(hourly)}, json_file)
+
+        if entry.exists():
+            shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp_dir, entry)
+    except OSError:
+        # Another job has written the same entry in the meantime
+        pass
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def build_dataset_cache(data_path, cache_dir, hourly_timesteps, building_ids=None, building_attributes='building_attributes.json', weather_file='weather_data.csv', solar_profile='solar_generation_1kW.csv'):
+    """ Pre-builds the on-disk cache of all the buildings (or only building_ids) of a climate zone. Returns the list of
+    cache entries. """
+    data_path = Path(data_path)
+    with open(data_path / building_attributes) as json_file:
+        data = json.load(json_file)
+
+    entries = []
+    for uid, attributes in data.items():
+        if building_ids is None or uid in building_ids:
+            for steps in np.atleast_1d(hourly_timesteps):
+                load_building_series(data_path, uid, attributes, data_path / weather_file, data_path / solar_profile, int(steps), cache_dir=cache_dir)
+                entries.append(_cache_entry(Path(cache_dir), uid, attributes, int(steps)))
+
+    return entries
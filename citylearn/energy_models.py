@@ -1,5 +1,6 @@
 from gym import spaces
 import numpy as np
+from citylearn.dataset import SimulationData
 
 class Building:
     def __init__(self, buildingId, hourly_timesteps, dhw_storage = None, cooling_storage = None, electrical_storage = None, dhw_heating_device = None, cooling_device = None, save_memory = True):
@@ -27,7 +28,7 @@ class Building:
         self.observation_space = None
         self.action_space = None
         self.time_step = 0
-        self.sim_results = {}
+        self.sim_results = SimulationData()
         self.save_memory = save_memory
 
         if self.dhw_storage is not None:
@@ -118,26 +119,28 @@ class Building:
             elec_demand_heating (float): electricity consumption needed for space heating and heating storage
         """
 
+        dhw_demand = self.sim_results.at('dhw_demand', self.time_step)
+
         # Heating power that could be possible to supply to the storage device to increase its State of Charge once the heating demand of the building has been satisfied
-        heat_power_avail = self.dhw_heating_device.get_max_heating_power() - self.sim_results['dhw_demand'][self.time_step]
+        heat_power_avail = self.dhw_heating_device.get_max_heating_power() - dhw_demand
 
         # The storage device is charged (action > 0) or discharged (action < 0) taking into account the max power available and that the storage device cannot be discharged by an amount of energy greater than the energy demand of the building.
-        heating_energy_balance = self.dhw_storage.charge(max(-self.sim_results['dhw_demand'][self.time_step], min(heat_power_avail, action*self.dhw_storage.capacity)))
+        heating_energy_balance = self.dhw_storage.charge(max(-dhw_demand, min(heat_power_avail, action*self.dhw_storage.capacity)))
 
         if self.save_memory == False:
             self.dhw_heating_device_to_storage.append(max(0, heating_energy_balance))
             self.dhw_storage_to_building.append(-min(0, heating_energy_balance))
-            self.dhw_heating_device_to_building.append(self.sim_results['dhw_demand'][self.time_step] + min(0, heating_energy_balance))
+            self.dhw_heating_device_to_building.append(dhw_demand + min(0, heating_energy_balance))
             self.dhw_storage_soc.append(self.dhw_storage._soc)
 
         # The energy that the energy supply device must provide is the sum of the energy balance of the storage unit (how much net energy it will lose or get) plus the energy supplied to the building. A constraint is added to guarantee it's always positive.
-        heating_energy_balance = max(0, heating_energy_balance + self.sim_results['dhw_demand'][self.time_step])
+        heating_energy_balance = max(0, heating_energy_balance + dhw_demand)
 
         # Electricity consumed by the energy supply unit
         elec_demand_heating = self.dhw_heating_device.set_total_electric_consumption_heating(heat_supply = heating_energy_balance)
 
         # Electricity consumption used (if +) or saved (if -) due to the change in the state of charge of the energy storage device
-        self._electric_consumption_dhw_storage = elec_demand_heating - self.dhw_heating_device.get_electric_consumption_heating(heat_supply = self.sim_results['dhw_demand'][self.time_step])
+        self._electric_consumption_dhw_storage = elec_demand_heating - self.dhw_heating_device.get_electric_consumption_heating(heat_supply = dhw_demand)
 
         if self.save_memory == False:
             self.electric_consumption_dhw.append(elec_demand_heating)
@@ -160,26 +163,28 @@ class Building:
                 elec_demand_cooling (float): electricity consumption needed for space cooling and cooling storage
         """
 
+        cooling_demand = self.sim_results.at('cooling_demand', self.time_step)
+
         # Cooling power that could be possible to supply to the storage device to increase its State of Charge once the heating demand of the building has been satisfied
-        cooling_power_avail = self.cooling_device.get_max_cooling_power() - self.sim_results['cooling_demand'][self.time_step]
+        cooling_power_avail = self.cooling_device.get_max_cooling_power() - cooling_demand
 
         # The storage device is charged (action > 0) or discharged (action < 0) taking into account the max power available and that the storage device cannot be discharged by an amount of energy greater than the energy demand of the building.
-        cooling_energy_balance = self.cooling_storage.charge(max(-self.sim_results['cooling_demand'][self.time_step], min(cooling_power_avail, action*self.cooling_storage.capacity)))
+        cooling_energy_balance = self.cooling_storage.charge(max(-cooling_demand, min(cooling_power_avail, action*self.cooling_storage.capacity)))
 
         if self.save_memory == False:
             self.cooling_device_to_storage.append(max(0, cooling_energy_balance))
             self.cooling_storage_to_building.append(-min(0, cooling_energy_balance))
-            self.cooling_device_to_building.append(self.sim_results['cooling_demand'][self.time_step] + min(0, cooling_energy_balance))
+            self.cooling_device_to_building.append(cooling_demand + min(0, cooling_energy_balance))
             self.cooling_storage_soc.append(self.cooling_storage._soc)
 
         # The energy that the energy supply device must provide is the sum of the energy balance of the storage unit (how much net energy it will lose or get) plus the energy supplied to the building. A constraint is added to guarantee it's always positive.
-        cooling_energy_balance = max(0, cooling_energy_balance + self.sim_results['cooling_demand'][self.time_step])
+        cooling_energy_balance = max(0, cooling_energy_balance + cooling_demand)
 
         # Electricity consumed by the energy supply unit
         elec_demand_cooling = self.cooling_device.set_total_electric_consumption_cooling(cooling_supply = cooling_energy_balance)
 
         # Electricity consumption used (if +) or saved (if -) due to the change in the state of charge of the energy storage device
-        self._electric_consumption_cooling_storage = elec_demand_cooling - self.cooling_device.get_electric_consumption_cooling(cooling_supply = self.sim_results['cooling_demand'][self.time_step])
+        self._electric_consumption_cooling_storage = elec_demand_cooling - self.cooling_device.get_electric_consumption_cooling(cooling_supply = cooling_demand)
 
         if self.save_memory == False:
             self.electric_consumption_cooling.append(np.float32(elec_demand_cooling))
@@ -191,10 +196,10 @@ class Building:
 
 
     def get_non_shiftable_load(self):
-        return self.sim_results['non_shiftable_load'][self.time_step]
+        return self.sim_results.at('non_shiftable_load', self.time_step)
 
     def get_solar_power(self, curtailment=-1):
-         self.solar_power = (1 - .5 * curtailment + 0.5) * self.sim_results['solar_gen'][self.time_step] # @AKP change to make solar_power accessible, where curtailment action is applied only 1x per timestep instead of at .step() and .aux_grid_function()
+         self.solar_power = (1 - .5 * curtailment + 0.5) * self.sim_results.at('solar_gen', self.time_step) # @AKP change to make solar_power accessible, where curtailment action is applied only 1x per timestep instead of at .step() and .aux_grid_function()
          return self.solar_power
 
     #def set_target_vm(self, voltage_shift=0):
@@ -218,7 +223,7 @@ class Building:
 
     def reset(self):
 
-        self.current_net_electricity_demand = self.sim_results['non_shiftable_load'][self.time_step] - self.sim_results['solar_gen'][self.time_step]
+        self.current_net_electricity_demand = self.sim_results.at('non_shiftable_load', self.time_step) - self.sim_results.at('solar_gen', self.time_step)
 
         if self.dhw_storage is not None:
             self.dhw_storage.reset()
@@ -228,10 +233,10 @@ class Building:
             self.electrical_storage.reset()
         if self.dhw_heating_device is not None:
             self.dhw_heating_device.reset()
-            self.current_net_electricity_demand += self.dhw_heating_device.get_electric_consumption_heating(self.sim_results['dhw_demand'][self.time_step])
+            self.current_net_electricity_demand += self.dhw_heating_device.get_electric_consumption_heating(self.sim_results.at('dhw_demand', self.time_step))
         if self.cooling_device is not None:
             self.cooling_device.reset()
-            self.current_net_electricity_demand += self.cooling_device.get_electric_consumption_cooling(self.sim_results['cooling_demand'][self.time_step])
+            self.current_net_electricity_demand += self.cooling_device.get_electric_consumption_cooling(self.sim_results.at('cooling_demand', self.time_step))
 
         self._electric_consumption_cooling_storage = 0.0
         self._electric_consumption_dhw_storage = 0.0
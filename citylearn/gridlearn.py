@@ -3,34 +3,58 @@ from pandapower import runpp
 from pandapower.plotting import simple_plotly, pf_res_plotly
 import pandapower.networks as networks
 from citylearn import CityLearn
-from citylearn import RBC_Agent
+from citylearn.citylearn import SEED
+from citylearn.power_flow import RadialPowerFlow
+from citylearn.recorder import PowerFlowRecorder
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from pathlib import Path
 import random
 
+# Results of the power flow recorded at every time step: result table and column of every variable
+OUTPUT_VARIABLES = {'p_mw_load': ('res_load', 'p_mw'),
+                    'q_mvar_gen': ('res_gen', 'q_mvar'),
+                    'vm_pu': ('res_bus', 'vm_pu'),
+                    'i_ka': ('res_line', 'i_ka'),
+                    'p_mw_stor': ('res_storage', 'p_mw'),
+                    'p_mw_gen': ('res_gen', 'p_mw')}
+
 class GridLearn(CityLearn):
-    def __init__(self, data_path, building_attributes, weather_file, solar_profile, building_ids, hourly_timesteps, buildings_states_actions = None, simulation_period = (0,8759), cost_function = ['ramping','1-load_factor','average_daily_peak', 'peak_demand','net_electricity_consumption'], central_agent = False, verbose = 0, n_buildings_per_bus=4, pv_penetration=0.3, test=False):
+    def __init__(self, data_path, building_attributes, weather_file, solar_profile, building_ids, hourly_timesteps, buildings_states_actions = None, simulation_period = (0,8759), cost_function = ['ramping','1-load_factor','average_daily_peak', 'peak_demand','net_electricity_consumption'], central_agent = False, verbose = 0, n_buildings_per_bus=4, pv_penetration=0.3, test=False, cache_dir=None, n_jobs=None, lazy=False, step_engine='vectorized', power_flow_backend='pandapower', output_dir=None, output_chunk_size=1000, background_baseline=False, seed=SEED):
+        if power_flow_backend not in ['pandapower', 'native']:
+            raise ValueError("power_flow_backend must be 'pandapower' or 'native'")
+        self.power_flow_backend = power_flow_backend
+        self.power_flow = None
+        self.recorder = PowerFlowRecorder(OUTPUT_VARIABLES, output_dir, output_chunk_size)
         self.test = test
+        self.pv_penetration = pv_penetration
+        self.n_buildings_per_bus = n_buildings_per_bus
         if self.test:
             self.net = self.make_test_grid()
         else:
             self.net = self.make_grid()
         n_buildings = n_buildings_per_bus * (len(self.net.bus)-1)
-        super().__init__(data_path, building_attributes, weather_file, solar_profile, building_ids, hourly_timesteps, buildings_states_actions, simulation_period, cost_function, central_agent, verbose, n_buildings)
+        super().__init__(data_path, building_attributes, weather_file, solar_profile, building_ids, hourly_timesteps, buildings_states_actions, simulation_period, cost_function, central_agent, verbose, n_buildings, cache_dir, n_jobs, lazy, step_engine, background_baseline, seed)
         self.house_nodes = self.add_houses(n_buildings_per_bus, pv_penetration)
-        # for some reason it seems like the output_writer for panda power only applies to deterministic time series
-        self.output = {'p_mw_load':{'var':'p_mw', 'parent':'res_load', 'values':pd.DataFrame()},
-           'q_mvar_gen':{'var':'q_mvar', 'parent':'res_gen', 'values':pd.DataFrame()},
-           'vm_pu':{'var':'vm_pu', 'parent':'res_bus', 'values':pd.DataFrame()},
-           'i_ka':{'var':'i_ka', 'parent':'res_line', 'values':pd.DataFrame()},
-           'p_mw_stor':{'var':'p_mw', 'parent':'res_storage', 'values':pd.DataFrame()},
-           'p_mw_gen':{'var':'p_mw', 'parent':'res_gen', 'values':pd.DataFrame()}}
+
+        # Positions of the end buses of every line and of the bus of every building in the results of the power flow, which are in the order of net.bus.
+        # The buildings that are not connected to the grid have no bus (-1)
+        self.line_from_bus = self.net.bus.index.get_indexer(self.net.line.from_bus)
+        self.line_to_bus = self.net.bus.index.get_indexer(self.net.line.to_bus)
+        self.building_bus = self.net.bus.index.get_indexer([self.house_buses.get(uid, -1) for uid in self.buildings])
+
+        # Loads and static generators of the buildings and position of their building in self.buildings. The other ones are left unchanged
+        building_index = {uid: i for i, uid in enumerate(self.buildings)}
+        self.building_loads = self.net.load.index[self.net.load.name.isin(building_index)]
+        self.load_building = np.array([building_index[name] for name in self.net.load.name[self.building_loads]], dtype=np.intp)
+        self.building_sgens = self.net.sgen.index[self.net.sgen.name.isin(building_index)]
+        self.sgen_building = np.array([building_index[name] for name in self.net.sgen.name[self.building_sgens]], dtype=np.intp)
+
+        # The power flow model is built once, after the houses are added
+        self.invalidate_power_flow()
         self.system_losses = []
         self.voltage_dev = []
-        self.pv_penetration = pv_penetration
-        self.n_buildings_per_bus = n_buildings_per_bus
 
     def make_test_grid(self):
         net = pp.create_empty_network(name="single bus network")
@@ -68,6 +92,7 @@ class GridLearn(CityLearn):
         delta_y = 0.2
 
         all_buildings = list(self.buildings.keys())
+        self.house_buses = {}
 
         for existing_node in res_load_nodes:
             # remove the existing arbitrary load
@@ -86,6 +111,7 @@ class GridLearn(CityLearn):
                 new_house = pp.create_bus(self.net, name=bid, vn_kv=12.66, max_vm_pu=1.2, min_vm_pu=0.8, zone=1, geodata=(new_x, new_y))
                 new_feeder = pp.create_line(self.net, new_house, existing_node, 0.5, "94-AL1/15-ST1A 0.4", max_loading_percent=100)
                 new_house_load = pp.create_load(self.net, new_house, 0, name=bid)
+                self.house_buses[bid] = new_house
 
 #                 if self.buildings_states_actions[bid]['pv_curtail']:
                 if np.random.uniform() <= pv_penetration:
@@ -95,69 +121,87 @@ class GridLearn(CityLearn):
 
     # Change to citylearn.py: aux_grid_function is called at the end of .step()
     def aux_grid_func(self):
-        for i in self.net.load.index:
-            if self.test:
-                current_load = 0.01
-            else:
-                current_load = 0
-                h = self.net.load.name[i]
-                current_load += self.buildings[h].get_dhw_electric_demand() * 0.001
-                current_load += self.buildings[h].get_non_shiftable_load() * 0.001
-                current_load += self.buildings[h].get_cooling_electric_demand() * 0.001
-
-                # TBD const_i_percent by appliance (check PNNL reports)
-                self.net.load.at[i, 'const_i_percent'] = 2.0 * self.buildings[h].get_cooling_electric_demand() * 0.001 / current_load
-                self.net.load.at[i, 'const_i_percent'] = 3.0 * self.buildings[h].get_non_shiftable_load() * 0.001 / current_load
-
-            self.net.load.at[i, 'p_mw'] = 0.9 * current_load
-            self.net.load.at[i, 'sn_mva'] = current_load
-
-        for j in self.net.sgen.index:
-            h = self.net.sgen.name[j]
-            current_gen = self.buildings[h].solar_power * 0.001
-            phi = self.buildings[h].v_lag
-            self.net.sgen.at[j,'p_mw'] = current_gen*np.cos(phi)
-            self.net.sgen.at[j,'q_mvar'] = current_gen*np.sin(phi)
-
-        runpp(self.net, enforce_q_lims=True)
+        # The loads and the static generators are updated with one column assignment per variable
+        dhw_demand, non_shiftable_load, cooling_demand, solar_power, v_lag = self.get_buildings_power()
+        if self.test:
+            self.net.load['p_mw'] = 0.9 * 0.01
+            self.net.load['sn_mva'] = 0.01
+        else:
+            buildings = self.load_building
+            current_load = dhw_demand[buildings] * 0.001 + non_shiftable_load[buildings] * 0.001 + cooling_demand[buildings] * 0.001
+
+            # TBD const_i_percent by appliance (check PNNL reports). The loads of the buildings without demand have no constant current part
+            const_i_percent = np.divide(3.0 * non_shiftable_load[buildings] * 0.001, current_load, out=np.zeros(len(current_load)), where=current_load != 0)
+            self.net.load.loc[self.building_loads, ['p_mw', 'sn_mva', 'const_i_percent']] = np.column_stack([0.9 * current_load, current_load, const_i_percent])
+
+        current_gen = solar_power[self.sgen_building] * 0.001
+        phi = v_lag[self.sgen_building]
+        self.net.sgen.loc[self.building_sgens, ['p_mw', 'q_mvar']] = np.column_stack([current_gen*np.cos(phi), current_gen*np.sin(phi)])
+
+        if self.power_flow is not None:
+            self.power_flow.run()
+        else:
+            runpp(self.net, enforce_q_lims=True)
 
         self.calc_system_losses()
         self.calc_voltage_dev()
+        self.calc_total_voltage_spread()
+        self.calc_relative_voltage()
 
         # write these value to the output writer:
-        for k, v in self.output.items():
-            self.output[k]['values'][str(self.time_step)] = self.net[v['parent']][v['var']]
-
-    def calc_system_losses(self):
-        self.system_losses += list((self.net.res_ext_grid.p_mw + self.net.res_load.p_mw.sum() - self.net.res_gen.p_mw.sum()).values)
+        self.recorder.record(self.net, self.time_step)
 
-    def calc_voltage_dev(self):
-        self.voltage_dev += list(abs((self.net.res_bus['vm_pu']-1)/0.05))
+    @property
+    def output(self):
+        """ Returns the recorded results of the power flow, as DataFrames of the elements x time steps built on request """
+        return {name: {'var': column, 'parent': parent, 'values': self.recorder.get_frame(name)} for name, (parent, column) in OUTPUT_VARIABLES.items()}
 
-    def get_rbc_cost(self):
-        # Running the reference rule-based controller to find the baseline cost
-        if self.cost_rbc is None:
-            env_rbc = GridLearn(self.data_path, self.building_attributes, self.weather_file, self.solar_profile, self.building_ids, hourly_timesteps=self.hourly_timesteps, buildings_states_actions = self.buildings_states_actions_filename, simulation_period = self.simulation_period, cost_function = self.cost_function, central_agent = False, n_buildings_per_bus=self.n_buildings_per_bus, pv_penetration=self.pv_penetration)
-            _, actions_spaces = env_rbc.get_state_action_spaces()
+    def invalidate_power_flow(self):
+        """ Rebuilds the model of the power flow. It must be called whenever the topology of self.net is changed (buses, lines, loads or static generators added, removed or taken out of service) """
+        self.power_flow = RadialPowerFlow(self.net) if self.power_flow_backend == 'native' else None
 
-            #Instantiatiing the control agent(s)
-            agent_rbc = RBC_Agent(env_rbc)
+    def calc_system_losses(self):
+        losses = (self.net.res_ext_grid.p_mw + self.net.res_load.p_mw.sum() - self.net.res_gen.p_mw.sum()).values
+        self.system_losses += list(losses)
+        self.kpis.add('system_losses', losses)
 
-            state = env_rbc.reset()
-            done = False
-            while not done:
-                action = agent_rbc.select_action([list(env_rbc.buildings.values())[0].sim_results['hour'][env_rbc.time_step]])
-                next_state, rewards, done, _ = env_rbc.step(action)
-                state = next_state
-            self.cost_rbc = env_rbc.get_baseline_cost()
+    def calc_voltage_dev(self):
+        voltage_dev = abs((self.net.res_bus['vm_pu']-1)/0.05)
+        self.voltage_dev += list(voltage_dev)
+        self.kpis.add('voltage_dev', voltage_dev)
+
+    def calc_total_voltage_spread(self):
+        # Sum over the lines of the voltage difference between their ends. It is the same for all the buildings, so it is computed once per time step
+        vm_pu = self.net.res_bus['vm_pu'].to_numpy()
+        self.total_voltage_spread = np.abs(vm_pu[self.line_to_bus] - vm_pu[self.line_from_bus]).sum()
+
+    def calc_relative_voltage(self):
+        # Voltage of the bus of every building ranked against all the buses of the grid (0.5 for the buildings that are not connected), with a single ranking pass
+        rank = self.net.res_bus['vm_pu'].rank(pct=True).to_numpy()
+        self.relative_voltage = np.where(self.building_bus >= 0, rank[self.building_bus], 0.5)
+
+    def get_baseline_config(self):
+        """ Returns everything the baseline cost depends on, including the grid """
+        config = super().get_baseline_config()
+        config.update({'n_buildings_per_bus': self.n_buildings_per_bus, 'pv_penetration': self.pv_penetration, 'power_flow_backend': self.power_flow_backend})
+        return config
+
+    def get_rbc_kwargs(self):
+        """ Returns the arguments of a new environment with the configuration of this one, which is controlled by the rule-based controller """
+        return dict(data_path=self.data_path, building_attributes=self.building_attributes, weather_file=self.weather_file, solar_profile=self.solar_profile, building_ids=self.building_ids, hourly_timesteps=self.hourly_timesteps, buildings_states_actions = self.buildings_states_actions_filename, simulation_period = self.simulation_period, cost_function = self.cost_function, central_agent = False, n_buildings_per_bus=self.n_buildings_per_bus, pv_penetration=self.pv_penetration, cache_dir=self.cache_dir, n_jobs=self.n_jobs, lazy=self.lazy, step_engine=self.step_engine, power_flow_backend=self.power_flow_backend, seed=self.random_seed)
 
     def reset(self):
         self.system_losses = []
         self.voltage_dev = []
-        return super().reset()
+        # Every episode starts from a flat voltage profile, so that the episodes do not depend on the previous ones
+        if self.power_flow is not None:
+            self.power_flow.reset()
+        state = super().reset()
+        self.recorder.reset(len(self.hour))
+        return state
 
     def plot_buses(self):
-        df = self.output['vm_pu']['values']
+        df = self.recorder.get_frame('vm_pu')
         xfmr = set(self.net.bus.iloc[self.net.trafo.hv_bus].index) | set(self.net.bus.iloc[self.net.trafo.lv_bus].index)
         ext_grid = set(self.net.bus.iloc[self.net.ext_grid.bus].index)
         substation = xfmr | ext_grid
@@ -223,6 +267,6 @@ class GridLearn(CityLearn):
 
     def plot_all(self):
         self.plot_buses()
-        self.plot_northsouth([self.output['p_mw_load']['values']], title="Building loads", y=["P (MW)"])
-        self.plot_northsouth([self.output['p_mw_gen']['values'], self.output['q_mvar_gen']['values']], title="Generation", y=["P (MW)", "Q (MVAR)"])
+        self.plot_northsouth([self.recorder.get_frame('p_mw_load')], title="Building loads", y=["P (MW)"])
+        self.plot_northsouth([self.recorder.get_frame('p_mw_gen'), self.recorder.get_frame('q_mvar_gen')], title="Generation", y=["P (MW)", "Q (MVAR)"])
         plt.show()
@@ -0,0 +1,171 @@
+"""
+Cost metrics of the net electricity consumption of the district, shared by CityLearn.cost() (normalized by the baseline)
+and CityLearn.get_baseline_cost(). The time steps are grouped into days of 24*hourly_timesteps steps and months of
+730*hourly_timesteps steps (8760/12 hours), counted from the start of the episode. A day or a month that is cut by the
+end of the episode is a window of its own.
+
+get_costs() computes every metric of a whole series with one reduction each: the series is padded with NaN to a whole
+number of windows and reshaped into (windows, steps per window). CostAccumulator computes the same metrics one time step
+at a time, in O(1) per step, so that they are available during an episode (see CityLearn.current_kpis). The series
+of the grid are added to it with add().
+"""
+import numpy as np
+
+# Hours of the windows of the daily peaks and of the monthly load factors
+HOURS_PER_DAY = 24
+HOURS_PER_MONTH = 8760//12
+
+# Metrics of the consumption of the district
+CONSUMPTION_COSTS = ['ramping', '1-load_factor', 'average_daily_peak', 'peak_demand', 'net_electricity_consumption', 'quadratic']
+
+# Costs of the grid (GridLearn), minus the sum of their series
+GRID_COSTS = ['system_losses', 'voltage_dev']
+
+def get_windows(values, size):
+    """ Returns the values as an array of shape (windows, size), the last window being padded with NaN """
+    values = np.asarray(values, dtype=np.float64)
+    windows = -(-len(values)//size)
+    padded = np.full(windows*size, np.nan)
+    padded[:len(values)] = values
+    return padded.reshape(windows, size)
+
+def get_costs(net_electric_consumption, cost_function, hourly_timesteps=1, system_losses=None, voltage_dev=None):
+    """
+    Returns the costs of an episode, which are not normalized.
+    Args:
+        net_electric_consumption (array): net electricity consumption of the district at every time step
+        cost_function (list): names of the costs
+        hourly_timesteps (int): number of time steps per hour
+        system_losses (list): losses of the grid at every time step (GridLearn)
+        voltage_dev (list): voltage deviations of the buses at every time step (GridLearn)
+    """
+    consumption = np.asarray(net_electric_consumption, dtype=np.float64)
+    cost = {}
+    if 'ramping' in cost_function:
+        cost['ramping'] = np.abs(np.diff(consumption)).sum()
+
+    # One minus the load factor (average demand divided by the peak demand) of every month, averaged across the months
+    if '1-load_factor' in cost_function:
+        months = get_windows(consumption, HOURS_PER_MONTH*hourly_timesteps)
+        cost['1-load_factor'] = np.mean(1 - np.nanmean(months, axis=1)/np.nanmax(months, axis=1))
+
+    # Average of the daily peaks of the district
+    if 'average_daily_peak' in cost_function:
+        cost['average_daily_peak'] = np.mean(np.nanmax(get_windows(consumption, HOURS_PER_DAY*hourly_timesteps), axis=1))
+
+    if 'peak_demand' in cost_function:
+        cost['peak_demand'] = np.max(consumption)
+
+    # The consumption is clipped at 0, as the objective is to minimize the energy consumed in the district, not to profit from the excess generation
+    if 'net_electricity_consumption' in cost_function:
+        cost['net_electricity_consumption'] = consumption.clip(min=0).sum()
+
+    if 'system_losses' in cost_function:
+        cost['system_losses'] = -1*np.sum(system_losses)
+
+    if 'voltage_dev' in cost_function:
+        cost['voltage_dev'] = -1*np.sum(voltage_dev)
+
+    if 'quadratic' in cost_function:
+        cost['quadratic'] = (consumption.clip(min=0)**2).sum()
+
+    return cost
+
+class CostAccumulator:
+    def __init__(self, hourly_timesteps=1):
+        """ Costs of the net electricity consumption of the district and of the grid, updated one time step at a time (same windows as get_costs) """
+        self.steps_per_day = HOURS_PER_DAY*hourly_timesteps
+        self.steps_per_month = HOURS_PER_MONTH*hourly_timesteps
+        self.reset()
+
+    def reset(self):
+        self.steps = 0
+        self.last = None
+        self.ramping = 0.
+        self.peak = -np.inf
+        self.positive = 0.
+        self.quadratic = 0.
+
+        # Sums of the series of the grid, e.g. system_losses
+        self.sums = {}
+
+        # Peak of the current day and sum of the peaks of the previous days
+        self.day_peak = -np.inf
+        self.day_peaks = 0.
+        self.days = 0
+
+        # Sum and peak of the current month and sum of the load factors of the previous months
+        self.month_sum = 0.
+        self.month_peak = -np.inf
+        self.month_steps = 0
+        self.load_factors = 0.
+        self.months = 0
+
+    def update(self, value):
+        """ Adds the net electricity consumption of the district at a time step """
+        value = float(value)
+        if self.last is not None:
+            self.ramping += abs(value - self.last)
+        self.last = value
+        self.peak = max(self.peak, value)
+        positive = max(value, 0.)
+        self.positive += positive
+        self.quadratic += positive**2
+
+        self.day_peak = max(self.day_peak, value)
+        self.month_sum += value
+        self.month_peak = max(self.month_peak, value)
+        self.month_steps += 1
+        self.steps += 1
+
+        # The windows are closed at their last time step
+        if self.steps % self.steps_per_day == 0:
+            self.day_peaks += self.day_peak
+            self.days += 1
+            self.day_peak = -np.inf
+        if self.month_steps == self.steps_per_month:
+            self.load_factors += 1 - self.month_sum/self.month_steps/self.month_peak
+            self.months += 1
+            self.month_sum, self.month_peak, self.month_steps = 0., -np.inf, 0
+
+    def add(self, name, values):
+        """ Adds the values of a series of the grid (one of GRID_COSTS) at a time step """
+        self.sums[name] = self.sums.get(name, 0.) + float(np.sum(values))
+
+    def get_costs(self, cost_function):
+        """ Returns the costs of the time steps added so far, which are not normalized. The day and the month in progress are windows of their own """
+        cost = {}
+        if self.steps == 0:
+            return cost
+
+        if 'ramping' in cost_function:
+            cost['ramping'] = self.ramping
+
+        if '1-load_factor' in cost_function:
+            load_factors, months = self.load_factors, self.months
+            if self.month_steps > 0:
+                load_factors += 1 - self.month_sum/self.month_steps/self.month_peak
+                months += 1
+            cost['1-load_factor'] = load_factors/months
+
+        if 'average_daily_peak' in cost_function:
+            day_peaks, days = self.day_peaks, self.days
+            if self.steps % self.steps_per_day != 0:
+                day_peaks += self.day_peak
+                days += 1
+            cost['average_daily_peak'] = day_peaks/days
+
+        if 'peak_demand' in cost_function:
+            cost['peak_demand'] = self.peak
+
+        if 'net_electricity_consumption' in cost_function:
+            cost['net_electricity_consumption'] = self.positive
+
+        for name in GRID_COSTS:
+            if name in cost_function and name in self.sums:
+                cost[name] = -1*self.sums[name]
+
+        if 'quadratic' in cost_function:
+            cost['quadratic'] = self.quadratic
+
+        return cost
@@ -0,0 +1,121 @@
+"""
+Observations of the buildings of a district. ObservationLayout is compiled once from buildings_states_actions: every
+building has a row of a preallocated (buildings, obs_dim) float32 buffer, and every one of its states a slot of that row.
+At every step the buffer is filled with a few gathers instead of walking the states of every building:
+
+    series      the states read from the simulation data, gathered once per group of buildings with the same prototype and states
+                (the series of the prototype from its data, the randomized series from the array created by stack_stores)
+    building    net_electricity_consumption, cooling_storage_soc, dhw_storage_soc, relative_voltage, one value per building
+    district    total_voltage_spread, the same value for all the buildings
+
+The observation of a central agent is gathered from the buffer with a precomputed index, which includes the states that
+are not in CENTRAL_AGENT_BUILDING_STATES (weather variables) once only.
+"""
+import numpy as np
+from citylearn.dataset import get_stacked
+
+# States that are not read from the simulation data
+BUILDING_STATES = ['net_electricity_consumption', 'cooling_storage_soc', 'dhw_storage_soc', 'relative_voltage']
+DISTRICT_STATES = ['total_voltage_spread']
+
+# States included once per building in the observation of a central agent. The other states are only included once.
+CENTRAL_AGENT_BUILDING_STATES = ['t_in', 'avg_unmet_setpoint', 'rh_in', 'non_shiftable_load', 'solar_gen', 'net_electricity_consumption', 'relative_voltage', 'total_voltage_spread', 'cooling_storage_soc', 'dhw_storage_soc']
+
+class ObservationLayout:
+    def __init__(self, buildings, buildings_states_actions):
+        """
+        Args:
+            buildings (dict): buildings of the district, in the order of the observations
+            buildings_states_actions (dict): states and actions of every building
+        """
+        self.uids = list(buildings)
+        self.states = [[name for name, value in buildings_states_actions[uid]['states'].items() if value == True] for uid in self.uids]
+        self.dims = np.array([len(states) for states in self.states], dtype=np.intp)
+        self.obs_dim = int(self.dims.max()) if len(self.uids) > 0 else 0
+        self.buffer = np.zeros((len(self.uids), self.obs_dim), dtype=np.float32)
+
+        # Slots (rows, columns) of the states of the buildings and of the district
+        self.slots = {}
+        for name in BUILDING_STATES + DISTRICT_STATES:
+            slots = [(i, states.index(name)) for i, states in enumerate(self.states) if name in states]
+            self.slots[name] = tuple(np.array(index, dtype=np.intp) for index in zip(*slots)) if len(slots) > 0 else None
+
+        # Index of the observation of a central agent in the flattened buffer
+        central_index, appended_states = [], []
+        for i, states in enumerate(self.states):
+            for j, name in enumerate(states):
+                if name in CENTRAL_AGENT_BUILDING_STATES or name not in appended_states:
+                    central_index.append(i*self.obs_dim + j)
+                    if name not in CENTRAL_AGENT_BUILDING_STATES:
+                        appended_states.append(name)
+        self.central_index = np.array(central_index, dtype=np.intp)
+
+        self.bind(buildings)
+
+    def bind(self, buildings):
+        """ Finds the series of the states in the simulation data of the buildings. It is called again whenever the data of the buildings is reloaded. """
+        buildings = [buildings[uid] for uid in self.uids]
+        stores = [building.sim_results for building in buildings]
+        self.stacked = get_stacked(stores)
+
+        # The buildings created from the same prototype share their series and (most of the time) their states, so their series states are gathered together
+        groups = {}
+        for i, (store, states) in enumerate(zip(stores, self.states)):
+            groups.setdefault((id(store.base), tuple(states), tuple(store.columns.items())), []).append(i)
+
+        self.groups = []
+        for rows in groups.values():
+            store, states = stores[rows[0]], self.states[rows[0]]
+            slots = [j for j, name in enumerate(states) if name not in BUILDING_STATES + DISTRICT_STATES]
+            own_slots = np.array([j for j in slots if states[j] in store.columns], dtype=np.intp)
+            base_slots = np.array([j for j in slots if states[j] not in store.columns], dtype=np.intp)
+            self.groups.append({'rows': np.array(rows, dtype=np.intp),
+                                'stores': [stores[i] for i in rows],
+                                'base': store.base if len(base_slots) > 0 else None,
+                                'base_slots': base_slots,
+                                'base_columns': store.base.index([states[j] for j in base_slots]) if len(base_slots) > 0 else None,
+                                'own_slots': own_slots,
+                                'own_columns': store.index([states[j] for j in own_slots])})
+
+    def fill(self, time_step, building_states, district_states):
+        """
+        Fills the buffer with the states of all the buildings at a time step and returns it.
+        Args:
+            building_states (dict): array of the values of all the buildings for each of BUILDING_STATES that is observed
+            district_states (dict): value of each of DISTRICT_STATES that is observed
+        """
+        buffer = self.buffer
+        for group in self.groups:
+            rows = group['rows']
+            if group['base'] is not None:
+                buffer[rows[:, np.newaxis], group['base_slots']] = group['base'].data[time_step, group['base_columns']]
+            if len(group['own_slots']) > 0:
+                if self.stacked is not None:
+                    own = self.stacked[rows, time_step][:, group['own_columns']]
+                else:
+                    own = np.array([store.data[time_step, group['own_columns']] for store in group['stores']])
+                buffer[rows[:, np.newaxis], group['own_slots']] = own
+
+        for name, slots in self.slots.items():
+            if slots is not None:
+                if name in DISTRICT_STATES:
+                    buffer[slots] = district_states[name]
+                else:
+                    buffer[slots] = np.asarray(building_states[name])[slots[0]]
+        return buffer
+
+    def observed(self, name):
+        """ Returns True if a state of BUILDING_STATES or DISTRICT_STATES is observed by any building """
+        return self.slots[name] is not None
+
+    def get_central_observation(self):
+        """ Returns the observation of a central agent from the buffer """
+        return self.buffer.ravel()[self.central_index]
+
+    def get_observations(self, indices):
+        """ Returns the observations of the buildings indices as an object array of arrays (the buildings may have different numbers of states) """
+        buffer = self.buffer[indices]
+        observations = np.empty(len(indices), dtype=object)
+        for k, i in enumerate(indices):
+            observations[k] = buffer[k, :self.dims[i]]
+        return observations
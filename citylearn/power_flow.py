@@ -0,0 +1,228 @@
+"""
+Native power flow of radial distribution grids. RadialPowerFlow is compiled once from a pandapower network: the in-service
+lines are ordered as a tree rooted at the external grid, and every bus is given the set of buses downstream of it. At every
+step the voltages are found with a backward/forward sweep on arrays only, warm-started from the voltages of the previous step:
+
+    backward    the current of every bus (loads, static generators and line charging) is summed over the buses downstream of every line
+    forward     the voltage drop of every line is summed over the lines between the external grid and every bus
+
+The buses follow the ZIP load model of pandapower (const_z_percent, const_i_percent) and the lines its pi model, so that the results
+written to net.res_bus, net.res_line, net.res_load, net.res_sgen and net.res_ext_grid match those of pandapower.runpp to the tolerance.
+Meshed grids, transformers, generators and switches are not supported.
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Elements of a pandapower network that the radial power flow does not model
+UNSUPPORTED_ELEMENTS = ['trafo', 'trafo3w', 'gen', 'shunt', 'impedance', 'ward', 'xward', 'dcline', 'storage', 'motor', 'asymmetric_load', 'asymmetric_sgen']
+
+# Columns of net.res_line, in the order of pandapower
+LINE_RESULTS = ['p_from_mw', 'q_from_mvar', 'p_to_mw', 'q_to_mvar', 'pl_mw', 'ql_mvar', 'i_from_ka', 'i_to_ka', 'i_ka', 'vm_from_pu', 'va_from_degree', 'vm_to_pu', 'va_to_degree', 'loading_percent']
+
+class PowerFlowNotConverged(Exception):
+    pass
+
+class RadialPowerFlow:
+    def __init__(self, net, tolerance=1e-10, max_iteration=100):
+        """
+        Args:
+            net (pandapowerNet): radial network, whose topology is not changed afterwards (the loads and static generators may be)
+            tolerance (float): largest change of the voltages (p.u.) between two iterations at convergence
+            max_iteration (int): number of iterations after which PowerFlowNotConverged is raised
+        """
+        for element in UNSUPPORTED_ELEMENTS:
+            if element in net and len(net[element]) > 0 and net[element]['in_service'].any():
+                raise ValueError('The radial power flow does not support the {} elements'.format(element))
+        if len(net.switch) > 0:
+            raise ValueError('The radial power flow does not support switches')
+        ext_grid = net.ext_grid[net.ext_grid['in_service']]
+        if len(ext_grid) != 1:
+            raise ValueError('The radial power flow requires a single external grid')
+
+        self.net = net
+        self.tolerance = tolerance
+        self.max_iteration = max_iteration
+        self.sn_mva = net.sn_mva
+        n_buses = len(net.bus)
+        bus_in_service = net.bus['in_service'].to_numpy(dtype=bool)
+        vn_kv = net.bus['vn_kv'].to_numpy(dtype=float)
+
+        # The buses of the elements are found by their positions in net.bus
+        self.bus_ids = net.bus.index.to_numpy()
+        self.bus_sorter = np.argsort(self.bus_ids)
+
+        # Lines of the tree, as positions in net.bus and net.line
+        line = net.line
+        from_bus = self.get_bus_positions(line['from_bus'])
+        to_bus = self.get_bus_positions(line['to_bus'])
+        self.from_bus, self.to_bus = from_bus, to_bus
+        line_in_service = line['in_service'].to_numpy(dtype=bool) & bus_in_service[from_bus] & bus_in_service[to_bus]
+
+        # Series impedance and half of the shunt admittance of every line, in p.u. of the voltage of its from bus
+        z_base = vn_kv[from_bus]**2/self.sn_mva
+        parallel = line['parallel'].to_numpy(dtype=float)
+        length = line['length_km'].to_numpy(dtype=float)
+        z_line = (line['r_ohm_per_km'].to_numpy(dtype=float) + 1j*line['x_ohm_per_km'].to_numpy(dtype=float))*length/parallel/z_base
+        y_line = (line['g_us_per_km'].to_numpy(dtype=float)*1e-6 + 2j*np.pi*net.f_hz*line['c_nf_per_km'].to_numpy(dtype=float)*1e-9)*length*parallel*z_base/2
+
+        # Tree ordering from the bus of the external grid (breadth first), with the line between every bus and its parent
+        root = net.bus.index.get_loc(ext_grid['bus'].iloc[0])
+        neighbours = [[] for _ in range(n_buses)]
+        for l in np.flatnonzero(line_in_service):
+            neighbours[from_bus[l]].append((l, to_bus[l]))
+            neighbours[to_bus[l]].append((l, from_bus[l]))
+        order, parent_line = [root], {root: -1}
+        for bus in order:
+            for l, other in neighbours[bus]:
+                if l == parent_line[bus]:
+                    continue
+                if other in parent_line:
+                    raise ValueError('The radial power flow does not support meshed grids')
+                parent_line[other] = l
+                order.append(other)
+
+        # Internal position of every bus (-1 if it is not connected to the external grid)
+        self.buses = np.array(order, dtype=np.intp)
+        self.bus_lookup = np.full(n_buses, -1, dtype=np.intp)
+        self.bus_lookup[self.buses] = np.arange(len(order))
+        n = len(order)
+
+        # Position of every line of the tree and of the bus at its child end, and whether its from bus is its parent
+        self.tree_lines = np.array([parent_line[bus] for bus in order[1:]], dtype=np.intp)
+        self.child = self.bus_lookup[np.array(order[1:], dtype=np.intp)]
+        self.from_is_parent = self.bus_lookup[to_bus[self.tree_lines]] == self.child
+        self.line_from = self.bus_lookup[from_bus]
+        self.line_to = self.bus_lookup[to_bus]
+        self.line_in_service = line_in_service
+        self.z = np.zeros(n, dtype=complex)
+        self.z[self.child] = z_line[self.tree_lines]
+        self.y_half = y_line
+
+        # Line charging is modelled as a constant admittance at both ends of the lines
+        self.y_shunt = np.zeros(n, dtype=complex)
+        np.add.at(self.y_shunt, self.line_from[self.tree_lines], y_line[self.tree_lines])
+        np.add.at(self.y_shunt, self.line_to[self.tree_lines], y_line[self.tree_lines])
+
+        # downstream[i, k] is 1 if bus k is downstream of bus i (the root has all the buses downstream). The current in the line
+        # to bus i is downstream @ I, and the voltage drop between the root and bus k is downstream.T @ (z*current)
+        parent = np.full(n, -1, dtype=np.intp)
+        parent[self.child] = np.where(self.from_is_parent, self.line_from[self.tree_lines], self.line_to[self.tree_lines])
+        paths = [[0]]
+        for k in range(1, n):
+            paths.append(paths[parent[k]] + [k])
+        rows = np.concatenate([path for path in paths])
+        columns = np.concatenate([[k]*len(path) for k, path in enumerate(paths)]).astype(np.intp)
+        self.downstream = sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(n, n))
+        self.upstream = self.downstream.T.tocsr()
+
+        # Base values of the results
+        self.i_base_ka = self.sn_mva/(np.sqrt(3)*vn_kv)
+        self.max_i_ka = line['max_i_ka'].to_numpy(dtype=float)*line['df'].to_numpy(dtype=float)*parallel
+        self.ext_grid_index = ext_grid.index
+        # Without transformers, runpp does not calculate the voltage angles from the angle of the external grid (calculate_voltage_angles='auto')
+        self.v_ext_grid = complex(ext_grid['vm_pu'].iloc[0])
+        self.v = np.full(n, self.v_ext_grid)
+        self.iterations = 0
+
+    def reset(self):
+        """ Starts the next power flow from a flat voltage profile """
+        self.v = np.full(len(self.buses), self.v_ext_grid)
+
+    def get_bus_positions(self, buses):
+        """ Returns the positions in net.bus of the buses """
+        return self.bus_sorter[np.searchsorted(self.bus_ids, buses, sorter=self.bus_sorter)]
+
+    def get_injections(self, element):
+        """ Returns the internal bus, the apparent power (p.u.) and the in service flags of the loads or static generators """
+        table = self.net[element]
+        bus = self.bus_lookup[self.get_bus_positions(table['bus'].to_numpy())]
+        active = table['in_service'].to_numpy(dtype=bool) & (bus >= 0)
+        s = (table['p_mw'].to_numpy(dtype=float) + 1j*table['q_mvar'].to_numpy(dtype=float))*table['scaling'].to_numpy(dtype=float)*active/self.sn_mva
+        return np.where(active, bus, 0), s, active
+
+    def run(self):
+        """ Runs the power flow with the current loads and static generators of the network and writes its results to the network """
+        n = len(self.buses)
+        load_bus, s_load, load_active = self.get_injections('load')
+        # The ZIP fractions of a load without power may be undefined (e.g. 0/0 for a building without demand): it is then a constant power load
+        const_z = self.net.load['const_z_percent'].to_numpy(dtype=float)/100
+        const_i = self.net.load['const_i_percent'].to_numpy(dtype=float)/100
+        const_z = np.where((s_load == 0) & ~np.isfinite(const_z), 0, const_z)
+        const_i = np.where((s_load == 0) & ~np.isfinite(const_i), 0, const_i)
+        sgen_bus, s_sgen, _ = self.get_injections('sgen')
+
+        # Constant power, constant current and constant impedance parts of the demand of every bus. As in pandapower, the mean
+        # ZIP fractions of the loads of a bus apply to the net demand of the bus, static generators included
+        n_loads = np.bincount(load_bus, load_active, n)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bus_const_z = np.where(n_loads > 0, np.bincount(load_bus, const_z*load_active, n)/n_loads, 0)
+            bus_const_i = np.where(n_loads > 0, np.bincount(load_bus, const_i*load_active, n)/n_loads, 0)
+        s_bus = self.bus_sum(load_bus, s_load) - self.bus_sum(sgen_bus, s_sgen)
+        s_p = s_bus*(1 - bus_const_z - bus_const_i)
+        s_i = np.conj(s_bus*bus_const_i)
+        y = np.conj(s_bus*bus_const_z) + self.y_shunt
+
+        v = self.v
+        for iteration in range(self.max_iteration):
+            current = np.conj(s_p/v) + s_i*v/np.abs(v) + y*v
+            v_next = self.v_ext_grid - self.upstream @ (self.z*(self.downstream @ current))
+            converged = np.abs(v_next - v).max() < self.tolerance
+            v = v_next
+            if converged:
+                break
+        else:
+            raise PowerFlowNotConverged('The radial power flow did not converge in {} iterations'.format(self.max_iteration))
+        self.v = v
+        self.iterations = iteration + 1
+
+        current = np.conj(s_p/v) + s_i*v/np.abs(v) + y*v
+        self.write_results(v, self.downstream @ current, load_bus, s_load, load_active, const_z, const_i, sgen_bus, s_sgen)
+        return v
+
+    def bus_sum(self, bus, s):
+        """ Returns the sum of the apparent powers s by internal bus """
+        return np.bincount(bus, s.real, len(self.buses)) + 1j*np.bincount(bus, s.imag, len(self.buses))
+
+    def write_results(self, v, line_current, load_bus, s_load, load_active, const_z, const_i, sgen_bus, s_sgen):
+        """ Writes the results of the power flow to the result tables of the network, in the format of pandapower """
+        net, sn_mva = self.net, self.sn_mva
+        connected = self.bus_lookup >= 0
+        v_bus = np.full(len(net.bus), np.nan, dtype=complex)
+        v_bus[self.buses] = v
+
+        # Loads and static generators
+        vm_load = np.where(load_active, np.abs(v[load_bus]), 0)
+        s_load = s_load*(1 - const_z - const_i + const_i*vm_load + const_z*vm_load**2)*sn_mva
+        s_sgen = s_sgen*sn_mva
+        net['res_load'] = pd.DataFrame(np.column_stack([s_load.real, s_load.imag]), index=net.load.index, columns=['p_mw', 'q_mvar'])
+        net['res_sgen'] = pd.DataFrame(np.column_stack([s_sgen.real, s_sgen.imag]), index=net.sgen.index, columns=['p_mw', 'q_mvar'])
+
+        # External grid, which supplies the current of all the buses
+        s_ext_grid = self.v_ext_grid*np.conj(line_current[0])*sn_mva
+        net['res_ext_grid'] = pd.DataFrame([[s_ext_grid.real, s_ext_grid.imag]], index=self.ext_grid_index, columns=['p_mw', 'q_mvar'])
+
+        # Buses, whose power is positive for consumption
+        s_bus = np.zeros(len(net.bus), dtype=complex)
+        s_bus[self.buses] = self.bus_sum(load_bus, s_load/sn_mva) - self.bus_sum(sgen_bus, s_sgen/sn_mva)
+        s_bus[self.buses[0]] -= s_ext_grid/sn_mva
+        s_bus = np.where(connected, s_bus*sn_mva, np.nan)
+        net['res_bus'] = pd.DataFrame(np.column_stack([np.abs(v_bus), np.angle(v_bus, deg=True), s_bus.real, s_bus.imag]), index=net.bus.index, columns=['vm_pu', 'va_degree', 'p_mw', 'q_mvar'])
+
+        # Lines: current entering at both ends, through the series impedance and the shunt admittance of the end
+        n_lines = len(net.line)
+        i_from = np.zeros(n_lines, dtype=complex)
+        i_to = np.zeros(n_lines, dtype=complex)
+        series = np.where(self.from_is_parent, 1, -1)*line_current[self.child]
+        tree_lines = self.tree_lines
+        i_from[tree_lines] = series + self.y_half[tree_lines]*v[self.line_from[tree_lines]]
+        i_to[tree_lines] = -series + self.y_half[tree_lines]*v[self.line_to[tree_lines]]
+        v_from, v_to = v_bus[self.from_bus], v_bus[self.to_bus]
+        s_from = np.where(self.line_in_service, v_from*np.conj(i_from)*sn_mva, 0)
+        s_to = np.where(self.line_in_service, v_to*np.conj(i_to)*sn_mva, 0)
+        i_from_ka = np.abs(i_from)*self.i_base_ka[self.from_bus]
+        i_to_ka = np.abs(i_to)*self.i_base_ka[self.to_bus]
+        i_ka = np.maximum(i_from_ka, i_to_ka)
+        net['res_line'] = pd.DataFrame(np.column_stack([s_from.real, s_from.imag, s_to.real, s_to.imag, s_from.real + s_to.real, s_from.imag + s_to.imag,
+                                                        i_from_ka, i_to_ka, i_ka, np.abs(v_from), np.angle(v_from, deg=True), np.abs(v_to), np.angle(v_to, deg=True),
+                                                        i_ka/self.max_i_ka*100]), index=net.line.index, columns=LINE_RESULTS)
@@ -0,0 +1,94 @@
+"""
+Recorder of the results of the power flow of GridLearn. Every recorded variable (a column of a result table of the
+pandapower network, e.g. res_bus.vm_pu) has a preallocated float32 array of shape (time steps, elements), and every
+step writes one row of it. The DataFrames of the former output writer (elements x time steps, with the time steps as
+string column names) are only built when they are requested.
+
+With a directory, the rows are streamed to disk in chunks of chunk_size time steps, one .npy file per variable and
+chunk, so that only the current chunk is kept in memory:
+
+    <directory>/<variable>_<episode>_<chunk>.npy
+"""
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+class PowerFlowRecorder:
+    def __init__(self, variables, directory=None, chunk_size=1000):
+        """
+        Args:
+            variables (dict): result table and column of every recorded variable, e.g. {'vm_pu': ('res_bus', 'vm_pu')}
+            directory (str or Path): directory of the chunks streamed to disk, or None to keep the whole episode in memory
+            chunk_size (int): number of time steps of every chunk
+        """
+        self.variables = variables
+        self.directory = None if directory is None else Path(directory)
+        self.chunk_size = chunk_size
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        self.episode = 0
+        self.steps = 0
+        self.reset(0)
+
+    def reset(self, n_steps):
+        """ Starts recording a new episode of at most n_steps time steps. The last chunk of the previous episode is written to disk """
+        if self.steps > 0:
+            self.flush()
+            self.episode += 1
+        self.n_steps = n_steps
+        self.steps = 0
+        self.time_steps = np.zeros(n_steps, dtype=np.int64)
+        self.elements = {}
+        self.buffers = {}
+        self.chunks = 0
+
+    def record(self, net, time_step):
+        """ Records the results of the power flow of the network at a time step """
+        if self.steps >= self.n_steps:
+            raise IndexError('The episode has more than the {} time steps of the recorder'.format(self.n_steps))
+        rows = self.n_steps if self.directory is None else self.chunk_size
+        row = self.steps if self.directory is None else self.steps - self.chunks*self.chunk_size
+        for name, (parent, column) in self.variables.items():
+            values = net[parent][column]
+            if name not in self.buffers:
+                # The elements of a table are those of the first time step of the episode
+                self.elements[name] = values.index.copy()
+                self.buffers[name] = np.zeros((rows, len(values)), dtype=np.float32)
+            elif len(values) != len(self.elements[name]):
+                raise ValueError('The number of elements of {}.{} changed during the episode'.format(parent, column))
+            self.buffers[name][row] = values.to_numpy()
+        self.time_steps[self.steps] = time_step
+        self.steps += 1
+
+        if self.directory is not None and row == self.chunk_size - 1:
+            self.flush()
+
+    def flush(self):
+        """ Writes the rows of the current chunk to disk """
+        rows = self.steps - self.chunks*self.chunk_size
+        if self.directory is None or rows == 0:
+            return
+        for name, buffer in self.buffers.items():
+            np.save(self.get_chunk_path(name, self.chunks), buffer[:rows])
+        if rows == self.chunk_size:
+            self.chunks += 1
+
+    def get_chunk_path(self, name, chunk):
+        """ Returns the path of a chunk of a variable """
+        return self.directory / '{}_{:04d}_{:05d}.npy'.format(name, self.episode, chunk)
+
+    def get_values(self, name):
+        """ Returns the recorded values of a variable as an array of shape (time steps, elements) """
+        if name not in self.buffers:
+            return np.zeros((self.steps, 0), dtype=np.float32)
+        if self.directory is None:
+            return self.buffers[name][:self.steps]
+        rows = self.steps - self.chunks*self.chunk_size
+        chunks = [np.load(self.get_chunk_path(name, chunk)) for chunk in range(self.chunks)]
+        return np.concatenate(chunks + [self.buffers[name][:rows]])
+
+    def get_frame(self, name):
+        """ Returns the recorded values of a variable as a DataFrame of the elements x time steps, in the format of the former output writer """
+        values = self.get_values(name)
+        elements = self.elements.get(name, pd.Index([]))
+        return pd.DataFrame(values.T, index=elements, columns=[str(time_step) for time_step in self.time_steps[:self.steps]])
@@ -0,0 +1,320 @@
+"""
+Vectorized step of all the buildings of a district. StepEngine holds the state of charge of the storage devices, the
+sizes of the devices, the COPs of the heat pumps and the demands of all the buildings as arrays, and applies the actions
+of all the buildings in one NumPy pass. The results are the same as those of the methods of Building (set_storage_cooling,
+set_storage_heating, get_solar_power, set_phase_lag), which remain available: CityLearn uses them with step_engine = 'object'.
+
+After every step the new state is written back to the objects (storage SOCs, electricity consumption of the devices, energy
+supplied by the devices, solar power, phase lag and net electricity demand of the buildings), so the rest of the environment and the
+agents read them as before. The other histories of the objects (kept when save_memory is False) are not recorded, so buildings that
+keep them are stepped by the objects.
+Steps that give the actions of some of the buildings are also run by the objects, after which the engine reads their state again (see sync).
+"""
+import numpy as np
+from citylearn.energy_models import HeatPump, ElectricHeater
+from citylearn.dataset import get_stacked
+
+# Actions of a building, in the order in which they are read from the action vector
+ACTIONS = ['cooling_storage', 'dhw_storage', 'pv_curtail', 'pv_phi']
+
+# Default value of the actions that are not controlled (see Building.get_solar_power and Building.set_phase_lag)
+DEFAULT_ACTIONS = {'cooling_storage': 0.0, 'dhw_storage': 0.0, 'pv_curtail': -1.0, 'pv_phi': -1.0}
+
+def charge_storage(soc, energy, capacity, efficiency, loss_coeff, max_power_charging, max_power_output):
+    """ Vectorized EnergyStorage.charge. Returns (soc, energy_balance) """
+    soc_init = soc*(1 - loss_coeff)
+    charging = energy >= 0
+
+    # Charging
+    energy = np.where(charging, np.minimum(energy, max_power_charging), np.maximum(-max_power_output, energy))
+    soc = np.where(charging, soc_init + energy*efficiency, np.maximum(0, soc_init + energy/efficiency))
+    soc = np.minimum(soc, capacity)
+
+    energy_balance = np.where(charging, (soc - soc_init)/efficiency, (soc - soc_init)*efficiency)
+    return soc, energy_balance
+
+def _sequential_sum(values):
+    # Sum in the order of the buildings, as the district totals are accumulated by the object path
+    return np.add.accumulate(values)[-1] if len(values) > 0 else 0.0
+
+class ActionLayout:
+    """
+    Layout of the actions of the buildings of a district, computed once from buildings_states_actions. The actions of every
+    building are read in the order of ACTIONS, skipping the actions it does not control. They can be given as:
+
+        a flat vector              the actions of all the buildings one after the other (central agent)
+        an array of shape (buildings, max_actions)
+                                   one row per building, holding its actions first; mask tells which entries are used
+        a dict {uid: actions}      the actions of some of the buildings (decentralized agents)
+    """
+    def __init__(self, buildings, buildings_states_actions):
+        self.uids = list(buildings)
+        self.enabled = np.array([[bool(buildings_states_actions[uid]['actions'].get(name, False)) for name in ACTIONS] for uid in self.uids], dtype=bool).reshape(len(self.uids), len(ACTIONS))
+        self.flags = [tuple(row) for row in self.enabled.tolist()]
+        self.counts = self.enabled.sum(axis=1)
+        self.n_actions = int(self.counts.sum())
+        self.max_actions = int(self.counts.max()) if len(self.uids) > 0 else 0
+        self.mask = np.arange(self.max_actions) < self.counts[:, np.newaxis]
+        self.index = {uid: i for i, uid in enumerate(self.uids)}
+        self.default_actions = np.array([DEFAULT_ACTIONS[name] for name in ACTIONS])
+
+    def unpack(self, actions):
+        """ Returns (actions, indices): the actions of all the buildings as an array of shape (buildings, len(ACTIONS)), where the actions that are not
+        controlled take their default value, and the indices of the buildings whose actions are given """
+        full = np.tile(self.default_actions, (len(self.uids), 1))
+        if isinstance(actions, dict):
+            indices = [self.index[uid] for uid in actions]
+            for i, uid in zip(indices, actions):
+                values = np.asarray(actions[uid], dtype=np.float64).ravel()
+                assert len(values) == self.counts[i], 'Building ' + str(uid) + ' expects ' + str(self.counts[i]) + ' actions'
+                full[i, self.enabled[i]] = values
+            return full, indices
+
+        actions = np.asarray(actions, dtype=np.float64)
+        if actions.ndim == 2:
+            assert actions.shape == self.mask.shape, 'The array of actions must have the shape (buildings, max_actions) ' + str(self.mask.shape)
+            full[self.enabled] = actions[self.mask]
+        else:
+            assert len(actions) == self.n_actions, 'Some of the actions provided were not used'
+            full[self.enabled] = actions
+        return full, list(range(len(self.uids)))
+
+    def pack(self, actions):
+        """ Returns a dict {uid: actions} (e.g. of RBC_Agent) as an array of shape (buildings, max_actions), with zeros in the unused entries """
+        packed = np.zeros(self.mask.shape, dtype=np.float32)
+        for uid, values in actions.items():
+            i = self.index[uid]
+            packed[i, :self.counts[i]] = values
+        return packed
+
+class StepEngine:
+    def __init__(self, buildings, buildings_states_actions):
+        """
+        Args:
+            buildings (dict): buildings of the district, in the order of the actions
+            buildings_states_actions (dict): states and actions of every building
+        Raises:
+            ValueError if the buildings cannot be stepped by the engine (see is_supported)
+        """
+        if not is_supported(buildings):
+            raise ValueError('The buildings cannot be stepped by the vectorized engine')
+
+        self.buildings = list(buildings.values())
+        n = len(self.buildings)
+        self.layout = ActionLayout(buildings, buildings_states_actions)
+        self.enabled = self.layout.enabled
+
+        # Storage devices
+        self.cooling_storage = _StorageArrays([b.cooling_storage for b in self.buildings])
+        self.dhw_storage = _StorageArrays([b.dhw_storage for b in self.buildings])
+
+        # Devices. The COPs are stacked once per distinct array, as they are shared by the buildings of the same prototype
+        cops, cop_rows = [], {}
+        def cop_row(cop):
+            if id(cop) not in cop_rows:
+                cop_rows[id(cop)] = len(cops)
+                cops.append(np.asarray(cop, dtype=np.float64))
+            return cop_rows[id(cop)]
+
+        self.cooling_nominal_power = np.array([b.cooling_device.nominal_power for b in self.buildings], dtype=np.float64)
+        self.cooling_cop_row = np.array([cop_row(b.cooling_device.cop_cooling) for b in self.buildings], dtype=np.intp)
+
+        self.dhw_heat_pump = np.array([isinstance(b.dhw_heating_device, HeatPump) for b in self.buildings], dtype=bool)
+        self.dhw_nominal_power = np.array([b.dhw_heating_device.nominal_power for b in self.buildings], dtype=np.float64)
+        self.dhw_efficiency = np.array([1.0 if heat_pump else b.dhw_heating_device.efficiency for b, heat_pump in zip(self.buildings, self.dhw_heat_pump)], dtype=np.float64)
+
+        # As in HeatPump.get_max_heating_power, the maximum heating power of a heat pump is given by its cooling COP
+        self.dhw_cop_cooling_row = np.array([cop_row(b.dhw_heating_device.cop_cooling) if heat_pump else 0 for b, heat_pump in zip(self.buildings, self.dhw_heat_pump)], dtype=np.intp)
+        self.dhw_cop_heating_row = np.array([cop_row(b.dhw_heating_device.cop_heating) if heat_pump else 0 for b, heat_pump in zip(self.buildings, self.dhw_heat_pump)], dtype=np.intp)
+        self.cops = np.stack(cops)
+
+        # Series. The series of the prototypes (cooling demand, solar generation) are gathered once per prototype, and the series
+        # of the buildings (DHW demand, non-shiftable load) from the array that holds them all (see stack_stores) if there is one
+        bases, base_index = [], {}
+        self.base_index = np.empty(n, dtype=np.intp)
+        for i, building in enumerate(self.buildings):
+            base = building.sim_results.base
+            if id(base) not in base_index:
+                base_index[id(base)] = len(bases)
+                bases.append(base)
+            self.base_index[i] = base_index[id(base)]
+        self.bases = [(base, base.index(['cooling_demand', 'solar_gen'])) for base in bases]
+
+        stores = [b.sim_results for b in self.buildings]
+        self.own_index = stores[0].index(['dhw_demand', 'non_shiftable_load'])
+        self.stacked = get_stacked(stores)
+
+        self.reset()
+
+    def reset(self):
+        """ Reads the state of the devices after the buildings are reset """
+        self.sync()
+
+    def sync(self):
+        """ Reads the state of the devices from the objects, after some of the buildings were stepped by them (actions given for some of the buildings) """
+        self.cooling_storage.reset()
+        self.dhw_storage.reset()
+        self.cooling_time_step = np.array([b.cooling_device.time_step for b in self.buildings], dtype=np.intp)
+        self.dhw_time_step = np.array([b.dhw_heating_device.time_step for b in self.buildings], dtype=np.intp)
+
+        # The buildings that were not stepped have not moved to the time step of the district, and read their series at their own time step in the next step
+        self.time_steps = np.array([b.time_step for b in self.buildings], dtype=np.intp)
+
+    def get_series(self, time_step):
+        """ Returns the cooling demand, solar generation, DHW demand and non-shiftable load of all the buildings at a time step, or at the time step
+        of every building if time_step is an array """
+        if np.ndim(time_step) > 0:
+            prototypes = np.array([self.bases[j][0].data[t, self.bases[j][1]] for j, t in zip(self.base_index, time_step)])
+            if self.stacked is not None:
+                own = self.stacked[np.arange(len(self.buildings))[:, np.newaxis], time_step[:, np.newaxis], self.own_index]
+            else:
+                own = np.array([b.sim_results.data[t, self.own_index] for b, t in zip(self.buildings, time_step)])
+            series = np.concatenate([prototypes, own], axis=1).astype(np.float64)
+            return series[:, 0], series[:, 1], series[:, 2], series[:, 3]
+
+        prototypes = np.array([base.data[time_step, index] for base, index in self.bases])[self.base_index]
+        if self.stacked is not None:
+            own = self.stacked[:, time_step, self.own_index]
+        else:
+            own = np.array([b.sim_results.data[time_step, self.own_index] for b in self.buildings])
+        series = np.concatenate([prototypes, own], axis=1).astype(np.float64)
+        return series[:, 0], series[:, 1], series[:, 2], series[:, 3]
+
+    def step(self, actions, time_step):
+        """
+        Args:
+            actions (array): actions of all the buildings, of shape (buildings, len(ACTIONS)) (see ActionLayout.unpack)
+            time_step (int): time step of the simulation
+        Return:
+            results (dict): net electricity demand, electricity consumption of the devices, non-shiftable load, solar power and phase lag of every building,
+                and the totals of the district
+        """
+        if self.time_steps is not None and np.any(self.time_steps != time_step):
+            time_step = self.time_steps
+        self.time_steps = None
+        cooling_demand, solar_gen, dhw_demand, non_shiftable_load = self.get_series(time_step)
+        cooling, dhw, curtail, pv_phi = self.enabled.T
+
+        # Cooling (Building.set_storage_cooling)
+        cop_cooling = self.cops[self.cooling_cop_row, self.cooling_time_step]
+        max_cooling = self.cooling_nominal_power*cop_cooling
+        cooling_energy = np.maximum(-cooling_demand, np.minimum(max_cooling - cooling_demand, actions[:, 0]*self.cooling_storage.capacity))
+        cooling_soc, cooling_balance = self.cooling_storage.charge(cooling_energy)
+        cooling_supply = np.maximum(0, cooling_balance + cooling_demand)
+        electric_demand_cooling = cooling_supply/cop_cooling
+        consumption_cooling_storage = electric_demand_cooling - cooling_demand/cop_cooling
+
+        # DHW (Building.set_storage_heating)
+        # Only the heat pumps read their COPs at their time step: the time step of an electric heater is not reset with the episode, and it does not use it
+        dhw_time_step = np.where(self.dhw_heat_pump, self.dhw_time_step, 0)
+        dhw_cop_cooling = np.where(self.dhw_heat_pump, self.cops[self.dhw_cop_cooling_row, dhw_time_step], self.dhw_efficiency)
+        dhw_cop_heating = np.where(self.dhw_heat_pump, self.cops[self.dhw_cop_heating_row, dhw_time_step], self.dhw_efficiency)
+        max_heating = self.dhw_nominal_power*dhw_cop_cooling
+        dhw_energy = np.maximum(-dhw_demand, np.minimum(max_heating - dhw_demand, actions[:, 1]*self.dhw_storage.capacity))
+        dhw_soc, dhw_balance = self.dhw_storage.charge(dhw_energy)
+        heat_supply = np.maximum(0, dhw_balance + dhw_demand)
+        electric_demand_dhw = heat_supply/dhw_cop_heating
+        consumption_dhw_storage = electric_demand_dhw - dhw_demand/dhw_cop_heating
+
+        # The storage devices and the devices that are not controlled are left unchanged
+        self.cooling_storage.update(cooling, cooling_soc, cooling_balance)
+        self.dhw_storage.update(dhw, dhw_soc, dhw_balance)
+        electric_demand_cooling = np.where(cooling, electric_demand_cooling, 0.0)
+        electric_demand_dhw = np.where(dhw, electric_demand_dhw, 0.0)
+        consumption_cooling_storage = np.where(cooling, consumption_cooling_storage, 0.0)
+        consumption_dhw_storage = np.where(dhw, consumption_dhw_storage, 0.0)
+
+        # Solar power and phase lag (Building.get_solar_power and Building.set_phase_lag)
+        solar_power = (1 - .5*actions[:, 2] + 0.5)*solar_gen
+        v_lag = (actions[:, 3] + 1)*np.pi/4
+
+        net_electricity_demand = np.round(electric_demand_cooling + electric_demand_dhw + non_shiftable_load - solar_power, 4)
+
+        # Writing the new state back to the objects
+        for i, building in enumerate(self.buildings):
+            if cooling[i]:
+                building.cooling_device.max_cooling = max_cooling[i]
+                building.cooling_device.cooling_supply.append(float(cooling_supply[i]))
+                building.cooling_device._electrical_consumption_cooling = electric_demand_cooling[i]
+                building.cooling_device.time_step += 1
+                building._electric_consumption_cooling_storage = consumption_cooling_storage[i]
+            if dhw[i]:
+                building.dhw_heating_device.max_heating = max_heating[i]
+                building.dhw_heating_device.heat_supply.append(float(heat_supply[i]))
+                building.dhw_heating_device._electrical_consumption_heating = electric_demand_dhw[i]
+                building.dhw_heating_device.time_step += 1
+                building._electric_consumption_dhw_storage = consumption_dhw_storage[i]
+            building.solar_power = solar_power[i]
+            building.v_lag = v_lag[i]
+            building.current_net_electricity_demand = net_electricity_demand[i]
+        self.cooling_storage.write()
+        self.dhw_storage.write()
+        self.cooling_time_step += cooling
+        self.dhw_time_step += dhw
+
+        return {'net_electricity_demand': net_electricity_demand,
+                'electric_demand': _sequential_sum(net_electricity_demand),
+                'elec_consumption_cooling_storage': _sequential_sum(consumption_cooling_storage),
+                'elec_consumption_dhw_storage': _sequential_sum(consumption_dhw_storage),
+                'elec_consumption_cooling_total': _sequential_sum(electric_demand_cooling),
+                'elec_consumption_dhw_total': _sequential_sum(electric_demand_dhw),
+                'elec_consumption_appliances': _sequential_sum(non_shiftable_load),
+                'elec_generation': _sequential_sum(solar_power),
+                'electric_demand_cooling': electric_demand_cooling,
+                'electric_demand_dhw': electric_demand_dhw,
+                'non_shiftable_load': non_shiftable_load,
+                'solar_power': solar_power,
+                'v_lag': v_lag}
+
+class _StorageArrays:
+    # Parameters and state of the storage devices of all the buildings. The maximum powers that are not set are infinite
+    def __init__(self, storages):
+        self.storages = storages
+        self.capacity = np.array([s.capacity for s in storages], dtype=np.float64)
+        self.efficiency = np.array([s.efficiency for s in storages], dtype=np.float64)
+        self.loss_coeff = np.array([s.loss_coeff for s in storages], dtype=np.float64)
+        self.max_power_charging = np.array([np.inf if s.max_power_charging is None else s.max_power_charging for s in storages], dtype=np.float64)
+        self.max_power_output = np.array([np.inf if s.max_power_output is None else s.max_power_output for s in storages], dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        # Reads the state of the storage devices from the objects
+        self.soc = np.array([s._soc for s in self.storages], dtype=np.float64)
+        self.energy_balance = np.array([s._energy_balance for s in self.storages], dtype=np.float64)
+        self.updated = np.zeros(len(self.storages), dtype=bool)
+
+    def charge(self, energy):
+        return charge_storage(self.soc, energy, self.capacity, self.efficiency, self.loss_coeff, self.max_power_charging, self.max_power_output)
+
+    def update(self, mask, soc, energy_balance):
+        self.soc = np.where(mask, soc, self.soc)
+        self.energy_balance = np.where(mask, energy_balance, self.energy_balance)
+        self.updated = mask
+
+    def write(self):
+        for i in np.flatnonzero(self.updated):
+            self.storages[i]._soc = self.soc[i]
+            self.storages[i]._energy_balance = self.energy_balance[i]
+
+def is_supported(buildings):
+    """ Returns True if the buildings can be stepped by StepEngine: their devices are those created by building_loader, their series are shared with
+    a prototype, and they do not keep the histories of their devices (save_memory) """
+    cop_lengths = set()
+    for building in buildings.values():
+        if building.electrical_storage is not None or building.cooling_storage is None or building.dhw_storage is None or building.sim_results.base is None:
+            return False
+        if not isinstance(building.cooling_device, HeatPump) or not isinstance(building.dhw_heating_device, (HeatPump, ElectricHeater)):
+            return False
+        if not all(obj.save_memory for obj in [building, building.cooling_storage, building.dhw_storage, building.cooling_device, building.dhw_heating_device]):
+            return False
+        if 'dhw_demand' not in building.sim_results.columns or 'non_shiftable_load' not in building.sim_results.columns:
+            return False
+
+        cops = [building.cooling_device.cop_cooling]
+        if isinstance(building.dhw_heating_device, HeatPump):
+            cops += [building.dhw_heating_device.cop_cooling, building.dhw_heating_device.cop_heating]
+        if any(cop is None or len(cop) == 0 for cop in cops):
+            return False
+        cop_lengths.update(len(cop) for cop in cops)
+
+    return len(buildings) > 0 and len(cop_lengths) == 1
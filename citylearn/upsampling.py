@@ -0,0 +1,139 @@
+"""
+Sub-hourly upsampling of hourly data. upsample() takes a whole (hours, columns) frame and returns a
+(hours*subhourly_steps, columns) array in one batched call, with one of the registered methods:
+
+    linear      linear interpolation (same grid and values as np.interp in subhourly_lin_interp)
+    repeat      the hourly value is kept during every sub-hourly step
+    noisy       repeat, multiplied by a random perturbation of 5% standard deviation
+    randomdraw  binary draws at full power whose sub-hourly energy adds up to the hourly energy (DHW draws)
+    spline      cubic spline interpolation (requires scipy)
+
+New methods (e.g. for new data sources) are added with the register_upsampling_method decorator. upsample_window()
+only computes a range of sub-hourly time steps, from the hourly rows that these time steps depend on.
+"""
+import numpy as np
+
+UPSAMPLING_METHODS = {}
+
+def register_upsampling_method(name):
+    def register(method):
+        UPSAMPLING_METHODS[name] = method
+        return method
+    return register
+
+def upsample(hourly_data, subhourly_steps, method = 'linear', **kwargs):
+    """
+    Args:
+        hourly_data (array): hourly values, of shape (hours,) or (hours, columns)
+        subhourly_steps (int): number of time steps per hour
+        method (str): one of UPSAMPLING_METHODS
+        kwargs: arguments of the method (e.g. rng for the random methods, power for randomdraw)
+    Return:
+        data (np.array): array of shape (hours*subhourly_steps,) or (hours*subhourly_steps, columns)
+    """
+    if method not in UPSAMPLING_METHODS:
+        raise ValueError('Unknown upsampling method ' + str(method) + ', available methods: ' + ', '.join(UPSAMPLING_METHODS))
+
+    hourly_data = np.asarray(hourly_data)
+    if hourly_data.ndim == 1:
+        return UPSAMPLING_METHODS[method](hourly_data[:, np.newaxis], subhourly_steps, **kwargs)[:, 0]
+    return UPSAMPLING_METHODS[method](hourly_data, subhourly_steps, **kwargs)
+
+def upsample_window(hourly_data, subhourly_steps, window, method = 'linear', **kwargs):
+    """
+    Returns the sub-hourly time steps window[0] to window[1] of upsample(hourly_data, subhourly_steps, method). Only the hourly
+    rows returned by get_hour_window are used, so the other rows of hourly_data do not need to be loaded. The linear
+    interpolation gives exactly the same values as upsample, the random methods draw the window only.
+    """
+    if method not in UPSAMPLING_METHODS:
+        raise ValueError('Unknown upsampling method ' + str(method) + ', available methods: ' + ', '.join(UPSAMPLING_METHODS))
+
+    hourly_data = np.asarray(hourly_data)
+    squeeze = hourly_data.ndim == 1
+    if squeeze:
+        hourly_data = hourly_data[:, np.newaxis]
+
+    n = hourly_data.shape[0]
+    start, stop = window[0], min(window[1], n*subhourly_steps)
+    if method == 'linear':
+        data = _linear(hourly_data, subhourly_steps, _interp_grid(n, subhourly_steps, start, stop))
+    else:
+        # The other methods are applied to the whole hours that contain the window
+        first_hour, last_hour = start//subhourly_steps, -(-stop//subhourly_steps)
+        data = UPSAMPLING_METHODS[method](hourly_data[first_hour:last_hour], subhourly_steps, **kwargs)
+        data = data[start - first_hour*subhourly_steps:stop - first_hour*subhourly_steps]
+
+    return data[:, 0] if squeeze else data
+
+def get_hour_window(window, n_hours, subhourly_steps):
+    """ Returns the range of hourly rows (first_hour, last_hour) used by upsample_window to compute the sub-hourly time steps of window """
+    start, stop = window[0], min(window[1], n_hours*subhourly_steps)
+    if stop <= start:
+        return 0, 0
+    positions = _interp_grid(n_hours, subhourly_steps, start, stop)
+    return start//subhourly_steps, min(n_hours, max(int(positions[-1]) + 2, -(-stop//subhourly_steps)))
+
+def _interp_grid(n, subhourly_steps, start = 0, stop = None):
+    # Sub-hourly positions (in hours) of the interpolated values, as in subhourly_lin_interp. The positions of a range of time steps are
+    # computed like np.linspace does, so that they are the same as in the whole grid
+    num = n*subhourly_steps
+    if start == 0 and (stop is None or stop == num):
+        return np.linspace(0, n, num)
+
+    stop = num if stop is None else stop
+    positions = np.arange(start, stop)*(n/(num - 1))
+    if stop == num:
+        positions[-1] = n
+    return positions
+
+@register_upsampling_method('linear')
+def _linear(hourly_data, subhourly_steps, positions = None):
+    n = hourly_data.shape[0]
+    x = _interp_grid(n, subhourly_steps) if positions is None else positions
+
+    # Index of the hour on the left of every position and weight of the hour on its right. Positions past the last hour keep its value, like np.interp
+    left = np.minimum(np.floor(x), n - 1).astype(np.intp)
+    right = np.minimum(left + 1, n - 1)
+    weight = (x - left)[:, np.newaxis]
+
+    hourly_data = hourly_data.astype(np.float64, copy=False)
+    return (hourly_data[right] - hourly_data[left])*weight + hourly_data[left]
+
+@register_upsampling_method('repeat')
+def _repeat(hourly_data, subhourly_steps):
+    return np.repeat(hourly_data, subhourly_steps, axis=0)
+
+@register_upsampling_method('noisy')
+def _noisy(hourly_data, subhourly_steps, rng = None, std = 0.05):
+    # The global numpy random state is used by default, so that seeding numpy keeps the perturbations reproducible
+    rng = np.random if rng is None else rng
+    data = np.repeat(hourly_data, subhourly_steps, axis=0)
+    perturbation = rng.normal(1.0, std, data.shape)
+    return np.multiply(data, perturbation)
+
+@register_upsampling_method('randomdraw')
+def _randomdraw(hourly_data, subhourly_steps, power = None, rng = None):
+    # power is the power of the device that supplies the demand, one value or one value per column. The sub-hourly steps of every hour are
+    # ranked randomly and the demand is supplied at full power during the first int(hour/subhourly_energy) of them
+    if rng is None:
+        rng = np.random.default_rng(np.random.randint(np.iinfo(np.int32).max))
+
+    hours, columns = hourly_data.shape
+    subhourly_energy = np.maximum(0.01, np.broadcast_to(np.asarray(power, dtype=np.float64), (columns,))/subhourly_steps)
+    n_draws = (hourly_data.astype(np.float64)/subhourly_energy).astype(int)
+
+    ranks = rng.random((columns, hours, subhourly_steps)).argsort(axis=2).argsort(axis=2)
+    draws = ranks < n_draws.T[:, :, np.newaxis]
+    data = draws*subhourly_energy.astype(np.float32)[:, np.newaxis, np.newaxis]
+    return data.reshape(columns, hours*subhourly_steps).T
+
+@register_upsampling_method('spline')
+def _spline(hourly_data, subhourly_steps):
+    try:
+        from scipy.interpolate import CubicSpline
+    except ImportError:
+        raise ImportError('The spline upsampling method requires scipy')
+
+    n = hourly_data.shape[0]
+    x = np.minimum(_interp_grid(n, subhourly_steps), n - 1)
+    return CubicSpline(np.arange(n), hourly_data, axis=0)(x)
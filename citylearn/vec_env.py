@@ -0,0 +1,338 @@
+"""
+Vector environments, which step K independent CityLearn or GridLearn environments (scenarios) in lockstep and return
+stacked arrays: observations of shape (K, observations), rewards and dones of shape (K,). Every scenario is given by the
+arguments of its environment, so the scenarios can differ by seed, climate zone, pv_penetration, etc. (see
+get_scenario). The environments must have central agents. Their observation and action spaces may have different sizes
+(e.g. other buildings are drawn from another seed): the observations are padded with zeros to the largest size, and
+every environment only reads the first actions of its row.
+
+    CityVecEnv          all the environments are stepped in this process. They share the read-only series of their
+                        prototype buildings (see dataset._PROTOTYPE_CACHE), which are only loaded once
+    SubprocCityVecEnv   the environments are split across worker processes, which write the observations, rewards and
+                        dones into shared memory blocks. Only the actions and the infos go through the pipes
+
+Both implement the VecEnv interface of stable-baselines3 (and are instances of its VecEnv when it is installed): an
+environment whose episode is done is reset at once, and its last observation is in info['terminal_observation'].
+Their spaces are those of the gym package of stable-baselines3: gymnasium from its version 2, gym before.
+"""
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory, resource_tracker
+from pathlib import Path
+from citylearn.citylearn import CityLearn
+
+try:
+    import stable_baselines3
+    from stable_baselines3.common.vec_env import VecEnv
+    if int(stable_baselines3.__version__.split('.')[0]) >= 2:
+        from gymnasium import spaces
+    else:
+        from gym import spaces
+except ImportError:
+    from gym import spaces
+
+    # Without stable-baselines3, the vector environments have the same interface but are not instances of its VecEnv
+    class VecEnv:
+        def __init__(self, num_envs, observation_space, action_space):
+            self.num_envs = num_envs
+            self.observation_space = observation_space
+            self.action_space = action_space
+
+        def step(self, actions):
+            self.step_async(actions)
+            return self.step_wait()
+
+def get_scenario(config, climate_zone=None, **kwargs):
+    """ Returns the arguments of an environment, which are those of config except the given ones (e.g. seed, pv_penetration).
+    With a climate zone, the data files of config are taken from the directory of that climate zone (Climate_Zone_<climate_zone>) """
+    config = dict(config, **kwargs)
+    if climate_zone is not None:
+        data_path = Path(config['data_path']).parent / ('Climate_Zone_' + str(climate_zone))
+        for name in ['building_attributes', 'weather_file', 'solar_profile']:
+            config[name] = data_path / Path(config[name]).name
+        config['data_path'] = data_path
+    return config
+
+def make_env(environment, scenario):
+    """ Returns the environment of a scenario, which must have a central agent """
+    env = environment(**scenario)
+    if not env.central_agent:
+        raise ValueError('The vector environments require central agents')
+    return env
+
+def get_padded_space(boxes, low, high):
+    """ Returns the Box space of the largest size that holds all the spaces, whose values beyond the size of a space are within (low, high) """
+    size = max(space.shape[0] for space in boxes)
+    lows, highs = np.full(size, np.inf, dtype=np.float32), np.full(size, -np.inf, dtype=np.float32)
+    for space in boxes:
+        n = space.shape[0]
+        lows[:n], highs[:n] = np.minimum(lows[:n], space.low), np.maximum(highs[:n], space.high)
+        lows[n:], highs[n:] = np.minimum(lows[n:], low), np.maximum(highs[n:], high)
+    return spaces.Box(low=lows, high=highs, dtype=np.float32)
+
+def _get_spaces(observation_spaces, action_spaces):
+    # The padded observations are zeros. The padded actions are ignored, they have the bounds of the normalized actions
+    return get_padded_space(observation_spaces, 0, 0), get_padded_space(action_spaces, -1, 1)
+
+def _get_indices(indices, num_envs):
+    # Indices of the environments targeted by get_attr, set_attr, env_method and env_is_wrapped (all of them if None)
+    if indices is None:
+        return range(num_envs)
+    return [indices] if isinstance(indices, int) else indices
+
+def _step_env(env, action, observations):
+    # Steps an environment with the first actions of its row, writes its (padded) observation into observations and resets it at the end of its episode
+    observation, reward, done, info = env.step(action[:env.action_space.shape[0]])
+    if done:
+        terminal_observation = np.zeros_like(observations)
+        terminal_observation[:len(observation)] = observation
+        info = dict(info, terminal_observation=terminal_observation)
+        observation = env.reset()
+    observations[:len(observation)] = observation
+    return reward, done, info
+
+def _reset_env(env, observations):
+    observation = env.reset()
+    observations[:len(observation)] = observation
+
+class CityVecEnv(VecEnv):
+    def __init__(self, scenarios, environment=CityLearn):
+        """
+        Args:
+            scenarios (list): arguments of every environment (see get_scenario)
+            environment (class): CityLearn, GridLearn or a subclass
+        """
+        self.envs = [make_env(environment, scenario) for scenario in scenarios]
+        observation_space, action_space = _get_spaces([env.observation_space for env in self.envs], [env.action_space for env in self.envs])
+        self.observations = np.zeros((len(self.envs),) + observation_space.shape, dtype=np.float32)
+        self.rewards = np.zeros(len(self.envs), dtype=np.float32)
+        self.dones = np.zeros(len(self.envs), dtype=bool)
+        self.infos = [{} for _ in self.envs]
+        self.actions = None
+        super().__init__(len(self.envs), observation_space, action_space)
+
+    def reset(self):
+        for i, env in enumerate(self.envs):
+            _reset_env(env, self.observations[i])
+        return self.observations.copy()
+
+    def step_async(self, actions):
+        self.actions = np.asarray(actions)
+
+    def step_wait(self):
+        for i, env in enumerate(self.envs):
+            self.rewards[i], self.dones[i], self.infos[i] = _step_env(env, self.actions[i], self.observations[i])
+        return self.observations.copy(), self.rewards.copy(), self.dones.copy(), list(self.infos)
+
+    def close(self):
+        self.envs = []
+
+    def seed(self, seed=None):
+        """ Sets the np_random generator of gym of the environments with seed, seed + 1, ... It does not change the scenarios: the buildings
+        and their random series are drawn when the environments are created, from the seed argument of the scenario (see get_scenario) """
+        return [env.seed(None if seed is None else seed + i) for i, env in enumerate(self.envs)]
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self.envs[i], attr_name) for i in _get_indices(indices, self.num_envs)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        for i in _get_indices(indices, self.num_envs):
+            setattr(self.envs[i], attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(self.envs[i], method_name)(*method_args, **method_kwargs) for i in _get_indices(indices, self.num_envs)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in _get_indices(indices, self.num_envs)]
+
+def _attach(buffers):
+    # The workers share the resource tracker of the parent process, which unlinks the blocks
+    blocks, results = [], {}
+    for name, (shm_name, shape, dtype) in buffers.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        blocks.append(shm)
+        results[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    return blocks, results
+
+def _worker(pipe, environment, scenarios, indices):
+    # Steps the environments of the scenarios, whose positions in the vector environment are indices. The spaces of the environments
+    # are sent to the parent process, which then sends the shared memory blocks of the stacked results
+    blocks = []
+    try:
+        envs = [make_env(environment, scenario) for scenario in scenarios]
+        pipe.send(('ok', ([env.observation_space for env in envs], [env.action_space for env in envs])))
+    except Exception as e:
+        pipe.send(('error', e))
+        return
+
+    while True:
+        try:
+            command, data = pipe.recv()
+        except EOFError:
+            # The parent process exited without closing the vector environment
+            break
+        if command == 'close':
+            break
+        try:
+            result = None
+            if command == 'attach':
+                blocks, results = _attach(data)
+            elif command == 'step':
+                result = []
+                for i, env, action in zip(indices, envs, data):
+                    results['rewards'][i], results['dones'][i], info = _step_env(env, action, results['observations'][i])
+                    result.append(info)
+            elif command == 'reset':
+                for i, env in zip(indices, envs):
+                    _reset_env(env, results['observations'][i])
+            elif command == 'get_attr':
+                positions, name = data
+                result = [getattr(envs[j], name) for j in positions]
+            elif command == 'set_attr':
+                positions, name, value = data
+                for j in positions:
+                    setattr(envs[j], name, value)
+            elif command == 'env_method':
+                positions, name, args, kwargs = data
+                result = [getattr(envs[j], name)(*args, **kwargs) for j in positions]
+            pipe.send(('ok', result))
+        except Exception as e:
+            pipe.send(('error', e))
+
+    for shm in blocks:
+        shm.close()
+    pipe.close()
+
+class SubprocCityVecEnv(VecEnv):
+    def __init__(self, scenarios, environment=CityLearn, n_workers=None, start_method=None):
+        """
+        Args:
+            scenarios (list): arguments of every environment (see get_scenario)
+            environment (class): CityLearn, GridLearn or a subclass
+            n_workers (int): number of worker processes, which step a contiguous group of environments each (one per environment by default, at most the number of cpus).
+                The workers are daemonic, so their environments cannot start processes of their own (n_jobs, background_baseline)
+            start_method (str): start method of the worker processes (see multiprocessing), the default one of the platform if None
+        """
+        n_envs = len(scenarios)
+        n_workers = min(n_envs, n_workers or mp.cpu_count())
+        self.groups = [list(group) for group in np.array_split(np.arange(n_envs), n_workers)]
+        self.pipes, self.processes, self.blocks = [], [], []
+        self.waiting = False
+        self.closed = False
+        context = mp.get_context(start_method)
+
+        # The shared blocks are created once the workers have sent their spaces. The resource tracker is started before the workers, so that they share it
+        # (a worker with a tracker of its own would unlink the blocks when it exits)
+        resource_tracker.ensure_running()
+        try:
+            for group in self.groups:
+                pipe, worker_pipe = context.Pipe()
+                process = context.Process(target=_worker, args=(worker_pipe, environment, [scenarios[i] for i in group], group), daemon=True)
+                process.start()
+                worker_pipe.close()
+                self.pipes.append(pipe)
+                self.processes.append(process)
+
+            # The environments are built by the workers in parallel
+            observation_spaces, action_spaces = [], []
+            for worker_spaces in self._receive(self.pipes):
+                observation_spaces += worker_spaces[0]
+                action_spaces += worker_spaces[1]
+            observation_space, action_space = _get_spaces(observation_spaces, action_spaces)
+
+            # Every worker writes the results of its environments into their rows of the shared blocks
+            self.results, buffers = {}, {}
+            for name, shape, dtype in [('observations', (n_envs,) + observation_space.shape, np.float32), ('rewards', (n_envs,), np.float32), ('dones', (n_envs,), bool)]:
+                shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape))*np.dtype(dtype).itemsize))
+                self.blocks.append(shm)
+                self.results[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+                buffers[name] = (shm.name, shape, np.dtype(dtype).str)
+            self._send_all('attach', [buffers]*len(self.pipes))
+        except Exception:
+            self.close()
+            raise
+
+        super().__init__(n_envs, observation_space, action_space)
+
+    def _receive(self, pipes):
+        # Returns the results of the workers. All of them are received before the error of a worker is raised, so that the pipes stay in sync
+        messages = [pipe.recv() for pipe in pipes]
+        for status, result in messages:
+            if status == 'error':
+                raise result
+        return [result for _, result in messages]
+
+    def _send_all(self, command, data):
+        # Sends a command to every worker and returns their results, once they are all done
+        for pipe, worker_data in zip(self.pipes, data):
+            pipe.send((command, worker_data))
+        return self._receive(self.pipes)
+
+    def reset(self):
+        self._send_all('reset', [None]*len(self.pipes))
+        return self.results['observations'].copy()
+
+    def step_async(self, actions):
+        actions = np.asarray(actions)
+        for pipe, group in zip(self.pipes, self.groups):
+            pipe.send(('step', actions[group]))
+        self.waiting = True
+
+    def step_wait(self):
+        self.waiting = False
+        infos = [info for worker_infos in self._receive(self.pipes) for info in worker_infos]
+        return self.results['observations'].copy(), self.results['rewards'].copy(), self.results['dones'].copy(), infos
+
+    def close(self):
+        if self.closed:
+            return
+        if self.waiting:
+            for pipe in self.pipes:
+                pipe.recv()
+        for pipe in self.pipes:
+            try:
+                pipe.send(('close', None))
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join()
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.closed = True
+
+    def seed(self, seed=None):
+        """ Sets the np_random generator of gym of the environments with seed, seed + 1, ... It does not change the scenarios: the buildings
+        and their random series are drawn when the environments are created, from the seed argument of the scenario (see get_scenario) """
+        return [self.env_method('seed', None if seed is None else seed + i, indices=i)[0] for i in range(self.num_envs)]
+
+    def get_attr(self, attr_name, indices=None):
+        return self._call_envs('get_attr', indices, attr_name)
+
+    def set_attr(self, attr_name, value, indices=None):
+        self._call_envs('set_attr', indices, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return self._call_envs('env_method', indices, method_name, method_args, method_kwargs)
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in _get_indices(indices, self.num_envs)]
+
+    def _call_envs(self, command, indices, *data):
+        # Sends a command to the workers of the environments of indices, with the positions of these environments in their group, and returns the results in the order of indices
+        indices = list(_get_indices(indices, self.num_envs))
+        requests = []
+        for pipe, group in zip(self.pipes, self.groups):
+            positions = [group.index(i) for i in indices if i in group]
+            if len(positions) > 0:
+                pipe.send((command, (positions,) + data))
+                requests.append((pipe, [i for i in indices if i in group]))
+        results = {}
+        for (_, group_indices), result in zip(requests, self._receive([pipe for pipe, _ in requests])):
+            if result is not None:
+                results.update(zip(group_indices, result))
+        return [results.get(i) for i in indices]
+
+    def __del__(self):
+        if not getattr(self, 'closed', True):
+            self.close()
@@ -15,5 +15,6 @@ setup(
         packages=find_packages(),
         install_requires=[], # add any additional packages that
         # needs to be installed along with your package. Eg: 'caer'
+        entry_points={'console_scripts': ['citylearn-build-cache=citylearn.build_cache:main']},
         classifiers= []
 )
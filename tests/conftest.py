@@ -0,0 +1,19 @@
+# Shared configuration of the pytest tests. Run them from the root of the repository: python -m pytest tests
+import sys
+import pytest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Scripts that train agents, which are not tests
+collect_ignore = ['central_agent_test.py', 'rl_main.py']
+
+@pytest.fixture
+def config():
+    """ Arguments of a small environment with a central agent in climate zone 1 """
+    data_path = ROOT / 'citylearn' / 'data' / 'Climate_Zone_1'
+    return dict(data_path=data_path, building_attributes=data_path / 'building_attributes.json', weather_file=data_path / 'weather_data.csv',
+                solar_profile=data_path / 'solar_generation_1kW.csv', building_ids=['Building_1', 'Building_2', 'Building_3'], hourly_timesteps=1,
+                buildings_states_actions=ROOT / 'citylearn' / 'buildings_state_action_space.json', simulation_period=(0, 48), central_agent=True,
+                cost_function=['ramping', '1-load_factor', 'average_daily_peak', 'peak_demand', 'net_electricity_consumption'])
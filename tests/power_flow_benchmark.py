@@ -0,0 +1,53 @@
+# Compares the 'native' power flow backend of GridLearn with pandapower.runpp on the grid of GridLearn, step by step.
+# Run from the root of the repository: python tests/power_flow_benchmark.py
+import sys
+import time
+import numpy as np
+from pathlib import Path
+
+# citylearn is imported from the repository, which does not need to be installed
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pandapower import runpp
+from citylearn import GridLearn
+from citylearn.power_flow import RadialPowerFlow
+
+climate_zone = 1
+data_path = Path("citylearn/data/Climate_Zone_"+str(climate_zone))
+building_ids = ['Building_1', 'Building_2', 'Building_3']
+env = GridLearn(data_path, data_path / 'building_attributes.json', data_path / 'weather_data.csv', data_path / 'solar_generation_1kW.csv', building_ids, 1, buildings_states_actions='citylearn/buildings_state_action_space.json', simulation_period=(0, 48), n_buildings_per_bus=4, central_agent=True)
+tolerance = {'res_bus': 1e-5, 'res_line': 1e-5, 'res_load': 1e-9, 'res_sgen': 1e-9, 'res_ext_grid': 1e-5}
+
+power_flow = RadialPowerFlow(env.net)
+
+def run_native():
+    power_flow.run()
+    return env.net
+
+env.reset()
+backends = {'native': run_native}
+times = {name: 0 for name in ['runpp'] + list(backends)}
+error = {name: {} for name in backends}
+done = False
+while not done:
+    # The step sets the loads and the static generators of the network, which all the power flows then solve
+    _, _, done, _ = env.step(env.action_space.sample())
+
+    start = time.time()
+    runpp(env.net, enforce_q_lims=True)
+    times['runpp'] += time.time() - start
+    reference = {table: env.net[table].copy() for table in tolerance}
+
+    for name, run in backends.items():
+        start = time.time()
+        net = run()
+        times[name] += time.time() - start
+        for table, results in reference.items():
+            error[name][table] = max(error[name].get(table, 0), np.nanmax(np.abs(net[table][results.columns].to_numpy() - results.to_numpy())))
+
+for name in backends:
+    for table, value in error[name].items():
+        assert value < tolerance[table], 'the {} power flow differs from runpp in {}'.format(name, table)
+        print('{:8s} {:12s} largest difference {:.2e}'.format(name, table, value))
+for name, value in times.items():
+    print('{:8s} {:7.2f} ms per step ({:.1f}x)'.format(name, value/env.time_step*1000, times['runpp']/value))
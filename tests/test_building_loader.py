@@ -0,0 +1,22 @@
+import numpy as np
+from citylearn import CityLearn
+
+def run_episode(env):
+    """ Returns the net electricity consumption of an episode with random actions """
+    rng = np.random.default_rng(0)
+    env.reset()
+    done = False
+    while not done:
+        _, _, done, _ = env.step(rng.uniform(-0.5, 0.5, env.action_space.shape))
+    return np.array(env.net_electric_consumption)
+
+def test_parallel_loader_matches_serial(config):
+    config = dict(config, n_buildings=6, hourly_timesteps=2)
+    serial, parallel = CityLearn(**config), CityLearn(**config, n_jobs=2)
+    assert list(serial.buildings) == list(parallel.buildings)
+    for building, parallel_building in zip(serial.buildings.values(), parallel.buildings.values()):
+        assert building.buildingId == parallel_building.buildingId
+        assert building.cooling_storage.capacity == parallel_building.cooling_storage.capacity
+        np.testing.assert_array_equal(building.sim_results.data, parallel_building.sim_results.data)
+        np.testing.assert_array_equal(building.sim_results.base.data, parallel_building.sim_results.base.data)
+    np.testing.assert_array_equal(run_episode(serial), run_episode(parallel))
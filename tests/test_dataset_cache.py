@@ -0,0 +1,54 @@
+import json
+import numpy as np
+from citylearn import CityLearn
+from citylearn.dataset import clear_csv_cache, build_dataset_cache
+
+def run_episode(env):
+    """ Returns the observations and the net electricity consumption of an episode with random actions """
+    rng = np.random.default_rng(0)
+    states = [env.reset()]
+    done = False
+    while not done:
+        state, _, done, _ = env.step(rng.uniform(-0.5, 0.5, env.action_space.shape))
+        states.append(state)
+    return np.array(states), np.array(env.net_electric_consumption)
+
+def assert_same_episode(env, other):
+    for building, other_building in zip(env.buildings.values(), other.buildings.values()):
+        np.testing.assert_array_equal(building.sim_results.data, other_building.sim_results.data)
+    states, consumption = run_episode(env)
+    other_states, other_consumption = run_episode(other)
+    np.testing.assert_array_equal(states, other_states)
+    np.testing.assert_array_equal(consumption, other_consumption)
+
+def test_cached_dataset_matches_source(config, tmp_path):
+    config = dict(config, hourly_timesteps=2)
+    clear_csv_cache()
+    env = CityLearn(**config)
+
+    # The first environment writes the cache entries, the second one memory-maps them
+    clear_csv_cache()
+    CityLearn(**config, cache_dir=tmp_path)
+    assert len(list(tmp_path.glob('climate_zone_1/*/meta.json'))) > 0
+    clear_csv_cache()
+    cached = CityLearn(**config, cache_dir=tmp_path)
+    assert all(isinstance(building.sim_results.base.data, np.memmap) for building in cached.buildings.values())
+    assert_same_episode(env, cached)
+
+def test_outdated_cache_entry_is_rebuilt(config, tmp_path):
+    entries = build_dataset_cache(config['data_path'], tmp_path, 2, building_ids=['Building_1'])
+    assert len(entries) == 1 and (entries[0] / 'meta.json').exists()
+    series = np.array(np.load(entries[0] / 'series.npy'))
+
+    # An entry written by another version of the cache is not read, but rebuilt from the sources
+    with open(entries[0] / 'meta.json') as json_file:
+        meta = json.load(json_file)
+    meta['fingerprint']['version'] = -1
+    with open(entries[0] / 'meta.json', 'w') as json_file:
+        json.dump(meta, json_file)
+
+    clear_csv_cache()
+    build_dataset_cache(config['data_path'], tmp_path, 2, building_ids=['Building_1'])
+    with open(entries[0] / 'meta.json') as json_file:
+        assert json.load(json_file)['fingerprint']['version'] != -1
+    np.testing.assert_array_equal(np.load(entries[0] / 'series.npy'), series)
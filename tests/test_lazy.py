@@ -0,0 +1,34 @@
+import numpy as np
+from citylearn import CityLearn
+from citylearn.baseline import get_baseline_key
+
+def test_lazy_env_steps_like_eager_env(config):
+    # A simulation period that does not start at 0, so that the window of the lazy mode does not cover the first time steps
+    config = dict(config, simulation_period=(4000, 4048), n_buildings=4)
+    eager, lazy = CityLearn(**config), CityLearn(**config, lazy=True)
+    for building, lazy_building in zip(eager.buildings.values(), lazy.buildings.values()):
+        assert building.cooling_device.nominal_power == lazy_building.cooling_device.nominal_power
+        assert building.cooling_storage.capacity == lazy_building.cooling_storage.capacity
+
+    np.testing.assert_array_equal(eager.reset(), lazy.reset())
+    rng = np.random.default_rng(0)
+    done = False
+    while not done:
+        action = rng.uniform(-0.3, 0.3, eager.action_space.shape)
+        state, reward, done, _ = eager.step(action)
+        lazy_state, lazy_reward, lazy_done, _ = lazy.step(action)
+        np.testing.assert_array_equal(state, lazy_state)
+        assert reward == lazy_reward and done == lazy_done
+    np.testing.assert_array_equal(eager.net_electric_consumption, lazy.net_electric_consumption)
+
+def test_materialize_gives_eager_bounds(config):
+    config = dict(config, simulation_period=(4000, 4048), n_buildings=4)
+    eager, lazy = CityLearn(**config), CityLearn(**config, lazy=True)
+    lazy.simulation_period = (0, 8759)
+    lazy.reset()
+    np.testing.assert_array_equal(eager.observation_space.low, lazy.observation_space.low)
+    np.testing.assert_array_equal(eager.observation_space.high, lazy.observation_space.high)
+
+def test_lazy_env_has_its_own_baseline(config):
+    eager, lazy = CityLearn(**config), CityLearn(**config, lazy=True)
+    assert get_baseline_key(eager.get_baseline_config()) != get_baseline_key(lazy.get_baseline_config())
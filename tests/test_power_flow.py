@@ -0,0 +1,43 @@
+import numpy as np
+import pandapower as pp
+from pandapower import runpp
+from citylearn import GridLearn
+from citylearn.power_flow import RadialPowerFlow
+
+def test_native_power_flow_matches_runpp(config):
+    config = dict(config, simulation_period=(0, 24), n_buildings_per_bus=1, cost_function=['ramping', 'system_losses', 'voltage_dev'])
+    pandapower, native = GridLearn(**config), GridLearn(**config, power_flow_backend='native')
+    pandapower.reset(), native.reset()
+    rng = np.random.default_rng(0)
+    done = False
+    while not done:
+        action = rng.uniform(-0.5, 0.5, pandapower.action_space.shape)
+        _, _, done, _ = pandapower.step(action)
+        native.step(action)
+        np.testing.assert_allclose(native.net.res_bus.vm_pu, pandapower.net.res_bus.vm_pu, rtol=0, atol=1e-5)
+        np.testing.assert_allclose(native.net.res_line.i_ka, pandapower.net.res_line.i_ka, rtol=0, atol=1e-5)
+        np.testing.assert_allclose(native.net.res_load.p_mw, pandapower.net.res_load.p_mw, rtol=0, atol=1e-9)
+    np.testing.assert_allclose(native.system_losses, pandapower.system_losses, rtol=0, atol=1e-5)
+    np.testing.assert_allclose(native.net_electric_consumption, pandapower.net_electric_consumption, rtol=1e-9)
+
+def test_native_power_flow_with_unloaded_bus():
+    # A bus whose load has no power and an undefined constant current fraction (0/0), as a building without demand
+    net = pp.create_empty_network()
+    buses = [pp.create_bus(net, vn_kv=0.4) for _ in range(3)]
+    pp.create_ext_grid(net, buses[0])
+    for from_bus, to_bus in zip(buses[:-1], buses[1:]):
+        pp.create_line(net, from_bus, to_bus, length_km=0.1, std_type='NAYY 4x50 SE')
+    pp.create_load(net, buses[1], p_mw=0.02, q_mvar=0.005, const_i_percent=30)
+    pp.create_load(net, buses[2], p_mw=0, q_mvar=0, const_i_percent=np.nan)
+    pp.create_load(net, buses[2], p_mw=0.01, q_mvar=0.002, const_i_percent=10)
+
+    RadialPowerFlow(net).run()
+    native = {table: net[table].copy() for table in ['res_bus', 'res_line', 'res_load']}
+    assert np.isfinite(native['res_bus'].vm_pu).all()
+
+    # pandapower, with the fraction of the unloaded load set to 0
+    net.load.loc[1, 'const_i_percent'] = 0
+    runpp(net)
+    np.testing.assert_allclose(native['res_bus'].vm_pu, net.res_bus.vm_pu, rtol=0, atol=1e-8)
+    np.testing.assert_allclose(native['res_line'].i_ka, net.res_line.i_ka, rtol=0, atol=1e-8)
+    np.testing.assert_allclose(native['res_load'].p_mw, net.res_load.p_mw, rtol=0, atol=1e-9)
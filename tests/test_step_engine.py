@@ -0,0 +1,72 @@
+import numpy as np
+from citylearn import CityLearn
+
+def get_socs(env):
+    return [(b.cooling_storage._soc, b.dhw_storage._soc, b.cooling_device.time_step, b.dhw_heating_device.time_step) for b in env.buildings.values()]
+
+def test_vectorized_engine_steps_like_objects(config):
+    vectorized, objects = CityLearn(**config), CityLearn(**config, step_engine='object')
+    assert vectorized._step_engine is not None and objects._step_engine is None
+
+    np.testing.assert_array_equal(vectorized.reset(), objects.reset())
+    rng = np.random.default_rng(0)
+    done = False
+    while not done:
+        action = rng.uniform(-0.5, 0.5, vectorized.action_space.shape)
+        state, reward, done, _ = vectorized.step(action)
+        object_state, object_reward, _, _ = objects.step(action)
+        np.testing.assert_allclose(state, object_state, rtol=1e-6)
+        assert get_socs(vectorized) == get_socs(objects)
+    np.testing.assert_array_equal(vectorized.net_electric_consumption, objects.net_electric_consumption)
+
+    # The energy supplied by the devices is recorded as by the objects (e.g. to plot cooling_supply)
+    for building, object_building in zip(vectorized.buildings.values(), objects.buildings.values()):
+        assert len(building.cooling_device.cooling_supply) == len(object_building.cooling_device.cooling_supply) > 0
+        np.testing.assert_allclose(building.cooling_device.cooling_supply, object_building.cooling_device.cooling_supply, rtol=1e-12)
+        np.testing.assert_allclose(building.dhw_heating_device.heat_supply, object_building.dhw_heating_device.heat_supply, rtol=1e-12)
+
+def test_vectorized_engine_steps_like_objects_across_episodes(config):
+    # Episodes long enough for the time steps of the devices that are not reset (electric heaters) to go past the length of the COPs
+    config = dict(config, simulation_period=(0, 4400))
+    vectorized, objects = CityLearn(**config), CityLearn(**config, step_engine='object')
+    for episode in range(2):
+        rng = np.random.default_rng(episode)
+        np.testing.assert_array_equal(vectorized.reset(), objects.reset())
+        done = False
+        while not done:
+            action = rng.uniform(-0.5, 0.5, vectorized.action_space.shape)
+            _, _, done, _ = vectorized.step(action)
+            objects.step(action)
+        assert get_socs(vectorized) == get_socs(objects)
+        np.testing.assert_array_equal(vectorized.net_electric_consumption, objects.net_electric_consumption)
+
+def test_partial_and_full_dict_steps(config):
+    # Steps that give the actions of some of the buildings are run by the objects, the engine must read their state before the next full step
+    vectorized, objects = CityLearn(**config), CityLearn(**config, step_engine='object')
+    vectorized.reset(), objects.reset()
+    uids = list(vectorized.buildings)
+    rng = np.random.default_rng(0)
+    for t in range(12):
+        given = uids if t % 2 == 0 else uids[:1]
+        actions = {uid: rng.uniform(0.2, 0.6, vectorized.action_layout.counts[i]) for i, uid in enumerate(uids) if uid in given}
+        vectorized.step(actions)
+        objects.step(actions)
+        assert get_socs(vectorized) == get_socs(objects)
+    np.testing.assert_array_equal(vectorized.net_electric_consumption, objects.net_electric_consumption)
+
+def test_dict_steps_across_episodes(config):
+    # Actions of decentralized agents ({uid: actions}), for all the buildings or some of them, over episodes longer than the COPs of the devices
+    config = dict(config, simulation_period=(0, 4400))
+    vectorized, objects = CityLearn(**config), CityLearn(**config, step_engine='object')
+    uids = list(vectorized.buildings)
+    for episode in range(2):
+        rng = np.random.default_rng(episode)
+        vectorized.reset(), objects.reset()
+        done = False
+        while not done:
+            given = uids[:1] if vectorized.time_step % 5 == 0 else uids
+            actions = {uid: rng.uniform(-0.5, 0.5, vectorized.action_layout.counts[i]) for i, uid in enumerate(uids) if uid in given}
+            _, _, done, _ = vectorized.step(actions)
+            objects.step(actions)
+        assert get_socs(vectorized) == get_socs(objects)
+        np.testing.assert_array_equal(vectorized.net_electric_consumption, objects.net_electric_consumption)
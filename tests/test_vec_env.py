@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from citylearn import CityVecEnv, SubprocCityVecEnv, get_scenario
+
+@pytest.fixture
+def scenarios(config):
+    # Short episodes, so that the environments are reset by the vector environments. The seeds draw buildings with spaces of different sizes
+    config = dict(config, simulation_period=(0, 10))
+    return [get_scenario(config), get_scenario(config, seed=3)]
+
+def run(venv, steps=25):
+    """ Returns the observations, rewards, dones and terminal observations of random steps """
+    rng = np.random.default_rng(0)
+    results = [venv.reset()]
+    for _ in range(steps):
+        observations, rewards, dones, infos = venv.step(rng.uniform(-0.3, 0.3, (venv.num_envs,) + venv.action_space.shape))
+        terminal = [info.get('terminal_observation', np.zeros(0)) for info in infos]
+        results += [observations, rewards, dones] + terminal
+    return results
+
+def test_subprocess_vec_env_matches_serial(scenarios):
+    serial = CityVecEnv(scenarios)
+    subprocess = SubprocCityVecEnv(scenarios, n_workers=2)
+    try:
+        assert serial.observation_space.shape == subprocess.observation_space.shape
+        assert serial.action_space.shape == subprocess.action_space.shape
+        results, subprocess_results = run(serial), run(subprocess)
+        assert len(results) == len(subprocess_results)
+        for values, subprocess_values in zip(results, subprocess_results):
+            np.testing.assert_array_equal(values, subprocess_values)
+        assert subprocess.get_attr('random_seed') == serial.get_attr('random_seed')
+    finally:
+        serial.close()
+        subprocess.close()
+
+def test_stable_baselines3_learns_on_vec_env(scenarios):
+    stable_baselines3 = pytest.importorskip('stable_baselines3')
+    from stable_baselines3.common.vec_env import VecEnv
+    venv = CityVecEnv(scenarios)
+    assert isinstance(venv, VecEnv)
+    model = stable_baselines3.PPO('MlpPolicy', venv, n_steps=8, batch_size=8, n_epochs=1)
+    model.learn(total_timesteps=32)
+    actions, _ = model.predict(venv.reset())
+    assert actions.shape == (venv.num_envs,) + venv.action_space.shape
@@ -0,0 +1,49 @@
+# Compares the batched upsampling of a building's hourly frame with the former per-column interpolation.
+# Run from the root of the repository: python tests/upsampling_benchmark.py
+import sys
+import time
+import numpy as np
+from pathlib import Path
+
+# citylearn is imported from the repository, which does not need to be installed
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from citylearn.dataset import read_csv_columns, BUILDING_INTERP_COLUMNS, WEATHER_INTERP_COLUMNS
+from citylearn.upsampling import upsample
+
+climate_zone = 1
+data_path = Path("citylearn/data/Climate_Zone_"+str(climate_zone))
+building = read_csv_columns(data_path / 'Building_1.csv')
+weather = read_csv_columns(data_path / 'weather_data.csv')
+columns = [building[c] for c in BUILDING_INTERP_COLUMNS.values()] + [weather[c] for c in WEATHER_INTERP_COLUMNS.values()]
+frame = np.column_stack(columns)
+repeats = 20
+
+def per_column(hourly_timesteps):
+    # Former path: one np.interp call per column, each with its own grid
+    series = []
+    for hourly_data in columns:
+        n = len(hourly_data)
+        series.append(list(np.interp(np.linspace(0, n, n*hourly_timesteps), np.arange(n), hourly_data)))
+    return series
+
+for hourly_timesteps in [1, 4, 12, 60]:
+    start = time.time()
+    for _ in range(repeats):
+        reference = per_column(hourly_timesteps)
+    per_column_time = (time.time() - start)/repeats
+
+    start = time.time()
+    for _ in range(repeats):
+        batched = upsample(frame, hourly_timesteps, 'linear')
+    batched_time = (time.time() - start)/repeats
+
+    assert np.array_equal(np.array(reference).T, batched), 'batched interpolation differs from np.interp'
+    print('hourly_timesteps = {:2d}: per-column {:7.2f} ms, batched {:7.2f} ms ({:.1f}x)'.format(
+        hourly_timesteps, per_column_time*1000, batched_time*1000, per_column_time/batched_time))
+
+for method in ['repeat', 'noisy', 'spline']:
+    start = time.time()
+    for _ in range(repeats):
+        upsample(frame, 4, method)
+    print('{:>10}: {:7.2f} ms for {} columns'.format(method, (time.time() - start)/repeats*1000, frame.shape[1]))